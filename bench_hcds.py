@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+#
+# Benchmark of the responders of the HTTP Collision Data Server (HCDS)
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import fnmatch
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.parse
+import wsgiref.util
+
+import numpy
+import yaml
+
+import hcds_config
+
+# Parameters of the collision used for all the requests to the "coll" module
+COLL_PARAMS = {
+	"model": "c2019",
+	"mtar_value": 1.,
+	"mtar_unit": "earth",
+	"mimp_value": 0.5,
+	"mimp_unit": "earth",
+	"vel_value": 2.,
+	"vel_unit": "escape",
+	"angle_value": 30.,
+}
+
+COLL_QUANTS = [ "regime", "acclr", "accsr", "acctr" ]
+COLL_FORMATS = [ "jsoncheck", "jsondata", "jsonpoly", "jsonsvg", "svg", "pdf", "png", "jpg" ]
+
+def make_set_file( path, groups, size ):
+	'''
+	Write an HDF5 file with the layout expected by the "sph" module.
+
+	- path: Name of the file
+	- groups: Number of groups, each one corresponding to a series
+	- size: Number of points in each series
+	'''
+
+	import tables
+
+	rng = numpy.random.default_rng( 1 )
+
+	with tables.open_file( path, "w" ) as h5file:
+		for n in range( groups ):
+			group = h5file.create_group( h5file.root, "file_{:03d}".format( n ) )
+			group._v_attrs[ "desc" ] = "Series {:d}".format( n )
+
+			h5file.create_array( group, "time", numpy.linspace( 0., 1.e4, size ) )
+			h5file.create_array( group, "mass", rng.uniform( 0.5, 1., size ) )
+			h5file.create_array( group, "radius", rng.uniform( 0.5, 1., size ) )
+
+def make_db_file( path, sims, size ):
+	'''
+	Write an HDF5 file with the layout expected by the "db" module.
+
+	- path: Name of the file
+	- sims: Number of simulations in the database
+	- size: Number of points in the time series of each simulation
+	'''
+
+	import tables
+
+	rng = numpy.random.default_rng( 2 )
+
+	with tables.open_file( path, "w" ) as h5file:
+		base = h5file.create_group( h5file.root, "base" )
+		h5file.create_array( base, "id", numpy.arange( sims, dtype = numpy.int64 ) )
+		h5file.create_array( base, "mtar", rng.uniform( 0.1, 1., sims ) )
+		h5file.create_array( base, "mimp", rng.uniform( 0.01, 0.1, sims ) )
+		h5file.create_array( base, "vel", rng.uniform( 1., 4., sims ) )
+		h5file.create_array( base, "angle", rng.uniform( 0., 90., sims ) )
+
+		for n in range( sims ):
+			group = h5file.create_group( h5file.root, "sim_{:03d}".format( n ) )
+
+			h5file.create_array( group, "time", numpy.linspace( 0., 1.e4, size ) )
+			h5file.create_array( group, "mlr", rng.uniform( 0.5, 1., size ) )
+			h5file.create_array( group, "mslr", rng.uniform( 0., 0.5, size ) )
+
+def setup( dir, args ):
+	'''
+	Create the data files and set the configuration of the modules that are benchmarked.
+	Returns the list of scenarios, each as a tuple of the name, the path and the query string.
+
+	- dir: Directory where to write the data files
+	- args: Command-line arguments
+	'''
+
+	make_set_file( os.path.join( dir, "set.h5" ), args.groups, args.size )
+	make_db_file( os.path.join( dir, "db.h5" ), args.sims, args.size )
+
+	# The definitions are written to YAML files, as in production
+	sph_defs = {
+		"set": {
+			"file": "set.h5",
+			"desc": "Synthetic set",
+			"fields": [
+				{ "data": "time / 3600", "value": "Time", "unit": "h" },
+				{ "data": "mass", "value": "Mass", "unit": "Total" },
+				{ "data": "mass / ( radius * radius * radius )", "value": "Density", "unit": "Relative" },
+			],
+		},
+	}
+	db_defs = {
+		"db": {
+			"file": "db.h5",
+			"desc": "Synthetic database",
+			"base_fields": [
+				{ "name": "id", "data": "id", "desc": "Identifier", "format": "d" },
+				{ "name": "ratio", "data": "mimp / mtar", "desc": "Mass ratio", "format": ".3f" },
+				{ "name": "vel", "data": "vel", "desc": "Velocity", "format": ".2f" },
+				{ "name": "angle", "data": "angle", "desc": "Angle", "format": ".0f" },
+			],
+			"fields": [
+				{ "name": "time", "data": "time / 3600" },
+				{ "name": "mlr", "data": "mlr" },
+				{ "name": "mslr", "data": "mslr" },
+			],
+			"plots": [],
+		},
+	}
+
+	for name, defs in [ ( "set.yaml", sph_defs ), ( "db.yaml", db_defs ) ]:
+		with open( os.path.join( dir, name ), "w" ) as f:
+			yaml.dump( defs, f )
+
+	hcds_config.MODS = {
+		"coll": ( "coll", { "usetex": False } ),
+		"sph": ( "sph", { "dir": dir, "file": "set.yaml" } ),
+		"db": ( "db", { "dir": dir, "file": "db.yaml" } ),
+	}
+	hcds_config.REQUEST_LOG = None
+	hcds_config.METRICS_DIR = None
+	hcds_config.PROFILE_TOKEN = None
+	hcds_config.PROFILE_DIR = None
+
+	scenarios = [ ( "coll/single", "coll/single", urllib.parse.urlencode( COLL_PARAMS ) ) ]
+
+	for quant in COLL_QUANTS:
+		for format in COLL_FORMATS:
+			params = dict( COLL_PARAMS, quant = quant, format = format )
+			scenarios.append( ( "coll/grid/{:s}/{:s}".format( quant, format ), "coll/grid", urllib.parse.urlencode( params ) ) )
+
+			if format in [ "png", "jpg" ]:
+				params[ "render" ] = "raster"
+				scenarios.append( ( "coll/grid/{:s}/{:s}-raster".format( quant, format ), "coll/grid", urllib.parse.urlencode( params ) ) )
+
+	scenarios.append( ( "sph/set", "sph/set", "" ) )
+	scenarios.append( ( "db/db", "db/db", "" ) )
+	scenarios.append( ( "db/db/0", "db/db/0", "" ) )
+
+	return scenarios
+
+def call( path, query ):
+	'''
+	Send one GET request to hcds_app.
+	Returns the status and the size of the body.
+
+	- path: Path of the request relative to BASE_PATH
+	- query: Query string of the request
+	'''
+
+	import main
+
+	environ = {}
+	wsgiref.util.setup_testing_defaults( environ )
+	environ[ "PATH_INFO" ] = hcds_config.BASE_PATH + path
+	environ[ "QUERY_STRING" ] = query
+	environ[ "wsgi.input" ] = io.BytesIO()
+
+	status = []
+	out = main.hcds_app( environ, lambda cur, headers: status.append( cur ) )
+
+	return status[ 0 ], sum( [ len( item ) for item in out ] )
+
+def percentile( values, q ):
+	return float( numpy.percentile( values, q ) ) * 1.e3
+
+def run( name, path, query, args ):
+	'''
+	Benchmark one scenario.
+	Returns a dictionary with the results.
+
+	- name: Name of the scenario
+	- path: Path of the request relative to BASE_PATH
+	- query: Query string of the request
+	- args: Command-line arguments
+	'''
+
+	# The first request also checks that the scenario is valid
+	for i in range( max( args.warmup, 1 ) ):
+		status, size = call( path, query )
+
+	if not status.startswith( "200" ):
+		raise RuntimeError( "{:s}: unexpected status {:s}".format( name, status ) )
+
+	durations = []
+	begin = time.perf_counter()
+	while len( durations ) < args.repeat or ( time.perf_counter() - begin < args.min_time and len( durations ) < args.max_repeat ):
+		start = time.perf_counter()
+		call( path, query )
+		durations.append( time.perf_counter() - start )
+	total = time.perf_counter() - begin
+
+	# Memory is measured in a separate call since tracing slows down the requests
+	tracemalloc.start()
+	call( path, query )
+	current, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	return {
+		"count": len( durations ),
+		"throughput": len( durations ) / total,
+		"p50": percentile( durations, 50 ),
+		"p90": percentile( durations, 90 ),
+		"p99": percentile( durations, 99 ),
+		"max": max( durations ) * 1.e3,
+		"peak_mem": peak / 1048576.,
+		"bytes": size,
+	}
+
+def compare( results, baseline, tolerance ):
+	'''
+	Compare the results with a baseline.
+	Returns the list of the names of the scenarios whose median latency or peak memory increased by more than the tolerance.
+
+	- results: Results of the current run
+	- baseline: Results of the baseline run
+	- tolerance: Maximum relative increase
+	'''
+
+	regressions = []
+
+	for name, cur in results.items():
+		if not name in baseline:
+			continue
+
+		ref = baseline[ name ]
+		for key in [ "p50", "peak_mem" ]:
+			if ref[ key ] > 0. and cur[ key ] > ref[ key ] * ( 1. + tolerance ):
+				regressions.append( "{:s} ({:s}: {:.3f} -> {:.3f})".format( name, key, ref[ key ], cur[ key ] ) )
+
+	return regressions
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser( description = "Benchmark the HCDS responders with synthetic requests and data." )
+	parser.add_argument( "--only", action = "append", help = "Only run the scenarios matching this shell pattern; can be given multiple times" )
+	parser.add_argument( "--repeat", type = int, default = 5, help = "Minimum number of timed requests for each scenario" )
+	parser.add_argument( "--max-repeat", type = int, default = 1000, help = "Maximum number of timed requests for each scenario" )
+	parser.add_argument( "--min-time", type = float, default = 1., help = "Minimum time in seconds spent on each scenario" )
+	parser.add_argument( "--warmup", type = int, default = 1, help = "Number of untimed requests before each scenario" )
+	parser.add_argument( "--size", type = int, default = 1000, help = "Number of points in each series of the synthetic HDF5 files" )
+	parser.add_argument( "--groups", type = int, default = 10, help = "Number of series in the synthetic file of the \"sph\" module" )
+	parser.add_argument( "--sims", type = int, default = 100, help = "Number of simulations in the synthetic file of the \"db\" module" )
+	parser.add_argument( "--save", help = "Write the results to this JSON file" )
+	parser.add_argument( "--baseline", help = "Compare the results with this JSON file, as written by --save" )
+	parser.add_argument( "--tolerance", type = float, default = 0.2, help = "Maximum relative increase of the median latency and peak memory compared to the baseline" )
+	parser.add_argument( "--list", action = "store_true", help = "List the scenarios and exit" )
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as dir:
+		scenarios = setup( dir, args )
+
+		if not args.only is None:
+			scenarios = [ item for item in scenarios if any( [ fnmatch.fnmatchcase( item[ 0 ], pattern ) for pattern in args.only ] ) ]
+
+		if args.list:
+			for name, path, query in scenarios:
+				print( name )
+			sys.exit( 0 )
+
+		results = {}
+
+		print( "{:40s} {:>6s} {:>9s} {:>9s} {:>9s} {:>9s} {:>9s} {:>9s}".format( "scenario", "count", "req/s", "p50 ms", "p90 ms", "p99 ms", "max ms", "peak MiB" ) )
+		for name, path, query in scenarios:
+			res = run( name, path, query, args )
+			results[ name ] = res
+
+			print( "{:40s} {:6d} {:9.2f} {:9.3f} {:9.3f} {:9.3f} {:9.3f} {:9.3f}".format( name, res[ "count" ], res[ "throughput" ], res[ "p50" ], res[ "p90" ], res[ "p99" ], res[ "max" ], res[ "peak_mem" ] ) )
+
+	if not args.save is None:
+		with open( args.save, "w" ) as f:
+			json.dump( { "size": args.size, "groups": args.groups, "sims": args.sims, "results": results }, f, indent = "\t" )
+
+	if not args.baseline is None:
+		with open( args.baseline, "r" ) as f:
+			baseline = json.load( f )
+
+		if ( baseline[ "size" ], baseline[ "groups" ], baseline[ "sims" ] ) != ( args.size, args.groups, args.sims ):
+			print( "Warning: the baseline was run with different data sizes", file = sys.stderr )
+
+		regressions = compare( results, baseline[ "results" ], args.tolerance )
+		if len( regressions ):
+			print( "Regressions compared to the baseline:" )
+			for item in regressions:
+				print( "  " + item )
+			sys.exit( 1 )
+
+		print( "No regression compared to the baseline." )
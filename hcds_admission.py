@@ -0,0 +1,220 @@
+# HTTP Collision Data Server (HCDS) admission control of the requests.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import fcntl
+import os
+import threading
+import time
+
+import hcds_config
+import hcds_exception
+
+class LocalLimiter( object ):
+	'''
+	Limit of the number of concurrent requests within the current process.
+	'''
+
+	def __init__( self, slots, queue ):
+		'''
+		- slots: Number of requests that can be handled at the same time
+		- queue: Number of requests that can wait for a slot
+		'''
+
+		self.slots = slots
+		self.queue = queue
+		self.cond = threading.Condition()
+		self.active = 0
+		self.waiting = 0
+
+	def acquire( self, timeout ):
+		'''
+		Wait for a slot to be available.
+		Returns a token to pass to release(), or None if the request is rejected.
+
+		- timeout: Maximum time to wait, in seconds
+		'''
+
+		with self.cond:
+			if self.active < self.slots:
+				self.active += 1
+				return True
+
+			if self.waiting >= self.queue:
+				return None
+
+			self.waiting += 1
+			try:
+				if not self.cond.wait_for( lambda: self.active < self.slots, timeout ):
+					return None
+
+				self.active += 1
+				return True
+			finally:
+				self.waiting -= 1
+
+	def release( self, token ):
+		with self.cond:
+			self.active -= 1
+			self.cond.notify()
+
+class FileLimiter( object ):
+	'''
+	Limit of the number of concurrent requests over all the processes of the host.
+	Each slot, and each place in the queue, is a file locked by the process that uses it.
+	'''
+
+	# Time between two attempts to get a slot while waiting in the queue
+	POLL = 0.01
+
+	def __init__( self, path, name, slots, queue ):
+		'''
+		- path: Directory of the lock files
+		- name: Name of the class of requests
+		- slots: Number of requests that can be handled at the same time
+		- queue: Number of requests that can wait for a slot
+		'''
+
+		os.makedirs( path, exist_ok = True )
+
+		self.slots = [ os.path.join( path, "{:s}.slot.{:d}".format( name, i ) ) for i in range( slots ) ]
+		self.queue = [ os.path.join( path, "{:s}.queue.{:d}".format( name, i ) ) for i in range( queue ) ]
+
+	def lock_any( self, names ):
+		'''
+		Lock the first available file of a list.
+		Returns the file descriptor of the locked file, or None if all of them are in use.
+
+		- names: Names of the files
+		'''
+
+		for name in names:
+			fd = os.open( name, os.O_RDWR | os.O_CREAT, 0o644 )
+
+			try:
+				fcntl.flock( fd, fcntl.LOCK_EX | fcntl.LOCK_NB )
+				return fd
+			except OSError:
+				os.close( fd )
+
+		return None
+
+	def acquire( self, timeout ):
+		'''
+		Wait for a slot to be available.
+		Returns a token to pass to release(), or None if the request is rejected.
+
+		- timeout: Maximum time to wait, in seconds
+		'''
+
+		fd = self.lock_any( self.slots )
+		if not fd is None:
+			return fd
+
+		place = self.lock_any( self.queue )
+		if place is None:
+			return None
+
+		try:
+			deadline = time.monotonic() + timeout
+			while time.monotonic() < deadline:
+				time.sleep( self.POLL )
+
+				fd = self.lock_any( self.slots )
+				if not fd is None:
+					return fd
+
+			return None
+		finally:
+			os.close( place )
+
+	def release( self, token ):
+		# Closing the file releases the lock
+		os.close( token )
+
+limiters = {}
+
+def get_limiter( route_class ):
+	'''
+	Get the limiter of a class of requests, or None if the class is not limited.
+
+	- route_class: Name of the class, as returned by BaseResponder.get_route_class()
+	'''
+
+	if not route_class in hcds_config.ADMISSION:
+		return None
+
+	if not route_class in limiters:
+		config = hcds_config.ADMISSION[ route_class ]
+
+		if hcds_config.ADMISSION_DIR is None:
+			limiters[ route_class ] = LocalLimiter( config[ "slots" ], config.get( "queue", 0 ) )
+		else:
+			limiters[ route_class ] = FileLimiter( hcds_config.ADMISSION_DIR, route_class, config[ "slots" ], config.get( "queue", 0 ) )
+
+	return limiters[ route_class ]
+
+def acquire( route_class, responder ):
+	'''
+	Wait for the request to be allowed to run.
+	Returns a tuple of the limiter and the token of the slot to pass to release(), or None if the class is not limited.
+	hcds_exception.ServiceUnavailable is raised if all the slots and places in the queue of the class are used, or if the request waited for too long.
+	The waiting time is added to the "queue" timing of the responder.
+
+	- route_class: Name of the class of the request, as returned by BaseResponder.get_route_class()
+	- responder: The hcds_responder_base.BaseResponder object that handles the request
+	'''
+
+	limiter = get_limiter( route_class )
+
+	if limiter is None:
+		return None
+
+	config = hcds_config.ADMISSION[ route_class ]
+
+	with responder.timing( "queue" ):
+		token = limiter.acquire( config.get( "timeout", 10. ) )
+
+	if token is None:
+		raise hcds_exception.ServiceUnavailable( config.get( "retry_after", 5 ) )
+
+	return limiter, token
+
+def release( admission ):
+	'''
+	Release the slot of a request.
+
+	- admission: Value returned by acquire()
+	'''
+
+	if not admission is None:
+		admission[ 0 ].release( admission[ 1 ] )
+
+@contextlib.contextmanager
+def admit( route_class, responder ):
+	'''
+	Wait for the request to be allowed to run, to be used in a "with" statement; see acquire().
+
+	- route_class: Name of the class of the request, as returned by BaseResponder.get_route_class()
+	- responder: The hcds_responder_base.BaseResponder object that handles the request
+	'''
+
+	admission = acquire( route_class, responder )
+
+	try:
+		yield
+	finally:
+		release( admission )
@@ -0,0 +1,92 @@
+# HTTP Collision Data Server (HCDS) in-memory caches.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import json
+import threading
+
+def make_key( *parts ):
+	'''
+	Build a cache key from a set of normalized parameters.
+	The parameters must be serializable to JSON; dictionaries are sorted so that the key does not depend on the insertion order.
+	'''
+
+	return json.dumps( parts, sort_keys = True )
+
+class LRUCache( object ):
+	'''
+	Mapping with a bounded number of entries, where the least recently used entry is evicted first.
+	'''
+
+	def __init__( self, size ):
+		'''
+		- size: Maximum number of entries kept in the cache
+		'''
+
+		self.size = size
+		self.data = collections.OrderedDict()
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	def get( self, key, default = None ):
+		'''
+		Retrieve an entry from the cache.
+
+		- key: Key of the entry
+		- default: Value to return if the entry is not in the cache
+		'''
+
+		with self.lock:
+			if key in self.data:
+				self.data.move_to_end( key )
+				self.hits += 1
+				return self.data[ key ]
+
+			self.misses += 1
+			return default
+
+	def put( self, key, value ):
+		'''
+		Add or replace an entry in the cache.
+
+		- key: Key of the entry
+		- value: Value to store
+		'''
+
+		if self.size <= 0:
+			return
+
+		with self.lock:
+			self.data[ key ] = value
+			self.data.move_to_end( key )
+
+			while len( self.data ) > self.size:
+				self.data.popitem( last = False )
+
+	def clear( self ):
+		'''
+		Remove all entries from the cache.
+		'''
+
+		with self.lock:
+			self.data.clear()
+
+	def __contains__( self, key ):
+		return key in self.data
+
+	def __len__( self ):
+		return len( self.data )
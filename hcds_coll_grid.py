@@ -0,0 +1,116 @@
+# HTTP Collision Data Server (HCDS) maps of outcomes of collisions.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy
+
+# Names of the quantities of a map
+QUANTS = [ "regime", "acclr", "accsr", "acctr" ]
+
+# Regime for which the second remnant is defined (hit and run)
+REGIME_HIT_AND_RUN = 5
+
+class GridResult( object ):
+	'''
+	Outcome of collisions over a grid of impact angles and velocities, stored compactly.
+	The regime is stored as int8 and the accretion efficiencies as float32, with a mask of the points where the outcome was obtained.
+	The maps may be stacked along a first axis, for instance one for each model, see stack().
+	'''
+
+	def __init__( self, x, y, regime, acclr, accsr, acctr, valid ):
+		'''
+		- x: Impact angles in degrees
+		- y: Impact velocities relative to the mutual escape velocity
+		- regime, acclr, accsr, acctr: Values of the quantities, with shape ( len( y ), len( x ) ) or ( count, len( y ), len( x ) ) for stacked maps
+		- valid: Boolean array of the same shape, false where the outcome could not be obtained
+		'''
+
+		self.x = x
+		self.y = y
+		self.regime = numpy.asarray( regime, dtype = numpy.int8 )
+		self.acclr = numpy.asarray( acclr, dtype = numpy.float32 )
+		self.accsr = numpy.asarray( accsr, dtype = numpy.float32 )
+		self.acctr = numpy.asarray( acctr, dtype = numpy.float32 )
+		self.valid = numpy.asarray( valid, dtype = bool )
+
+	def is_stacked( self ):
+		'''
+		Check whether the result has several maps stacked along a first axis.
+		'''
+
+		return self.regime.ndim == 3
+
+	def get( self, quant ):
+		'''
+		Get the values of one quantity as used by the renderers and sent to the callers.
+		Invalid points are set to 0, and the efficiency of the second remnant is set to -1.1 where there is none, below the range of the color scale.
+
+		- quant: Name of the quantity, one of QUANTS
+		'''
+
+		if quant == "regime":
+			return numpy.where( self.valid, self.regime, 0 ).astype( numpy.int8 )
+
+		values = getattr( self, quant )
+
+		if quant == "accsr":
+			values = numpy.where( self.regime == REGIME_HIT_AND_RUN, values, numpy.float32( -1.1 ) )
+
+		return numpy.where( self.valid & numpy.isfinite( values ), values, numpy.float32( 0. ) )
+
+	def get_arrays( self ):
+		'''
+		Get the arrays of the result, as a dictionary that can be saved with numpy.savez(), see from_arrays().
+		'''
+
+		return { "x": self.x, "y": self.y, "regime": self.regime, "acclr": self.acclr, "accsr": self.accsr, "acctr": self.acctr, "valid": self.valid }
+
+	def freeze( self ):
+		'''
+		Make the arrays read-only, so that a result kept in a cache cannot be modified by its users.
+		'''
+
+		for array in self.get_arrays().values():
+			array.setflags( write = False )
+
+def empty( x, y ):
+	'''
+	Create a result where all the points are invalid, to be filled.
+
+	- x: Impact angles in degrees
+	- y: Impact velocities relative to the mutual escape velocity
+	'''
+
+	shape = ( len( y ), len( x ) )
+
+	return GridResult( x, y, numpy.zeros( shape, numpy.int8 ), numpy.zeros( shape, numpy.float32 ), numpy.zeros( shape, numpy.float32 ), numpy.zeros( shape, numpy.float32 ), numpy.zeros( shape, bool ) )
+
+def from_arrays( arrays ):
+	'''
+	Create a result from its arrays, as returned by GridResult.get_arrays().
+
+	- arrays: Dictionary of arrays
+	'''
+
+	return GridResult( arrays[ "x" ], arrays[ "y" ], arrays[ "regime" ], arrays[ "acclr" ], arrays[ "accsr" ], arrays[ "acctr" ], arrays[ "valid" ] )
+
+def stack( results ):
+	'''
+	Stack maps computed over the same grid into one result.
+
+	- results: List of GridResult objects
+	'''
+
+	return GridResult( results[ 0 ].x, results[ 0 ].y, *[ numpy.stack( [ getattr( result, name ) for result in results ] ) for name in QUANTS + [ "valid" ] ] )
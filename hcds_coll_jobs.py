@@ -0,0 +1,270 @@
+# HTTP Collision Data Server (HCDS) background jobs of the collresolve module.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import concurrent.futures
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+
+import numpy
+
+class JobStore( object ):
+	'''
+	Jobs run by a pool of background threads, whose state and results are kept in a directory.
+	Each job is described by a specification, which must be serializable to JSON so that the job can be run again by another worker if the one that ran it stopped.
+	The worker that runs a job holds a lock on its file, which tells the other workers that the job is not abandoned.
+	'''
+
+	# Minimum time between two writes of the progress of a job, in seconds
+	PROGRESS_INTERVAL = 0.5
+
+	def __init__( self, path, run, workers = 1, ttl = 86400., max_pending = None ):
+		'''
+		- path: Directory of the job files
+		- run: Function that runs a job, called with the specification and a function to report the progress as ( done, total ).
+		       It returns a tuple of a JSON-serializable object and a dictionary of numpy arrays, which form the result of the job.
+		- workers: Number of jobs run at the same time by this worker
+		- ttl: Time after which finished jobs are removed, in seconds
+		- max_pending: Maximum number of jobs queued or running in the directory, over all the workers, or None for no limit
+		'''
+
+		os.makedirs( path, exist_ok = True )
+
+		self.path = path
+		self.run = run
+		self.ttl = ttl
+		self.max_pending = max_pending
+		self.executor = concurrent.futures.ThreadPoolExecutor( max_workers = workers )
+
+	def get_file( self, id, ext ):
+		return os.path.join( self.path, id + ext )
+
+	def is_valid_id( self, id ):
+		'''
+		Check that a string is a job identifier, so that it can safely be used in file names.
+
+		- id: String to check
+		'''
+
+		return len( id ) == 32 and all( [ c in "0123456789abcdef" for c in id ] )
+
+	def read_status( self, id ):
+		'''
+		Get the state of a job, or None if it does not exist.
+		This is a dictionary with the following items:
+		- id: Identifier of the job
+		- state: One of "queued", "running", "done" or "failed"
+		- spec: Specification of the job
+		- done, total: Progress of the job, as reported by the job itself; total is None until the job started
+		- created, started, finished: Time of the changes of state, as UNIX timestamps, or None
+		- result: Object returned by the job, once it is done
+		- error: Description of the error, if the job failed
+
+		- id: Identifier of the job
+		'''
+
+		if not self.is_valid_id( id ):
+			return None
+
+		try:
+			with open( self.get_file( id, ".json" ), "r" ) as f:
+				return json.load( f )
+		except ( OSError, ValueError ):
+			return None
+
+	def write_status( self, status ):
+		'''
+		Save the state of a job; the file is replaced at once so that readers never see a partial state.
+
+		- status: State of the job, see read_status()
+		'''
+
+		name = self.get_file( status[ "id" ], ".json" )
+		tmp = name + ".{:d}.{:d}.tmp".format( os.getpid(), threading.get_ident() )
+
+		with open( tmp, "w" ) as f:
+			json.dump( status, f )
+
+		os.replace( tmp, name )
+
+	def read_result( self, id ):
+		'''
+		Get the arrays produced by a job, or None if it is not done.
+
+		- id: Identifier of the job
+		'''
+
+		if not self.is_valid_id( id ):
+			return None
+
+		try:
+			with numpy.load( self.get_file( id, ".npz" ) ) as data:
+				return { key: data[ key ] for key in data.files }
+		except OSError:
+			return None
+
+	def lock_job( self, id ):
+		'''
+		Lock the file of a job.
+		Returns the file descriptor, or None if another worker holds the lock.
+
+		- id: Identifier of the job
+		'''
+
+		fd = os.open( self.get_file( id, ".lock" ), os.O_RDWR | os.O_CREAT, 0o644 )
+
+		try:
+			fcntl.flock( fd, fcntl.LOCK_EX | fcntl.LOCK_NB )
+			return fd
+		except OSError:
+			os.close( fd )
+			return None
+
+	def count_pending( self ):
+		'''
+		Get the number of jobs that are queued or running.
+		'''
+
+		count = 0
+
+		for entry in os.scandir( self.path ):
+			if not entry.name.endswith( ".json" ):
+				continue
+
+			status = self.read_status( entry.name[ : -5 ] )
+			if not status is None and ( status[ "state" ] == "queued" or status[ "state" ] == "running" ):
+				count += 1
+
+		return count
+
+	def submit( self, spec ):
+		'''
+		Add a job to the queue.
+		Returns its state, see read_status(), or None if there are already max_pending jobs queued or running.
+
+		- spec: Specification of the job
+		'''
+
+		self.expire()
+
+		status = { "id": uuid.uuid4().hex, "state": "queued", "spec": spec, "done": 0, "total": None, "created": time.time(), "started": None, "finished": None, "result": None, "error": None }
+
+		# The workers count the pending jobs and add theirs one at a time
+		lock = os.open( os.path.join( self.path, "submit.lock" ), os.O_RDWR | os.O_CREAT, 0o644 )
+
+		try:
+			fcntl.flock( lock, fcntl.LOCK_EX )
+
+			if not self.max_pending is None and self.count_pending() >= self.max_pending:
+				return None
+
+			fd = self.lock_job( status[ "id" ] )
+			self.write_status( status )
+		finally:
+			# Closing the file releases the lock
+			os.close( lock )
+
+		# The job changes its own copy of the state
+		self.executor.submit( self.execute, dict( status ), fd )
+
+		return status
+
+	def resume( self ):
+		'''
+		Queue again the jobs that did not finish and that are not run by another worker, for instance after a restart.
+		'''
+
+		for entry in os.scandir( self.path ):
+			if not entry.name.endswith( ".json" ):
+				continue
+
+			status = self.read_status( entry.name[ : -5 ] )
+			if status is None or status[ "state" ] == "done" or status[ "state" ] == "failed":
+				continue
+
+			fd = self.lock_job( status[ "id" ] )
+			if not fd is None:
+				status[ "state" ] = "queued"
+				self.write_status( status )
+				self.executor.submit( self.execute, status, fd )
+
+	def execute( self, status, fd ):
+		'''
+		Run a job in one of the threads of the pool.
+
+		- status: State of the job, see read_status()
+		- fd: File descriptor of the lock of the job
+		'''
+
+		last = [ 0. ]
+
+		def progress( done, total ):
+			status[ "done" ] = done
+			status[ "total" ] = total
+
+			now = time.monotonic()
+			if now - last[ 0 ] >= self.PROGRESS_INTERVAL:
+				last[ 0 ] = now
+				self.write_status( status )
+
+		try:
+			status[ "state" ] = "running"
+			status[ "started" ] = time.time()
+			self.write_status( status )
+
+			result, arrays = self.run( status[ "spec" ], progress )
+
+			name = self.get_file( status[ "id" ], ".npz" )
+			tmp = name + ".{:d}.{:d}.tmp.npz".format( os.getpid(), threading.get_ident() )
+			numpy.savez( tmp, **arrays )
+			os.replace( tmp, name )
+
+			status[ "state" ] = "done"
+			status[ "result" ] = result
+		except Exception as ex:
+			status[ "state" ] = "failed"
+			status[ "error" ] = str( ex )
+		finally:
+			status[ "finished" ] = time.time()
+			self.write_status( status )
+
+			# Closing the file releases the lock
+			os.close( fd )
+
+	def expire( self ):
+		'''
+		Remove the files of the jobs that finished more than the time-to-live ago.
+		'''
+
+		now = time.time()
+
+		for entry in os.scandir( self.path ):
+			if not entry.name.endswith( ".json" ):
+				continue
+
+			id = entry.name[ : -5 ]
+			status = self.read_status( id )
+			if status is None or status[ "finished" ] is None or now - status[ "finished" ] <= self.ttl:
+				continue
+
+			for ext in [ ".npz", ".lock", ".json" ]:
+				try:
+					os.remove( self.get_file( id, ext ) )
+				except OSError:
+					pass
@@ -0,0 +1,493 @@
+# HTTP Collision Data Server (HCDS) plotting of collresolve maps.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import inspect
+
+import numpy
+import contourpy
+import PIL.Image
+import matplotlib
+matplotlib.use( "agg" )
+import matplotlib.artist
+import matplotlib.cm
+import matplotlib.colorbar
+import matplotlib.colors
+import matplotlib.figure
+import matplotlib.backends.backend_agg
+
+import mpl_tune
+
+# Color bars are always filled in recent versions of matplotlib, which do not accept the argument anymore
+COLORBAR_ARGS = { "filled": True } if "filled" in inspect.signature( matplotlib.colorbar.Colorbar.__init__ ).parameters else {}
+
+def get_style( quant ):
+	'''
+	Get the color scale definition for a given quantity.
+
+	- quant: Name of the quantity, one of "regime", "acclr", "accsr" or "acctr"
+	'''
+
+	if quant == "regime":
+		return {
+			"vmin": 0.5,
+			"vmax": 5.5,
+			"levels": [ 0.5, 1.5, 2.5, 3.5, 4.5, 5.5 ],
+			"boundaries": [ 0.5, 1.5, 2.5, 3.5, 4.5, 5.5 ],
+			"values": [ 1., 2., 3., 4., 5. ],
+			"label": "Collision regime",
+			"ticks": [ 1., 2., 3., 4., 5. ],
+			"ticklabels": [ "Accretion", "Erosion", "Super cat.", "Graze and Merge", "Hit and Run" ],
+		}
+
+	levels = [ -100., -1.05, -0.95, -0.85, -0.75, -0.65, -0.55, -0.45, -0.35, -0.25, -0.15, -0.05, 0.05, 0.15, 0.25, 0.35, 0.45, 0.55, 0.65, 0.75, 0.85, 0.95, 1.05, 100. ]
+
+	if quant == "acclr":
+		label = "Accretion efficiency of largest remnant"
+	elif quant == "accsr":
+		label = "Accretion efficiency of second remnant"
+	else:
+		label = "Accretion efficiency of debris"
+
+	return {
+		"vmin": -1.,
+		"vmax": 1.,
+		"levels": levels,
+		"boundaries": levels[ 1 : -1 ],
+		"values": None,
+		"label": label,
+		"ticks": [ -1., -0.5, 0., 0.5, 1. ],
+		"ticklabels": None,
+	}
+
+def get_cmap():
+	'''
+	Get the color map used for all the maps.
+	'''
+
+	return matplotlib.colormaps[ "RdBu" ].with_extremes( under = "black", bad = "black" )
+
+def remove_contours( contours ):
+	'''
+	Remove a set of filled contours from the axes it was drawn into.
+
+	- contours: matplotlib.contour.ContourSet object
+	'''
+
+	# Since matplotlib 3.8, the ContourSet is itself an artist
+	if isinstance( contours, matplotlib.artist.Artist ):
+		contours.remove()
+	else:
+		for coll in contours.collections:
+			coll.remove()
+
+def get_layer_colors( style, cmap ):
+	'''
+	Get the color of each interval between two successive levels, as used for filled contours.
+	Returns an array of RGBA bytes with one row per interval.
+
+	- style: Color scale definition, as returned by get_style()
+	- cmap: Color map
+	'''
+
+	levels = numpy.asarray( style[ "levels" ] )
+	layers = 0.5 * ( levels[ 1 : ] + levels[ : -1 ] )
+
+	norm = matplotlib.colors.Normalize( vmin = style[ "vmin" ], vmax = style[ "vmax" ] )
+
+	return cmap( norm( layers ), bytes = True )
+
+def map_colors( z, style, cmap ):
+	'''
+	Map values to colors in the same way as filled contours drawn with the given style.
+	Returns an array of RGBA bytes of shape z.shape + ( 4, ); values outside the levels are white, like the background of the axes.
+
+	- z: Array of values
+	- style: Color scale definition, as returned by get_style()
+	- cmap: Color map
+	'''
+
+	levels = numpy.asarray( style[ "levels" ] )
+	layers = get_layer_colors( style, cmap )
+	table = numpy.concatenate( [ layers, [ [ 255, 255, 255, 255 ] ] ] ).astype( numpy.uint8 )
+
+	# Intervals are closed at the top, except the lowest one which is closed on both sides
+	index = numpy.searchsorted( levels, z, side = "left" ) - 1
+	index[ z == levels[ 0 ] ] = 0
+	index[ ( index < 0 ) | ( index >= len( layers ) ) | numpy.isnan( z ) ] = len( layers )
+
+	return table[ index ]
+
+def resample( x, y, z, xs, ys ):
+	'''
+	Bilinear interpolation of a field given on a regular grid.
+
+	- x: Values along the horizontal axis of the grid, increasing
+	- y: Values along the vertical axis of the grid, increasing
+	- z: Values of the field, with shape ( len( y ), len( x ) )
+	- xs: Horizontal positions at which to interpolate
+	- ys: Vertical positions at which to interpolate
+	'''
+
+	def weights( grid, pos ):
+		pos = numpy.clip( pos, grid[ 0 ], grid[ -1 ] )
+		index = numpy.clip( numpy.searchsorted( grid, pos, side = "right" ) - 1, 0, len( grid ) - 2 )
+		frac = ( pos - grid[ index ] ) / ( grid[ index + 1 ] - grid[ index ] )
+		return index, frac
+
+	ix, fx = weights( x, xs )
+	iy, fy = weights( y, ys )
+
+	ix = ix[ numpy.newaxis, : ]
+	fx = fx[ numpy.newaxis, : ]
+	iy = iy[ :, numpy.newaxis ]
+	fy = fy[ :, numpy.newaxis ]
+
+	bottom = z[ iy, ix ] * ( 1. - fx ) + z[ iy, ix + 1 ] * fx
+	top = z[ iy + 1, ix ] * ( 1. - fx ) + z[ iy + 1, ix + 1 ] * fx
+
+	return bottom * ( 1. - fy ) + top * fy
+
+def get_polygons( x, y, z, style, cmap, digits = 4 ):
+	'''
+	Compute the filled contours of a map as polygons, so that the map can be drawn by the caller.
+	Returns a dictionary with the description of the color scale and, for each interval between two levels, its color and a list of polygons.
+	Each polygon is a list of rings given as flat lists of alternating horizontal and vertical coordinates; the first ring is the outer boundary and the next ones are holes.
+
+	- x: Values along the horizontal axis (impact angle)
+	- y: Values along the vertical axis (impact velocity)
+	- z: Values of the quantity, with shape ( len( y ), len( x ) )
+	- style: Color scale definition, as returned by get_style()
+	- cmap: Color map
+	- digits: Number of decimal digits of the coordinates
+	'''
+
+	generator = contourpy.contour_generator( x, y, z, fill_type = contourpy.FillType.OuterOffset )
+	colors = get_layer_colors( style, cmap )
+	levels = style[ "levels" ]
+
+	layers = []
+	for i in range( len( levels ) - 1 ):
+		polygons = []
+		for points, offsets in zip( *generator.filled( levels[ i ], levels[ i + 1 ] ) ):
+			points = numpy.round( points, digits )
+			polygons.append( [ points[ offsets[ j ] : offsets[ j + 1 ] ].ravel().tolist() for j in range( len( offsets ) - 1 ) ] )
+
+		layers.append( {
+			"lower": levels[ i ],
+			"upper": levels[ i + 1 ],
+			"color": "#{:02x}{:02x}{:02x}".format( *colors[ i ][ : 3 ] ),
+			"polygons": polygons,
+		} )
+
+	return {
+		"xlim": [ float( x[ 0 ] ), float( x[ -1 ] ) ],
+		"ylim": [ float( y[ 0 ] ), float( y[ -1 ] ) ],
+		"boundaries": style[ "boundaries" ],
+		"label": style[ "label" ],
+		"ticks": style[ "ticks" ],
+		"ticklabels": style[ "ticklabels" ],
+		"layers": layers,
+	}
+
+def encode_image( rgba, format ):
+	'''
+	Encode an array of RGBA bytes into an image file.
+
+	- rgba: Array of RGBA bytes with shape ( height, width, 4 ), first row at the top
+	- format: Either "png" or "jpg"
+	'''
+
+	image = PIL.Image.fromarray( rgba, "RGBA" )
+
+	buffer = io.BytesIO()
+	if format == "jpg":
+		# JPEG has no transparency; flatten the image on a white background
+		flat = PIL.Image.new( "RGB", image.size, ( 255, 255, 255 ) )
+		flat.paste( image, mask = image.getchannel( "A" ) )
+		flat.save( buffer, format = "jpeg", quality = 90 )
+	else:
+		image.save( buffer, format = "png", compress_level = 1 )
+
+	return buffer.getvalue()
+
+class GridTemplate( object ):
+	'''
+	Figure for a map of outcomes, with axes, labels and color bar already set-up.
+	The figure may have several panels side by side, which share the color bar, to compare maps.
+
+	The figure is built once for a given quantity; rendering a map only replaces the filled contours.
+	'''
+
+	def __init__( self, quant, usetex = False, panels = 1 ):
+		'''
+		Build the figure.
+
+		- quant: Name of the quantity that will be shown on the map
+		- usetex: Whether to use LaTeX for text formatting
+		- panels: Number of maps shown in the figure
+		'''
+
+		self.quant = quant
+		self.style = get_style( quant )
+		self.cmap = get_cmap()
+		self.contours = [ None ] * panels
+		self.overlay = None
+
+		xmin = 0.
+		xmax = 90.
+		xscale = "linear"
+		xname = "\\theta_{coll}~[deg]"
+		xt = [ 0., 15., 30., 45., 60., 75., 90. ]
+		xl = None
+
+		ymin = 0.99
+		ymax = 4.01
+		yscale = "linear"
+		yname = "v_{coll}/v_{esc}"
+		yt = None
+		yl = None
+
+		matplotlib.rc( "font", family = "serif" )
+
+		if usetex:
+			matplotlib.rc( "text", usetex = True )
+			matplotlib.rc( "text.latex", preamble = "\\usepackage{amsmath}\n\\usepackage{wasysym}\n\\usepackage{mathptmx}" )
+
+		figtext = mpl_tune.FigText( size = "large", color = "black", tex = usetex )
+
+		# Panels have the same size as the single map; they get room for their title
+		figsize = mpl_tune.FigSize( ncols = panels )
+		figsize.set_size_h( 5.0 * panels, mpl_tune.FigSize.SIZE_NO_CBAR )
+		figsize.set_size_v( 5.0 if panels == 1 else 5.3, mpl_tune.FigSize.SIZE_NO_CBAR )
+		figsize.set_margin_left( 0.52 )
+		figsize.set_margin_bottom( 0.52 )
+		figsize.set_margin_right( 0.08 )
+		figsize.set_margin_top( 0.08 if panels == 1 else 0.38 )
+
+		# Color bar
+		figsize.set_cbar_loc( "right" )
+		figsize.set_cbar_width( 0.1 )
+		figsize.set_cbar_pad( 0.75 )
+
+		# The figure is created without pyplot so that it is not registered in its global state
+		self.fig = matplotlib.figure.Figure( **figsize.get_figure_args() )
+		matplotlib.backends.backend_agg.FigureCanvasAgg( self.fig )
+		self.fig.subplots_adjust( **figsize.get_subplots_args() )
+
+		self.axes = [ self.fig.add_subplot( 1, panels, i + 1 ) for i in range( panels ) ]
+		self.ax = self.axes[ 0 ]
+		self.figtext = figtext
+
+		self.cb = None
+		if figsize.has_cbar():
+			cax = self.fig.add_axes( figsize.get_cbar_ax_spec() )
+			kwargs = { "boundaries": self.style[ "boundaries" ] }
+			if not self.style[ "values" ] is None:
+				kwargs[ "values" ] = self.style[ "values" ]
+			norm = matplotlib.colors.Normalize( vmin = self.style[ "vmin" ], vmax = self.style[ "vmax" ] )
+			mappabble = matplotlib.cm.ScalarMappable( norm, self.cmap )
+
+			self.cb = self.fig.colorbar( mappabble, orientation = figsize.get_cbar_orientation(), cax = cax, **kwargs, **COLORBAR_ARGS )
+
+		for ax in self.axes:
+			ax.patch.set_facecolor( "white" )
+			ax.patch.set_edgecolor( "white" )
+
+			if xscale == "log":
+				ax.set_xscale( "log" )
+				ax.set_xlim( 10 ** xmin, 10 ** xmax )
+			else:
+				ax.set_xlim( xmin, xmax )
+
+			if yscale == "log":
+				ax.set_yscale( "log" )
+				ax.set_ylim( 10 ** ymin, 10 ** ymax )
+			else:
+				ax.set_ylim( ymin, ymax )
+
+			ax.set_xlabel( "$\\mathrm{" + xname + "}$", **figtext.get_text_args() )
+			if not xt is None:
+				ax.set_xticks( xt )
+				ax.set_xticks( [], minor = True )
+			if not xl is None:
+				ax.set_xticklabels( xl, **figtext.get_text_args() )
+
+			if not yt is None:
+				ax.set_yticks( yt )
+				ax.set_yticks( [], minor = True )
+
+			# Only the first panel has the labels of the vertical axis
+			if not ax is self.ax:
+				ax.tick_params( labelleft = False )
+
+		self.ax.set_ylabel( "$\\mathrm{" + yname + "}$", **figtext.get_text_args() )
+		if not yl is None:
+			self.ax.set_yticklabels( yl, **figtext.get_text_args() )
+
+		if not self.cb is None:
+			self.cb.set_label( self.style[ "label" ], **figtext.get_text_args() )
+			self.cb.set_ticks( self.style[ "ticks" ] )
+			if not self.style[ "ticklabels" ] is None:
+				self.cb.set_ticklabels( self.style[ "ticklabels" ] )
+
+			figtext.set_cbar( self.cb )
+
+		for ax in self.axes:
+			figtext.set_axes( ax )
+
+	def get_panels( self, z ):
+		'''
+		Get the maps of each panel.
+
+		- z: Values of the quantity, with shape ( len( y ), len( x ) ) for a single panel or ( panels, len( y ), len( x ) )
+		'''
+
+		z = numpy.asarray( z )
+
+		return [ z ] if z.ndim == 2 else list( z )
+
+	def set_titles( self, titles ):
+		'''
+		Set the titles of the panels.
+
+		- titles: List of titles, one for each panel, or None to remove them
+		'''
+
+		for i, ax in enumerate( self.axes ):
+			ax.set_title( "" if titles is None else titles[ i ], **self.figtext.get_text_args() )
+
+	def clear_data( self ):
+		'''
+		Remove the filled contours shown in the figure.
+		'''
+
+		for i, contours in enumerate( self.contours ):
+			if not contours is None:
+				remove_contours( contours )
+				self.contours[ i ] = None
+
+	def set_data( self, x, y, z ):
+		'''
+		Replace the filled contours shown in the figure.
+
+		- x: Values along the horizontal axis (impact angle)
+		- y: Values along the vertical axis (impact velocity)
+		- z: Values of the quantity, see get_panels()
+		'''
+
+		self.clear_data()
+
+		for i, data in enumerate( self.get_panels( z ) ):
+			self.contours[ i ] = self.axes[ i ].contourf( x, y, data, self.style[ "levels" ], cmap = self.cmap, vmin = self.style[ "vmin" ], vmax = self.style[ "vmax" ] )
+
+	def render( self, x, y, z, format, titles = None ):
+		'''
+		Render a map and return the content of the resulting file.
+
+		- x: Values along the horizontal axis (impact angle)
+		- y: Values along the vertical axis (impact velocity)
+		- z: Values of the quantity, see get_panels()
+		- format: File format, as understood by matplotlib
+		- titles: Titles of the panels, or None
+		'''
+
+		self.set_titles( titles )
+		self.set_data( x, y, z )
+
+		buffer = io.BytesIO()
+		self.fig.savefig( buffer, dpi = 250, format = format, facecolor = "none", edgecolor = "none" )
+
+		return buffer.getvalue()
+
+	def get_overlay( self, dpi, titles = None ):
+		'''
+		Get the figure rendered without any data as an RGBA array, along with the location of the plot area of each panel in pixels.
+		The result is computed once for a given resolution and titles, and then kept.
+
+		- dpi: Resolution of the image
+		- titles: Titles of the panels, or None
+		'''
+
+		if not self.overlay is None and self.overlay[ 0 ] == ( dpi, titles ):
+			return self.overlay[ 1 ], self.overlay[ 2 ]
+
+		self.clear_data()
+		self.set_titles( titles )
+
+		# Render the figure with a transparent plot area, so that the data can be put below
+		save_dpi = self.fig.dpi
+		self.fig.set_dpi( dpi )
+		self.fig.patch.set_alpha( 0. )
+		for ax in self.axes:
+			ax.patch.set_visible( False )
+
+		try:
+			self.fig.canvas.draw()
+			rgba = numpy.array( self.fig.canvas.buffer_rgba() )
+			# The extents are computed lazily; freeze them before the resolution is restored
+			bboxes = [ ax.get_window_extent().frozen() for ax in self.axes ]
+		finally:
+			for ax in self.axes:
+				ax.patch.set_visible( True )
+			self.fig.patch.set_alpha( 1. )
+			self.fig.set_dpi( save_dpi )
+
+		height = rgba.shape[ 0 ]
+		boxes = [ ( height - int( round( bbox.y1 ) ), height - int( round( bbox.y0 ) ), int( round( bbox.x0 ) ), int( round( bbox.x1 ) ) ) for bbox in bboxes ]
+
+		self.overlay = ( ( dpi, titles ), rgba, boxes )
+
+		return rgba, boxes
+
+	def render_raster( self, x, y, z, format, dpi = 100, titles = None ):
+		'''
+		Render a map as a raster image without drawing the contours.
+		The values are interpolated at each pixel of the plot area and mapped to the same colors as the filled contours.
+		The axes and color bar are taken from a pre-rendered overlay.
+
+		- x: Values along the horizontal axis (impact angle)
+		- y: Values along the vertical axis (impact velocity)
+		- z: Values of the quantity, see get_panels()
+		- format: Either "png" or "jpg"
+		- dpi: Resolution of the image
+		- titles: Titles of the panels, or None
+		'''
+
+		if not titles is None:
+			titles = tuple( titles )
+
+		overlay, boxes = self.get_overlay( dpi, titles )
+
+		xmin, xmax = self.ax.get_xlim()
+		ymin, ymax = self.ax.get_ylim()
+
+		rgba = overlay.copy()
+
+		for data, ( row0, row1, col0, col1 ) in zip( self.get_panels( z ), boxes ):
+			# Position of the pixel centers, the first row being at the top
+			xs = xmin + ( numpy.arange( col1 - col0 ) + 0.5 ) / ( col1 - col0 ) * ( xmax - xmin )
+			ys = ymax - ( numpy.arange( row1 - row0 ) + 0.5 ) / ( row1 - row0 ) * ( ymax - ymin )
+
+			colors = map_colors( resample( x, y, data, xs, ys ), self.style, self.cmap )
+
+			# Put the overlay on top of the data
+			alpha = overlay[ row0 : row1, col0 : col1, 3 : 4 ].astype( numpy.float32 ) / 255.
+
+			rgba[ row0 : row1, col0 : col1, : 3 ] = ( overlay[ row0 : row1, col0 : col1, : 3 ] * alpha + colors[ :, :, : 3 ] * ( 1. - alpha ) + 0.5 ).astype( numpy.uint8 )
+			rgba[ row0 : row1, col0 : col1, 3 ] = 255
+
+		return encode_image( rgba, format )
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+#
+# HTTP Collision Data Server (HCDS) precomputed tables of collision outcomes.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The table covers collisions between bodies whose radius is computed from their mass by collresolve ("e2020" size type).
+# It is a set of NPY files, one per quantity, with axes (model, total mass, mass ratio, velocity, angle):
+# - total mass: logarithmically spaced, in Earth masses
+# - mass ratio: impactor over target mass, logarithmically spaced, at most 1
+# - velocity: linearly spaced, relative to the mutual escape velocity
+# - angle: linearly spaced, in degrees
+# The definition of the axes, the interpolation method and its error bounds are stored in "table.json"; the table must be served with the same method.
+#
+# To build a table, execute this file, e.g.:
+# python hcds_coll_table.py --models c2019,sl2012 --nmass 25 --nratio 25 /path/to/table
+
+import argparse
+import itertools
+import json
+import math
+import os
+
+import numpy
+
+QUANTS = [ "regime", "acclr", "accsr", "acctr" ]
+
+class OutcomeTable( object ):
+	'''
+	Precomputed table of collision outcomes, memory-mapped from disk.
+	'''
+
+	def __init__( self, path, method = None ):
+		'''
+		- path: Directory containing the table
+		- method: Interpolation method used to serve the table, "linear" or "nearest"; a ValueError is raised if the error bounds were estimated for another method. If not set, the method of the table is used.
+		'''
+
+		with open( os.path.join( path, "table.json" ) ) as f:
+			self.meta = json.load( f )
+
+		self.method = self.meta[ "method" ]
+		if not method is None and method != self.method:
+			raise ValueError( "table {:s} was built for the \"{:s}\" method, not \"{:s}\"".format( path, self.method, method ) )
+
+		self.models = self.meta[ "models" ]
+		self.axes = self.meta[ "axes" ]
+		self.data = { quant: numpy.load( os.path.join( path, quant + ".npy" ), mmap_mode = "r" ) for quant in QUANTS }
+
+	def get_error( self ):
+		'''
+		Get the error bounds of the interpolation, as estimated when the table was built.
+		'''
+
+		return self.meta[ "error" ]
+
+	def position( self, axis, value ):
+		'''
+		Get the fractional index of values along one axis of the table.
+
+		- axis: Name of the axis
+		- value: Value or array of values, in the units of the axis
+		'''
+
+		spec = self.axes[ axis ]
+		value = numpy.asarray( value, dtype = numpy.float64 )
+
+		if spec[ "log" ]:
+			value = numpy.log10( value )
+			vmin = math.log10( spec[ "min" ] )
+			vmax = math.log10( spec[ "max" ] )
+		else:
+			vmin = spec[ "min" ]
+			vmax = spec[ "max" ]
+
+		return numpy.clip( ( value - vmin ) / ( vmax - vmin ) * ( spec[ "num" ] - 1 ), 0., spec[ "num" ] - 1. )
+
+	def covers( self, model, mass, ratio, vel = None, angle = None ):
+		'''
+		Check whether the table covers the given parameters; the tolerance is a small fraction of the axis spacing.
+
+		- model: Name of the collision model
+		- mass: Total mass, in Earth masses
+		- ratio: Ratio of the impactor mass over the target mass
+		- vel: Impact velocity relative to the mutual escape velocity, or array thereof
+		- angle: Impact angle in degrees, or array thereof
+		'''
+
+		if not model in self.models:
+			return False
+
+		for axis, value in [ ( "mass", mass ), ( "ratio", ratio ), ( "vel", vel ), ( "angle", angle ) ]:
+			if value is None:
+				continue
+
+			spec = self.axes[ axis ]
+			tol = 1.e-9 * abs( spec[ "max" ] )
+			if numpy.min( value ) < spec[ "min" ] - tol or numpy.max( value ) > spec[ "max" ] + tol:
+				return False
+
+		return True
+
+	def lookup( self, model, mass, ratio, vel, angle, method = None ):
+		'''
+		Get the outcome of collisions from the table.
+		The regime is always taken from the nearest point of the table; the other quantities are interpolated linearly unless the method is "nearest".
+		Only the points of the table in the same regime as the nearest point, and whose values are available, are used in the interpolation; if there are none, the value of the nearest point is used.
+		Returns a dictionary of arrays, one per quantity, with NaN (or -1 for the regime) where the outcome is not available.
+
+		- model: Name of the collision model
+		- mass: Total mass, in Earth masses
+		- ratio: Ratio of the impactor mass over the target mass
+		- vel: Impact velocity relative to the mutual escape velocity, or array thereof
+		- angle: Impact angle in degrees, or array thereof; must be broadcastable with vel
+		- method: "linear" or "nearest"; by default, the method of the table
+		'''
+
+		if method is None:
+			method = self.method
+
+		vel, angle = numpy.broadcast_arrays( numpy.asarray( vel, dtype = numpy.float64 ), numpy.asarray( angle, dtype = numpy.float64 ) )
+
+		m = self.models.index( model )
+		pos = [
+			numpy.broadcast_to( self.position( "mass", mass ), vel.shape ),
+			numpy.broadcast_to( self.position( "ratio", ratio ), vel.shape ),
+			self.position( "vel", vel ),
+			self.position( "angle", angle ),
+		]
+
+		near = tuple( [ m ] + [ numpy.rint( p ).astype( numpy.intp ) for p in pos ] )
+
+		res = { "regime": numpy.asarray( self.data[ "regime" ][ near ] ) }
+
+		if method == "nearest":
+			for quant in QUANTS[ 1 : ]:
+				res[ quant ] = numpy.asarray( self.data[ quant ][ near ], dtype = numpy.float64 )
+			return res
+
+		lower = []
+		frac = []
+		for i, p in enumerate( pos ):
+			index = numpy.clip( numpy.floor( p ).astype( numpy.intp ), 0, max( self.data[ "regime" ].shape[ i + 1 ] - 2, 0 ) )
+			lower.append( index )
+			frac.append( p - index )
+
+		corners = []
+		for corner in itertools.product( [ 0, 1 ], repeat = 4 ):
+			weight = numpy.ones( vel.shape )
+			for f, c in zip( frac, corner ):
+				weight = weight * ( f if c else 1. - f )
+
+			index = tuple( [ m ] + [ numpy.minimum( l + c, self.data[ "regime" ].shape[ i + 1 ] - 1 ) for i, ( l, c ) in enumerate( zip( lower, corner ) ) ] )
+
+			# Points in another regime than the nearest point do not contribute
+			weight = numpy.where( self.data[ "regime" ][ index ] == res[ "regime" ], weight, 0. )
+
+			corners.append( ( index, weight ) )
+
+		for quant in QUANTS[ 1 : ]:
+			total = numpy.zeros( vel.shape )
+			norm = numpy.zeros( vel.shape )
+
+			for index, weight in corners:
+				values = numpy.asarray( self.data[ quant ][ index ], dtype = numpy.float64 )
+
+				# Points whose value is not available do not contribute either
+				weight = numpy.where( numpy.isfinite( values ), weight, 0. )
+				total += numpy.where( weight > 0., weight * values, 0. )
+				norm += weight
+
+			nearest = numpy.asarray( self.data[ quant ][ near ], dtype = numpy.float64 )
+
+			with numpy.errstate( invalid = "ignore", divide = "ignore" ):
+				res[ quant ] = numpy.where( norm > 0., total / norm, nearest )
+
+		return res
+
+def make_axis( vmin, vmax, num, log ):
+	'''
+	Definition of one axis of the table.
+	'''
+
+	return { "min": vmin, "max": vmax, "num": num, "log": log }
+
+def axis_values( spec ):
+	'''
+	Get the values along one axis of the table.
+	'''
+
+	if spec[ "log" ]:
+		return numpy.logspace( math.log10( spec[ "min" ] ), math.log10( spec[ "max" ] ), spec[ "num" ] )
+	else:
+		return numpy.linspace( spec[ "min" ], spec[ "max" ], spec[ "num" ] )
+
+def resolve( resp, model, mass, ratio, vel, angle ):
+	'''
+	Compute the outcome of one collision with collresolve.
+	Returns a tuple of the regime and the three accretion efficiencies, or None if the outcome cannot be computed.
+
+	- resp: hcds_responder_coll.CollResponder object
+	- model: Name of the collision model
+	- mass: Total mass, in Earth masses
+	- ratio: Ratio of the impactor mass over the target mass
+	- vel: Impact velocity relative to the mutual escape velocity
+	- angle: Impact angle in degrees
+	'''
+
+	import collresolve
+
+	mtar = mass / ( 1. + ratio ) / resp.MASS_MEARTH_MSOL
+	mimp = mtar * ratio
+
+	rtar = resp.body_radius( mtar )
+	rimp = resp.body_radius( mimp )
+	resp.set_model( model )
+
+	tar = collresolve.Body( mass = mtar, radius = rtar )
+	imp = collresolve.Body( mass = mimp, radius = rimp )
+
+	try:
+		collresolve.setup( resp.conf, tar, imp, vel * resp.escape_velocity( tar, imp ), math.radians( angle ) )
+		res, regime = collresolve.resolve( resp.conf, tar, imp, 2, 1 )
+	except:
+		return None
+
+	return ( regime, ( res[ 0 ].mass - tar.mass ) / imp.mass, ( res[ 1 ].mass - imp.mass ) / imp.mass, res[ 2 ].mass / imp.mass )
+
+def build( path, models, axes, samples = 1000, method = "linear" ):
+	'''
+	Build a table by sweeping the parameter space with collresolve, and estimate the error of its interpolation.
+
+	- path: Directory where to write the table
+	- models: List of names of collision models
+	- axes: Dictionary of the definition of the "mass", "ratio", "vel" and "angle" axes
+	- samples: Number of random collisions used to estimate the error
+	- method: Interpolation method used to estimate the error; the table must be served with the same method
+	'''
+
+	import hcds_responder_coll
+
+	resp = hcds_responder_coll.CollResponder( {} )
+
+	os.makedirs( path, exist_ok = True )
+
+	values = [ axis_values( axes[ name ] ) for name in [ "mass", "ratio", "vel", "angle" ] ]
+	shape = tuple( [ len( models ) ] + [ len( v ) for v in values ] )
+
+	data = {}
+	for quant in QUANTS:
+		data[ quant ] = numpy.lib.format.open_memmap( os.path.join( path, quant + ".npy" ), mode = "w+", dtype = numpy.int8 if quant == "regime" else numpy.float32, shape = shape )
+
+	for m, model in enumerate( models ):
+		for i, mass in enumerate( values[ 0 ] ):
+			for j, ratio in enumerate( values[ 1 ] ):
+				for k, vel in enumerate( values[ 2 ] ):
+					for l, angle in enumerate( values[ 3 ] ):
+						res = resolve( resp, model, mass, ratio, vel, angle )
+
+						if res is None:
+							data[ "regime" ][ m, i, j, k, l ] = -1
+							for quant in QUANTS[ 1 : ]:
+								data[ quant ][ m, i, j, k, l ] = numpy.nan
+						else:
+							for quant, value in zip( QUANTS, res ):
+								data[ quant ][ m, i, j, k, l ] = value
+
+	for quant in QUANTS:
+		data[ quant ].flush()
+	del data
+
+	meta = { "models": models, "axes": axes, "method": method, "error": None }
+	with open( os.path.join( path, "table.json" ), "w" ) as f:
+		json.dump( meta, f )
+
+	# Compare the table against collresolve at random points
+	table = OutcomeTable( path )
+	rng = numpy.random.default_rng( 0 )
+
+	mismatch = 0
+	errors = { quant: [] for quant in QUANTS[ 1 : ] }
+
+	for n in range( samples ):
+		model = models[ rng.integers( len( models ) ) ]
+		point = []
+		for name in [ "mass", "ratio", "vel", "angle" ]:
+			spec = axes[ name ]
+			if spec[ "log" ]:
+				point.append( 10. ** rng.uniform( math.log10( spec[ "min" ] ), math.log10( spec[ "max" ] ) ) )
+			else:
+				point.append( rng.uniform( spec[ "min" ], spec[ "max" ] ) )
+
+		exact = resolve( resp, model, *point )
+		if exact is None:
+			continue
+
+		approx = table.lookup( model, *point )
+
+		if int( approx[ "regime" ] ) != exact[ 0 ]:
+			mismatch += 1
+
+		for quant, value in zip( QUANTS[ 1 : ], exact[ 1 : ] ):
+			if math.isfinite( float( approx[ quant ] ) ):
+				errors[ quant ].append( abs( float( approx[ quant ] ) - value ) )
+
+	meta[ "error" ] = {
+		"method": method,
+		"samples": samples,
+		"regime_mismatch": mismatch / samples if samples > 0 else None,
+	}
+	for quant in QUANTS[ 1 : ]:
+		if len( errors[ quant ] ):
+			meta[ "error" ][ quant ] = { "max": max( errors[ quant ] ), "p95": float( numpy.percentile( errors[ quant ], 95. ) ) }
+		else:
+			meta[ "error" ][ quant ] = None
+
+	with open( os.path.join( path, "table.json" ), "w" ) as f:
+		json.dump( meta, f )
+
+	return meta
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser( description = "Build a table of collision outcomes for HCDS." )
+	parser.add_argument( "path", help = "Directory where to write the table" )
+	parser.add_argument( "--models", default = "merge,ls2012,sl2012,c2019", help = "Comma-separated list of collision models" )
+	parser.add_argument( "--mass-min", type = float, default = 1.e-3, help = "Minimal total mass, in Earth masses" )
+	parser.add_argument( "--mass-max", type = float, default = 1.e1, help = "Maximal total mass, in Earth masses" )
+	parser.add_argument( "--nmass", type = int, default = 17, help = "Number of points along the total mass axis" )
+	parser.add_argument( "--ratio-min", type = float, default = 1.e-2, help = "Minimal ratio of the impactor over target mass" )
+	parser.add_argument( "--nratio", type = int, default = 17, help = "Number of points along the mass ratio axis" )
+	parser.add_argument( "--nvel", type = int, default = 61, help = "Number of points along the velocity axis" )
+	parser.add_argument( "--nangle", type = int, default = 46, help = "Number of points along the angle axis" )
+	parser.add_argument( "--samples", type = int, default = 1000, help = "Number of random collisions used to estimate the error of the interpolation" )
+	parser.add_argument( "--method", default = "linear", choices = [ "linear", "nearest" ], help = "Interpolation method used to estimate the error; it must match the table_method option of the \"coll\" module" )
+	args = parser.parse_args()
+
+	axes = {
+		"mass": make_axis( args.mass_min, args.mass_max, args.nmass, True ),
+		"ratio": make_axis( args.ratio_min, 1., args.nratio, True ),
+		"vel": make_axis( 0.99, 4.01, args.nvel, False ),
+		"angle": make_axis( 0., 90., args.nangle, False ),
+	}
+
+	meta = build( args.path, args.models.split( "," ), axes, args.samples, args.method )
+
+	print( json.dumps( meta[ "error" ], indent = 1 ) )
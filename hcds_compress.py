@@ -0,0 +1,127 @@
+# HTTP Collision Data Server (HCDS) compression of the responses.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import hashlib
+
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+import hcds_cache
+import hcds_config
+
+# Content types whose data is already compressed
+COMPRESSED_TYPES = [ "image/png", "image/jpeg", "application/pdf" ]
+
+# Compressed bodies, keyed by a hash of the uncompressed body and the encoding
+cache = hcds_cache.LRUCache( hcds_config.COMPRESS_CACHE )
+
+def get_available():
+	'''
+	Get the content encodings that can be produced, in the order of preference set by COMPRESS_ENCODINGS.
+	'''
+
+	available = []
+	for encoding in hcds_config.COMPRESS_ENCODINGS:
+		if encoding == "gzip" or ( encoding == "br" and not brotli is None ) or ( encoding == "zstd" and not zstandard is None ):
+			available.append( encoding )
+
+	return available
+
+def negotiate( accept ):
+	'''
+	Select the content encoding to use for a response.
+	Returns the name of the encoding, or None if the response must not be compressed.
+
+	- accept: Value of the "Accept-Encoding" header of the request, or None if it is not set
+	'''
+
+	if accept is None:
+		return None
+
+	weights = {}
+	for item in accept.split( "," ):
+		parts = item.strip().split( ";" )
+		name = parts[ 0 ].strip().lower()
+		weight = 1.
+
+		for param in parts[ 1 : ]:
+			param = param.strip()
+			if param[ : 2 ] == "q=":
+				try:
+					weight = float( param[ 2 : ] )
+				except ValueError:
+					weight = 0.
+
+		weights[ name ] = weight
+
+	# The server's preference applies among the encodings accepted by the client
+	for encoding in get_available():
+		if weights.get( encoding, weights.get( "*", 0. ) ) > 0.:
+			return encoding
+
+	return None
+
+def get_tag( tag, encoding ):
+	'''
+	Get the ETag of a compressed response, which differs from the one of the uncompressed response.
+
+	- tag: ETag of the uncompressed response, including the quotes
+	- encoding: Name of the encoding, as returned by negotiate()
+	'''
+
+	return tag[ : -1 ] + "-" + encoding + "\""
+
+def get_key( data, encoding ):
+	'''
+	Get the key of a compressed body in the cache.
+
+	- data: Uncompressed body
+	- encoding: Name of the encoding, as returned by negotiate()
+	'''
+
+	return ( hashlib.sha1( data ).hexdigest(), encoding )
+
+def is_compressible( content_type ):
+	'''
+	Check whether the data of the given type is worth compressing.
+
+	- content_type: Value of the "Content-Type" header of the response
+	'''
+
+	return not content_type.split( ";" )[ 0 ].strip().lower() in COMPRESSED_TYPES
+
+def compress( data, encoding ):
+	'''
+	Compress data.
+
+	- data: Data to compress
+	- encoding: Name of the encoding, as returned by negotiate()
+	'''
+
+	if encoding == "br":
+		return brotli.compress( data, quality = 5 )
+	elif encoding == "zstd":
+		return zstandard.ZstdCompressor( level = 3 ).compress( data )
+	else:
+		return gzip.compress( data, compresslevel = 6, mtime = 0 )
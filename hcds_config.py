@@ -30,10 +30,32 @@ BASE_PATH = "/data/"
 # Available modules are:
 # - coll: The following item is available:
 #         - usetex: Boolean to indicate whether to use LaTeX for text formatting
+#         - render: Default rendering of PNG and JPG maps, either "contour" (filled contours drawn by matplotlib) or "raster" (colors computed pixel by pixel, much faster);
+#                   it can be overriden for each request with the "render" parameter
+#         - raster_dpi: Resolution of the maps in "raster" rendering
+#         - tile_size: Number of points along each side of the tiles of zoomable maps (endpoint "tile/<zoom>/<x>/<y>")
+#         - tile_max_zoom: Maximum zoom level of the tiles
+#         - tile_cache: Maximum number of tiles kept in memory by each worker
+#         - bulk_max: Maximum number of scenarios in a single bulk request (endpoint "bulk")
+#         - bulk_max_bytes: Maximum size of the body of a bulk request, in bytes
+#         - body_cache: Maximum number of memoized body radii and escape velocities kept by each worker
+#         - map_cache: Maximum number of maps kept by each worker, each with all the quantities, so that changing the quantity of a map does not compute it again
+#         - table: Directory of a precomputed table of outcomes, built with hcds_coll_table.py; if set, requests covered by the table are answered from it
+#         - table_method: Interpolation in the table, either "linear" or "nearest"; the regime is always taken from the nearest point; it must be the method the table was built with (--method of hcds_coll_table.py)
+#         - job_dir: Directory where the background jobs computing maps (endpoints "job" and "job/<id>[/result]") and their results are stored; jobs are disabled if not set
+#         - job_workers: Number of jobs run at the same time by each worker
+#         - job_ttl: Time after which finished jobs are removed, in seconds
+#         - job_max_points: Maximum number of points along each side of the map of a job
+#         - job_max_bytes: Maximum size of the body of a job submission, in bytes
+#         - job_max_pending: Maximum number of jobs queued or running over all the workers; further submissions are rejected with a "503 Service Unavailable" error
+#         - job_retry_after: Time in seconds sent in the "Retry-After" header of rejected submissions
 # - sph: The following item is available:
 #        - dir: Directory where both the configuration file and data files are present.
 #        - file: Name of a YAML containing the definitions
 #        - items: Direct definitions (only if "file" is not set or points to an non-existing file)
+#        - mmap: Whether to map the datasets into memory instead of copying them, from their sidecar export written with hcds_mmap.py or, if h5py is installed, directly from the HDF5 file for contiguous datasets without filters; true by default
+#        - mmap_cache: Maximum number of datasets kept mapped by each worker
+#        - materialized: Whether to read the values of the fields materialized with hcds_materialize.py, in the HDF5 file or in sidecar files, instead of evaluating their expressions; values are only used if they were computed from the same expression and the HDF5 file was not modified afterwards; true by default
 #        Definitions are given as a dictionary, where the key are the identifiers and the value another dictionary of three items:
 #        - file: Path to HDF5 file containing the data
 #        - desc: Human-reable description of the dataset
@@ -46,6 +68,9 @@ BASE_PATH = "/data/"
 #        - dir: Directory where both the configuration file and data files are present.
 #        - file: Name of a YAML containing the definitions
 #        - items: Direct definitions (only if "file" is not set or points to an non-existing file)
+#        - mmap, mmap_cache, materialized: Same as for the "sph" module
+#        - store: Whether to serve the databases from their columnar store, written with hcds_db_store.py, while it matches the HDF5 file and the definitions of the fields; true by default
+#        The list of simulations of a database accepts the "fields" parameter, a comma-separated list of the base fields to return, and the "<name>.min" and "<name>.max" parameters to only return the simulations where the base field <name> is within bounds.
 #        Definitions are given as a dictionary, where the key are the identifiers and the value another dictionary with the following items:
 #        - file: Path to HDF5 file containing the data
 #        - desc: Human-reable description of the dataset
@@ -58,12 +83,92 @@ BASE_PATH = "/data/"
 #          - name: Field name as it should appear on the resulting data
 #          - data: Expression to compute the values; it is a mathematical expression parsed by MaExPa with the fields in the dataset available as variables
 #        - plot: Plotting information. Passed as-is to the output
+# - metrics: Metrics of the requests handled by all the workers, in the Prometheus text format; there are no configuration items
+#            They describe the internals of the server, so the module is not enabled by default; add e.g. "metrics": ( "metrics", {} ) and restrict the access to its path
 MODS = {
 	"coll": ( "coll", {
 		"usetex": False,
 	} ),
 }
 
+# Whether the "sph" and "db" modules load the definitions of their items when the application is loaded, checking that the data files, datasets and expressions are valid
+# Problems are reported as warnings in the "hcds.sph" log; if set to False, the definitions are loaded on the first request
+# In both cases, the definitions are loaded again when the YAML file or a data file is modified
+PRELOAD = True
+
+# Directory where each worker stores its metrics, so that they can be summed up over all the workers
+# It must be writable by all the workers; if set to None, the "metrics" module only reports the metrics of the worker that handles the request
+METRICS_DIR = "/tmp/hcds/metrics"
+
+# Minimum time in seconds between two writes of the metrics of a worker to METRICS_DIR
+METRICS_INTERVAL = 1.
+
+# Whether to send the time spent in each phase of a request in the "Server-Timing" header of the response
+TIMING_HEADER = True
+
+# Log of the requests, with one JSON object per line containing the path, query, status, size and timings of the request
+# Set to a file name, to "-" for the standard error, or to None to disable
+REQUEST_LOG = None
+
+# Secret token to profile a request on demand, by setting either the "profile" parameter or the "X-HCDS-Profile" header of the request to its value
+# Set to None to disable profiling on demand
+PROFILE_TOKEN = None
+
+# Fraction of the requests that are profiled, between 0 and 1; only used if PROFILE_DIR is set
+PROFILE_RATE = 0.
+
+# Directory where to write the profiles of the requests, in the pstats format; the name of the file is given in the "X-HCDS-Profile" header of the response
+# If set to None, the body of the response to a request profiled on demand is replaced by a text report of the profile
+PROFILE_DIR = None
+
+# Time in seconds during which clients and proxies may reuse a response without checking it with the server, in the "Cache-Control" header
+# Each module can override it with a "max_age" item in its configuration
+CACHE_MAX_AGE = 3600
+
+# Arbitrary string included in the "ETag" header of the responses; change it to invalidate the copies kept by clients and proxies, e.g. after an update
+CACHE_VERSION = "1"
+
+# Minimum size in bytes of the body of a response for it to be compressed; set to None to disable compression
+COMPRESS_MIN_SIZE = 1024
+
+# Content encodings used to compress the responses, in order of preference; "br" requires the brotli package and "zstd" the zstandard package
+COMPRESS_ENCODINGS = [ "br", "zstd", "gzip" ]
+
+# Maximum number of compressed responses kept in memory by each worker
+COMPRESS_CACHE = 256
+
+# Encoder of the JSON responses: "orjson" to use the orjson package if it is installed, which is much faster, or "json" for the standard library
+JSON_ENCODER = "orjson"
+
+# Admission control of the requests, so that expensive requests cannot use all the workers.
+# Each module sorts its requests into classes: "heavy" for maps, tiles, bulk requests and datasets, "light" for the rest.
+# For each class listed here, the following items are available:
+# - slots: Maximum number of requests of the class handled at the same time
+# - queue: Maximum number of requests of the class waiting for a slot; further requests are rejected immediately
+# - timeout: Maximum time in seconds that a request waits for a slot
+# - retry_after: Time in seconds sent in the "Retry-After" header of rejected requests
+# Classes that are not listed are not limited.
+ADMISSION = {
+	"heavy": { "slots": 2, "queue": 4, "timeout": 10., "retry_after": 5 },
+}
+
+# Directory of the lock files used to apply the limits of ADMISSION to all the workers of the host; it must be writable by all the workers.
+# If set to None, the limits apply to each worker separately, which has no effect unless the workers run several threads.
+ADMISSION_DIR = "/tmp/hcds/admission"
+
+# Whether identical heavy requests handled at the same time share one computation, see ADMISSION for the classes; requests are identical if their responses have the same "ETag" header
+SINGLEFLIGHT = True
+
+# Directory where workers lock the computations in progress and share their results; it must be writable by all the workers
+# If set to None, the requests are not shared
+SINGLEFLIGHT_DIR = "/tmp/hcds/singleflight"
+
+# Maximum time in seconds that a request waits for an identical one before computing its own response
+SINGLEFLIGHT_TIMEOUT = 60.
+
+# Time in seconds during which a result shared in SINGLEFLIGHT_DIR can be used by other workers
+SINGLEFLIGHT_TTL = 5.
+
 # List of origins from which to allow cross-domain requests.
 # This is useful during development when this server is not at the same address as the one providing the user interface.
 CORS_ORIGINS = []
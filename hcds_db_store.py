@@ -0,0 +1,276 @@
+# HTTP Collision Data Server (HCDS) columnar store of the databases of the "db" module.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The fields of a database are evaluated once and stored with one .npy file per field, which are mapped into memory to serve the requests.
+# The rows of the base fields are divided into chunks, with the minimum and maximum of each field, so that chunks outside of the requested ranges are skipped.
+# The store is written next to the HDF5 file, in a directory named after a hash of the definitions of the fields; it is only used while it matches the HDF5 file.
+#
+# Usage: python hcds_db_store.py MODULE [--chunk ROWS]
+# where MODULE is the name of a "db" module in hcds_config.MODS.
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+
+import numpy
+import tables
+
+import hcds_cache
+
+# Default number of rows in each chunk of the base fields
+CHUNK_ROWS = 4096
+
+# Name of the file containing the description of the store
+META_FILE = "meta.json"
+
+def get_hash( config ):
+	'''
+	Get a hash of the definitions of the fields of a database, which identifies its store.
+
+	- config: Definition of the database
+	'''
+
+	return hashlib.sha1( bytes( hcds_cache.make_key( config[ "base_fields" ], config[ "fields" ] ), "utf-8" ) ).hexdigest()
+
+def get_path( filename, config ):
+	'''
+	Get the directory of the store of a database.
+
+	- filename: Path of the HDF5 file of the database
+	- config: Definition of the database
+	'''
+
+	return filename + ".store/" + get_hash( config )
+
+def get_stats( column ):
+	'''
+	Get the minimum and maximum of the finite values of a column, or None if there are none or if the column is not numerical.
+
+	- column: Array of values
+	'''
+
+	if column.dtype.kind not in "biuf":
+		return None
+
+	column = column[ numpy.isfinite( column ) ]
+	if len( column ) == 0:
+		return None
+
+	return [ column.min().item(), column.max().item() ]
+
+def get_mask( columns, bounds ):
+	'''
+	Get the rows where all the columns are within their bounds.
+
+	- columns: List of arrays of the same length
+	- bounds: List of the lower and upper bounds of each column; either bound may be None
+	'''
+
+	mask = numpy.ones( len( columns[ 0 ] ) if len( columns ) else 0, dtype = bool )
+
+	for column, ( lower, upper ) in zip( columns, bounds ):
+		if not lower is None:
+			mask &= column >= lower
+		if not upper is None:
+			mask &= column <= upper
+
+	return mask
+
+def write( path, mtime, base, sims, chunk = CHUNK_ROWS ):
+	'''
+	Write the store of a database, replacing an existing one.
+
+	- path: Directory of the store
+	- mtime: Time of the last modification of the HDF5 file when it was read
+	- base: List of arrays of the base fields, in the order of the definitions
+	- sims: Dictionary with the numbers of the simulations as keys and the lists of arrays of their fields as values
+	- chunk: Number of rows in each chunk of the base fields
+	'''
+
+	tmp = path + ".tmp"
+	shutil.rmtree( tmp, ignore_errors = True )
+	os.makedirs( tmp + "/base" )
+
+	for i, column in enumerate( base ):
+		numpy.save( "{:s}/base/{:d}.npy".format( tmp, i ), column )
+
+	for num, columns in sims.items():
+		os.makedirs( "{:s}/sim_{:03d}".format( tmp, num ) )
+		for i, column in enumerate( columns ):
+			numpy.save( "{:s}/sim_{:03d}/{:d}.npy".format( tmp, num, i ), column )
+
+	rows = len( base[ 0 ] ) if len( base ) else 0
+	chunks = []
+	for start in range( 0, rows, chunk ):
+		stop = min( start + chunk, rows )
+		chunks.append( { "start": start, "stop": stop, "stats": [ get_stats( numpy.asarray( column[ start : stop ] ) ) for column in base ] } )
+
+	with open( tmp + "/" + META_FILE, "w" ) as f:
+		json.dump( { "mtime": mtime, "rows": rows, "chunks": chunks, "sims": sorted( sims.keys() ) }, f )
+
+	# Workers still using the previous store keep their mapped files
+	old = path + ".old"
+	shutil.rmtree( old, ignore_errors = True )
+	if os.path.exists( path ):
+		os.rename( path, old )
+	os.rename( tmp, path )
+	shutil.rmtree( old, ignore_errors = True )
+
+def get_sims( h5file ):
+	'''
+	Get the numbers of the simulations of a database, in increasing order; their groups are named "sim_NNN".
+	Other groups whose name starts with "sim_" are ignored.
+
+	- h5file: PyTables file of the database
+	'''
+
+	names = [ name for name in h5file.root._v_groups if name.startswith( "sim_" ) and name[ 4 : ].isdigit() ]
+
+	return sorted( [ int( name[ 4 : ] ) for name in names if name == "sim_{:03d}".format( int( name[ 4 : ] ) ) ] )
+
+def ingest( filename, config, evaluate, chunk = CHUNK_ROWS ):
+	'''
+	Evaluate all the fields of a database and write its store.
+	Returns the number of simulations.
+
+	- filename: Path of the HDF5 file of the database
+	- config: Definition of the database
+	- evaluate: Function evaluating a list of field definitions over a group of the HDF5 file, see hcds_responder_sph.SPHResponder.evaluate()
+	- chunk: Number of rows in each chunk of the base fields
+	'''
+
+	mtime = os.stat( filename ).st_mtime
+
+	with tables.open_file( filename ) as h5file:
+		base = [ numpy.asarray( column ) for column in evaluate( config[ "base_fields" ], h5file.root.base ) ]
+
+		sims = {}
+		for num in get_sims( h5file ):
+			sims[ num ] = [ numpy.asarray( column ) for column in evaluate( config[ "fields" ], h5file.get_node( "/sim_{:03d}".format( num ) ) ) ]
+
+	write( get_path( filename, config ), mtime, base, sims, chunk )
+
+	return len( sims )
+
+class Store( object ):
+	'''
+	Store of a database opened for reading; the columns are mapped into memory.
+	'''
+
+	def __init__( self, path, meta ):
+		'''
+		- path: Directory of the store
+		- meta: Description of the store, as written by write()
+		'''
+
+		self.path = path
+		self.meta = meta
+
+	def get_base( self, index ):
+		'''
+		Get a column of the base fields.
+
+		- index: Index of the field in the definitions
+		'''
+
+		return numpy.load( "{:s}/base/{:d}.npy".format( self.path, index ), mmap_mode = "r" )
+
+	def select_chunks( self, ranges ):
+		'''
+		Get the chunks of the base fields that may contain rows within the ranges, as a list of the first and last row + 1 of each chunk.
+
+		- ranges: Dictionary with the indices of the fields as keys and the lower and upper bounds as values; either bound may be None
+		'''
+
+		chunks = []
+
+		for chunk in self.meta[ "chunks" ]:
+			keep = True
+
+			for index, ( lower, upper ) in ranges.items():
+				stats = chunk[ "stats" ][ index ]
+				if stats is None or ( not lower is None and stats[ 1 ] < lower ) or ( not upper is None and stats[ 0 ] > upper ):
+					keep = False
+					break
+
+			if keep:
+				chunks.append( ( chunk[ "start" ], chunk[ "stop" ] ) )
+
+		return chunks
+
+	def get_chunk_count( self ):
+		'''
+		Get the total number of chunks of the base fields.
+		'''
+
+		return len( self.meta[ "chunks" ] )
+
+	def has_sim( self, num ):
+		'''
+		Check whether a simulation is in the store.
+
+		- num: Number of the simulation
+		'''
+
+		return num in self.meta[ "sims" ]
+
+	def get_sim( self, num, index ):
+		'''
+		Get a column of the fields of a simulation.
+
+		- num: Number of the simulation
+		- index: Index of the field in the definitions
+		'''
+
+		return numpy.load( "{:s}/sim_{:03d}/{:d}.npy".format( self.path, num, index ), mmap_mode = "r" )
+
+def open_store( filename, config, mtime ):
+	'''
+	Open the store of a database, or return None if there is none or if the HDF5 file was modified after it was written.
+
+	- filename: Path of the HDF5 file of the database
+	- config: Definition of the database
+	- mtime: Time of the last modification of the HDF5 file
+	'''
+
+	path = get_path( filename, config )
+
+	try:
+		with open( path + "/" + META_FILE ) as f:
+			meta = json.load( f )
+	except ( OSError, ValueError ):
+		return None
+
+	if meta[ "mtime" ] != mtime:
+		return None
+
+	return Store( path, meta )
+
+if __name__ == "__main__":
+	import hcds_config
+	import hcds_responder_db
+
+	parser = argparse.ArgumentParser( description = "Write the columnar stores of the databases of a \"db\" module of HCDS." )
+	parser.add_argument( "module", help = "Name of the module in hcds_config.MODS" )
+	parser.add_argument( "--chunk", type = int, default = CHUNK_ROWS, help = "Number of rows in each chunk of the base fields" )
+	args = parser.parse_args()
+
+	responder = hcds_responder_db.DBResponder( hcds_config.MODS[ args.module ][ 1 ] )
+
+	for key, item in responder.get_item_defs().items():
+		print( "{:s}: {:d} simulations written".format( key, ingest( item[ "file" ], item, responder.evaluate, args.chunk ) ) )
@@ -14,7 +14,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
+import hcds_json
 
 class HCDSException( Exception ):
 	'''
@@ -29,6 +29,9 @@ class HCDSException( Exception ):
 	def get_body( self ):
 		return b'500 Internal Server Error'
 
+	def get_headers( self ):
+		return []
+
 class NotFound( HCDSException ):
 	'''
 	Exception that renders an HTTP 404 "Not Found" error page.
@@ -61,4 +64,67 @@ class JSONBadRequest( HCDSException ):
 		return 'application/json'
 
 	def get_body( self ):
-		return bytes( json.dumps( self.data ), "utf-8" )
+		return hcds_json.dumps( self.data )
+
+class MethodNotAllowed( HCDSException ):
+	'''
+	Exception that renders an HTTP 405 "Method Not Allowed" error page.
+	'''
+
+	def get_status( self ):
+		return '405 Method Not Allowed'
+
+	def get_content_type( self ):
+		return 'text/plain'
+
+	def get_body( self ):
+		return b'405 Method Not Allowed'
+
+class Conflict( HCDSException ):
+	'''
+	Exception that renders an HTTP 409 "Conflict" error page, for a resource that is not in a state to fulfill the request.
+	'''
+
+	def get_status( self ):
+		return '409 Conflict'
+
+	def get_content_type( self ):
+		return 'text/plain'
+
+	def get_body( self ):
+		return b'409 Conflict'
+
+class PayloadTooLarge( HCDSException ):
+	'''
+	Exception that renders an HTTP 413 "Payload Too Large" error page.
+	'''
+
+	def get_status( self ):
+		return '413 Payload Too Large'
+
+	def get_content_type( self ):
+		return 'text/plain'
+
+	def get_body( self ):
+		return b'413 Payload Too Large'
+
+class ServiceUnavailable( HCDSException ):
+	'''
+	Exception that renders an HTTP 503 "Service Unavailable" error page, telling the client when to try again.
+	'''
+
+	def __init__( self, retry_after ):
+		HCDSException.__init__( self )
+		self.retry_after = retry_after
+
+	def get_status( self ):
+		return '503 Service Unavailable'
+
+	def get_content_type( self ):
+		return 'text/plain'
+
+	def get_body( self ):
+		return b'503 Service Unavailable'
+
+	def get_headers( self ):
+		return [ ( "Retry-After", "{:d}".format( self.retry_after ) ) ]
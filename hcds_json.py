@@ -0,0 +1,146 @@
+# HTTP Collision Data Server (HCDS) encoding of JSON responses.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import numpy
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+import hcds_config
+
+def masked( array, mask ):
+	'''
+	Get an array where the masked values are replaced by None, which are encoded as null.
+
+	- array: Array of values
+	- mask: Boolean array, true for the values to replace
+	'''
+
+	out = numpy.asarray( array ).astype( object )
+	out[ mask ] = None
+
+	return out
+
+def to_double( array ):
+	'''
+	Convert single-precision values to double precision, keeping the shortest decimal representation of each value.
+	Otherwise, a value such as 0.1 in single precision would be encoded as 0.10000000149011612.
+
+	- array: Array of single-precision values
+	'''
+
+	array = numpy.asarray( array )
+	out = array.astype( numpy.float64 )
+
+	select = numpy.isfinite( out ) & ( out != 0. )
+	values = out[ select ]
+	exponent = numpy.floor( numpy.log10( numpy.abs( values ) ) )
+
+	# Values are rounded to an increasing number of significant digits, until they are the same in single precision; 9 digits are always enough
+	todo = numpy.arange( len( values ) )
+	for digits in range( 1, 10 ):
+		power = digits - 1 - exponent[ todo ]
+		scale = 10. ** numpy.abs( power )
+
+		with numpy.errstate( over = "ignore", invalid = "ignore" ):
+			rounded = numpy.where( power >= 0, numpy.round( values[ todo ] * scale ) / scale, numpy.round( values[ todo ] / scale ) * scale )
+
+		same = rounded.astype( array.dtype ) == values[ todo ].astype( array.dtype )
+		values[ todo[ same ] ] = rounded[ same ]
+		todo = todo[ ~same ]
+
+		if len( todo ) == 0:
+			break
+
+	out[ select ] = values
+
+	return out
+
+def to_list( array ):
+	'''
+	Convert an array to nested lists of Python values, where non-finite floating-point values are replaced by None.
+
+	- array: Array to convert
+	'''
+
+	array = numpy.asarray( array )
+
+	if array.dtype.kind == "f" and array.dtype.itemsize < 8:
+		array = to_double( array )
+
+	if array.dtype.kind in "fc":
+		mask = ~numpy.isfinite( array )
+		if mask.any():
+			return masked( array, mask ).tolist()
+
+	return array.tolist()
+
+def rows( columns ):
+	'''
+	Combine columns of values into rows, encoded as a list of lists.
+
+	- columns: List of arrays of the same length
+	'''
+
+	columns = [ numpy.asarray( column ) for column in columns ]
+
+	# Floating-point columns can be combined into one array, which is encoded without going through Python values
+	if all( [ column.dtype.kind == "f" for column in columns ] ):
+		return numpy.stack( columns, axis = 1 )
+
+	return [ list( row ) for row in zip( *[ to_list( column ) for column in columns ] ) ]
+
+def records( names, columns ):
+	'''
+	Combine columns of values into records, encoded as a list of objects.
+
+	- names: Names of the columns, used as keys of the objects
+	- columns: List of arrays of the same length
+	'''
+
+	return [ dict( zip( names, row ) ) for row in zip( *[ to_list( column ) for column in columns ] ) ]
+
+def default( obj ):
+	'''
+	Convert the objects that are not natively supported by the encoders.
+	'''
+
+	if isinstance( obj, numpy.ndarray ):
+		return to_list( obj )
+	elif isinstance( obj, numpy.floating ) and obj.itemsize < 8:
+		return to_double( obj ).item()
+	elif isinstance( obj, numpy.generic ):
+		return obj.item()
+
+	raise TypeError( "Object of type {:s} is not JSON serializable".format( type( obj ).__name__ ) )
+
+def dumps( data ):
+	'''
+	Encode an object in JSON.
+	Numpy arrays and scalars are supported, and non-finite values in arrays are encoded as null.
+	orjson is used if it is installed, unless JSON_ENCODER is set to "json".
+
+	- data: Object to encode
+	'''
+
+	if not orjson is None and hcds_config.JSON_ENCODER != "json":
+		return orjson.dumps( data, default = default, option = orjson.OPT_SERIALIZE_NUMPY )
+
+	return bytes( json.dumps( data, default = default ), "utf-8" )
@@ -0,0 +1,345 @@
+# HTTP Collision Data Server (HCDS) materialized fields of the "sph" and "db" modules.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The expressions of the fields are evaluated once and their values are written as .npy files, at the place of the sidecar exports of hcds_mmap.py.
+# They are only used while they are more recent than the HDF5 file.
+# With --in-file, the values are written in the HDF5 file instead, for each group in a child group named FIELDS_GROUP.
+# Each dataset is named after a hash of its expression, which is also kept in its "expr" attribute, so that it is only used while the definition is the same.
+# Its "stamp" attribute is the modification time of the HDF5 file, which is set once the values are written, so that it is only used while the file is not modified.
+# Its "source" attribute keeps the shape, type and checksum of the datasets used by the expression; only their shape and type are checked when the fields are looked up.
+# With --verify, the checksums are checked instead, and the fields whose source datasets did not change are stamped again so that they are used again after the file was modified.
+# Writing to the HDF5 file changes its modification time, so the sidecar exports of hcds_mmap.py and the stores of hcds_db_store.py must be written again afterwards.
+#
+# Usage: python hcds_materialize.py MODULE [--in-file | --verify]
+# where MODULE is the name of a "sph" or "db" module in hcds_config.MODS.
+
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy
+import tables
+
+import hcds_mmap
+
+# Name of the group containing the materialized fields of a group
+FIELDS_GROUP = "_hcds_fields"
+
+def get_name( expr ):
+	'''
+	Get the name of the dataset containing the values of an expression.
+
+	- expr: Expression of the field
+	'''
+
+	return "h" + hashlib.sha1( bytes( expr, "utf-8" ) ).hexdigest()
+
+def get_path( group, expr ):
+	'''
+	Get the path of the dataset containing the values of an expression within the HDF5 file.
+
+	- group: Name of the group over which the expression is evaluated
+	- expr: Expression of the field
+	'''
+
+	return "/" + group + "/" + FIELDS_GROUP + "/" + get_name( expr )
+
+def get_sources( responder, expr, datasets ):
+	'''
+	Get the names of the datasets used by an expression.
+
+	- responder: hcds_responder_sph.SPHResponder object used to parse the expression
+	- expr: Expression of the field
+	- datasets: Shape and type of each dataset of the group, see hcds_responder_sph.ItemPlan
+	'''
+
+	names = set()
+
+	def get_var( var ):
+		names.add( var )
+		return numpy.zeros( (), datasets[ var ][ 1 ] )
+
+	with numpy.errstate( all = "ignore" ):
+		responder.compile( expr )( var = get_var )
+
+	return sorted( names )
+
+def get_info( group, name ):
+	'''
+	Get the shape and type of a dataset, without reading it, as a list that can be serialized to JSON.
+
+	- group: PyTables group containing the dataset
+	- name: Name of the dataset
+	'''
+
+	leaf = getattr( group, name )
+
+	return [ name, [ int( n ) for n in leaf.shape ], numpy.dtype( leaf.dtype ).str ]
+
+def get_fingerprint( group, name ):
+	'''
+	Get the shape, type and checksum of a dataset, as a list that can be serialized to JSON.
+
+	- group: PyTables group containing the dataset
+	- name: Name of the dataset
+	'''
+
+	data = numpy.ascontiguousarray( getattr( group, name )[ ... ] )
+
+	return get_info( group, name ) + [ hashlib.sha1( data.view( numpy.uint8 ) ).hexdigest() ]
+
+def get_stamp( filename ):
+	'''
+	Get the stamp of an HDF5 file, which is its modification time in nanoseconds.
+
+	- filename: Path of the HDF5 file
+	'''
+
+	return os.stat( filename ).st_mtime_ns
+
+def get_fields( h5file ):
+	'''
+	Get the datasets of all the fields materialized in an HDF5 file.
+
+	- h5file: PyTables file
+	'''
+
+	return [ leaf for group in h5file.walk_groups() if group._v_name == FIELDS_GROUP for leaf in group._f_iter_nodes( "Leaf" ) ]
+
+def get_stamped( h5file, stamp ):
+	'''
+	Get the paths of the datasets of materialized fields that have a given stamp.
+
+	- h5file: PyTables file
+	- stamp: Stamp of the file, see get_stamp()
+	'''
+
+	return [ leaf._v_pathname for leaf in get_fields( h5file ) if "stamp" in leaf._v_attrs and leaf._v_attrs[ "stamp" ] == stamp ]
+
+def write_stamps( h5file, paths ):
+	'''
+	Stamp datasets of materialized fields before the HDF5 file is closed.
+	Returns the stamp, which must be set with set_stamp() once the file is closed.
+
+	- h5file: PyTables file, opened for writing
+	- paths: Paths of the datasets
+	'''
+
+	stamp = time.time_ns()
+
+	for path in set( paths ):
+		h5file.get_node( path )._v_attrs[ "stamp" ] = stamp
+
+	return stamp
+
+def set_stamp( filename, stamp ):
+	'''
+	Set the modification time of an HDF5 file to the stamp of its materialized fields.
+
+	- filename: Path of the HDF5 file
+	- stamp: Stamp returned by write_stamps()
+	'''
+
+	os.utime( filename, ns = ( stamp, stamp ) )
+
+def find( h5file, group ):
+	'''
+	Find the materialized fields of a group, as a dictionary with the names of the datasets as keys and the source of their values as values, either "file" or "sidecar".
+	Datasets whose "expr" attribute does not match their name, whose stamp is not the one of the file or whose source datasets changed shape or type, and sidecar files older than the HDF5 file, are ignored.
+	The source datasets are not read; their checksums are only checked by verify().
+
+	- h5file: PyTables file
+	- group: Name of the group
+	'''
+
+	found = {}
+
+	try:
+		node = h5file.get_node( "/" + group + "/" + FIELDS_GROUP )
+	except tables.NoSuchNodeError:
+		node = None
+
+	if not node is None:
+		stamp = get_stamp( h5file.filename )
+
+		for leaf in node._f_iter_nodes( "Leaf" ):
+			attrs = leaf._v_attrs
+			if not "expr" in attrs or not "source" in attrs or not "stamp" in attrs or attrs[ "stamp" ] != stamp or get_name( attrs[ "expr" ] ) != leaf._v_name:
+				continue
+
+			try:
+				valid = all( [ get_info( node._v_parent, item[ 0 ] ) == item[ : 3 ] for item in json.loads( attrs[ "source" ] ) ] )
+			except ( ValueError, tables.NoSuchNodeError ):
+				continue
+
+			if valid:
+				found[ leaf._v_name ] = "file"
+
+	path = h5file.filename + hcds_mmap.SIDECAR_SUFFIX + "/" + group + "/" + FIELDS_GROUP
+
+	try:
+		names = os.listdir( path )
+		mtime = os.stat( h5file.filename ).st_mtime
+	except OSError:
+		names = []
+
+	for name in names:
+		if name.endswith( ".npy" ) and not name[ : -4 ] in found and os.stat( path + "/" + name ).st_mtime >= mtime:
+			found[ name[ : -4 ] ] = "sidecar"
+
+	return found
+
+def load_sidecar( filename, group, expr ):
+	'''
+	Map the sidecar file containing the values of an expression into memory.
+
+	- filename: Path of the HDF5 file
+	- group: Name of the group over which the expression is evaluated
+	- expr: Expression of the field
+	'''
+
+	return numpy.asarray( numpy.load( hcds_mmap.get_sidecar( filename, get_path( group, expr ) ), mmap_mode = "r" ) )
+
+def materialize( responder, plan, sidecar ):
+	'''
+	Evaluate the fields of an item over all its groups, and write their values.
+	Returns the number of written datasets.
+
+	- responder: hcds_responder_sph.SPHResponder object used to evaluate the expressions
+	- plan: Plan of the item, see hcds_responder_sph.ItemPlan
+	- sidecar: Whether to write the values to sidecar files rather than to the HDF5 file
+	'''
+
+	filename = plan.config[ "file" ]
+	count = 0
+	stamp = None if sidecar else get_stamp( filename )
+
+	with tables.open_file( filename, "r" if sidecar else "a" ) as h5file:
+		# The fields that are currently used are stamped again along with the new ones
+		paths = [] if sidecar else get_stamped( h5file, stamp )
+
+		for defs_key, groups in plan.groups.items():
+			defs = plan.config[ defs_key ]
+
+			for group in groups:
+				node = h5file.get_node( "/" + group )
+				values = responder.evaluate( defs, node )
+
+				for item, value in zip( defs, values ):
+					path = get_path( group, item[ "data" ] )
+
+					if sidecar:
+						name = hcds_mmap.get_sidecar( filename, path )
+						os.makedirs( os.path.dirname( name ), exist_ok = True )
+
+						# Written to a temporary file first, so that workers never map a partial file
+						with open( name + ".tmp", "wb" ) as f:
+							numpy.save( f, numpy.asarray( value ) )
+						os.replace( name + ".tmp", name )
+					else:
+						if path in h5file:
+							h5file.remove_node( path )
+
+						source = [ get_fingerprint( node, name ) for name in get_sources( responder, item[ "data" ], plan.datasets[ group ] ) ]
+
+						leaf = h5file.create_array( "/" + group + "/" + FIELDS_GROUP, get_name( item[ "data" ] ), numpy.asarray( value ), createparents = True )
+						leaf._v_attrs[ "expr" ] = item[ "data" ]
+						leaf._v_attrs[ "source" ] = json.dumps( source )
+						paths.append( leaf._v_pathname )
+
+					count += 1
+
+		if not sidecar and count > 0:
+			stamp = write_stamps( h5file, paths )
+
+	if not sidecar and count > 0:
+		set_stamp( filename, stamp )
+
+	# The plans of the workers depend on the modification time of the directory of the sidecar files
+	if sidecar and count > 0:
+		os.utime( filename + hcds_mmap.SIDECAR_SUFFIX )
+
+	return count
+
+def verify( filename ):
+	'''
+	Check the checksums of the source datasets of all the fields materialized in an HDF5 file.
+	The fields whose source datasets did not change are stamped again, so that they are used again after the file was modified; the others are removed.
+	Returns the number of fields that were kept and removed.
+
+	- filename: Path of the HDF5 file
+	'''
+
+	paths = []
+	removed = 0
+
+	with tables.open_file( filename, "a" ) as h5file:
+		for leaf in get_fields( h5file ):
+			attrs = leaf._v_attrs
+			if not "expr" in attrs or not "source" in attrs or get_name( attrs[ "expr" ] ) != leaf._v_name:
+				continue
+
+			try:
+				valid = all( [ get_fingerprint( leaf._v_parent._v_parent, item[ 0 ] ) == item for item in json.loads( attrs[ "source" ] ) ] )
+			except ( ValueError, tables.NoSuchNodeError ):
+				valid = False
+
+			if valid:
+				paths.append( leaf._v_pathname )
+			else:
+				leaf._f_remove()
+				removed += 1
+
+		if len( paths ) > 0:
+			stamp = write_stamps( h5file, paths )
+
+	if len( paths ) > 0:
+		set_stamp( filename, stamp )
+
+	return len( paths ), removed
+
+if __name__ == "__main__":
+	import hcds_config
+	import hcds_responder_db
+	import hcds_responder_set
+
+	parser = argparse.ArgumentParser( description = "Evaluate the fields of a \"sph\" or \"db\" module of HCDS once and write their values." )
+	parser.add_argument( "module", help = "Name of the module in hcds_config.MODS" )
+	group = parser.add_mutually_exclusive_group()
+	group.add_argument( "--in-file", action = "store_true", help = "Write the values to the HDF5 files instead of .npy files next to them; the sidecar exports and the stores must be written again afterwards" )
+	group.add_argument( "--verify", action = "store_true", help = "Check the checksums of the source datasets of the values written to the HDF5 files instead, remove the values whose sources changed and use the others again" )
+	args = parser.parse_args()
+
+	name, config = hcds_config.MODS[ args.module ]
+
+	# The values are evaluated from the datasets, never from values materialized before
+	config = dict( config, mmap = False, materialized = False )
+
+	if name == "sph":
+		responder = hcds_responder_set.SetResponder( config )
+	elif name == "db":
+		responder = hcds_responder_db.DBResponder( config )
+	else:
+		parser.error( "module {:s} is neither a \"sph\" nor a \"db\" module".format( args.module ) )
+
+	plans = responder.get_plans()
+	for key in plans:
+		if args.verify:
+			print( "{:s}: {:d} fields kept, {:d} fields removed".format( key, *verify( plans[ key ].config[ "file" ] ) ) )
+		else:
+			print( "{:s}: {:d} fields written".format( key, materialize( responder, plans[ key ], not args.in_file ) ) )
@@ -0,0 +1,356 @@
+# HTTP Collision Data Server (HCDS) metrics of the requests.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit
+import json
+import math
+import os
+import threading
+import time
+
+import hcds_compress
+import hcds_config
+
+# Upper bounds of the buckets of the latency histograms, in seconds
+LATENCY_BUCKETS = [ 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., math.inf ]
+
+# Upper bounds of the buckets of the histograms of the number of items computed in a request
+COUNT_BUCKETS = [ 1., 10., 100., 1000., 10000., 100000., math.inf ]
+
+HELP = {
+	"hcds_requests_total": ( "counter", "Number of requests handled" ),
+	"hcds_request_errors_total": ( "counter", "Number of requests that ended with an exception" ),
+	"hcds_request_duration_seconds": ( "histogram", "Time to handle a request" ),
+	"hcds_request_phase_seconds_total": ( "counter", "Time spent in each phase of the requests" ),
+	"hcds_response_bytes_total": ( "counter", "Size of the bodies of the responses" ),
+	"hcds_request_evaluations": ( "histogram", "Number of collisions resolved by collresolve in a request" ),
+	"hcds_cache_hits_total": ( "counter", "Number of lookups found in the in-memory caches" ),
+	"hcds_cache_misses_total": ( "counter", "Number of lookups not found in the in-memory caches" ),
+	"hcds_cache_hit_ratio": ( "gauge", "Fraction of the lookups found in the in-memory caches" ),
+}
+
+def is_alive( pid ):
+	'''
+	Check whether a process is running.
+
+	- pid: Identifier of the process
+	'''
+
+	try:
+		os.kill( pid, 0 )
+	except ProcessLookupError:
+		return False
+	except PermissionError:
+		pass
+
+	return True
+
+def make_labels( labels ):
+	'''
+	Convert a dictionary of labels into a hashable and sorted form.
+	'''
+
+	return tuple( sorted( ( str( key ), str( value ) ) for key, value in labels.items() ) )
+
+def format_labels( labels, extra = None ):
+	'''
+	Format labels for the Prometheus text exposition format.
+
+	- labels: Labels as returned by make_labels()
+	- extra: Additional label, as a (name, value) tuple
+	'''
+
+	items = list( labels )
+	if not extra is None:
+		items.append( extra )
+
+	if len( items ) == 0:
+		return ""
+
+	return "{" + ",".join( [ "{:s}=\"{:s}\"".format( key, value.replace( "\\", "\\\\" ).replace( "\"", "\\\"" ).replace( "\n", "\\n" ) ) for key, value in items ] ) + "}"
+
+def format_value( value ):
+	'''
+	Format a number for the Prometheus text exposition format.
+	'''
+
+	if value == math.inf:
+		return "+Inf"
+
+	return repr( float( value ) )
+
+class Registry( object ):
+	'''
+	Counters and histograms of the current process.
+	When a directory is given, the values are periodically written to a file specific to the process,
+	so that the values of all the workers can be summed up by any of them.
+	'''
+
+	def __init__( self, path = None, interval = 1. ):
+		'''
+		- path: Directory where to store the values of each process, or None to keep them only in memory
+		- interval: Minimum time in seconds between two writes of the values of the process
+		'''
+
+		self.path = path
+		self.interval = interval
+		self.lock = threading.Lock()
+		self.counters = {}
+		self.histograms = {}
+		self.written = 0.
+
+	def inc( self, name, value = 1., **labels ):
+		'''
+		Increase a counter.
+
+		- name: Name of the metric
+		- value: Amount to add
+		- labels: Labels of the metric
+		'''
+
+		key = ( name, make_labels( labels ) )
+
+		with self.lock:
+			self.counters[ key ] = self.counters.get( key, 0. ) + value
+
+	def set( self, name, value, **labels ):
+		'''
+		Set a counter that is maintained elsewhere in the process, such as the statistics of a cache.
+
+		- name: Name of the metric
+		- value: Current value
+		- labels: Labels of the metric
+		'''
+
+		key = ( name, make_labels( labels ) )
+
+		with self.lock:
+			self.counters[ key ] = float( value )
+
+	def observe( self, name, value, buckets = LATENCY_BUCKETS, **labels ):
+		'''
+		Add an observation to a histogram.
+
+		- name: Name of the metric
+		- value: Observed value
+		- buckets: Upper bounds of the buckets, the last one being infinite
+		- labels: Labels of the metric
+		'''
+
+		key = ( name, make_labels( labels ) )
+
+		with self.lock:
+			if not key in self.histograms:
+				self.histograms[ key ] = { "buckets": list( buckets ), "counts": [ 0 ] * len( buckets ), "sum": 0., "count": 0 }
+
+			hist = self.histograms[ key ]
+			for i, bound in enumerate( hist[ "buckets" ] ):
+				if value <= bound:
+					hist[ "counts" ][ i ] += 1
+					break
+
+			hist[ "sum" ] += value
+			hist[ "count" ] += 1
+
+	def dump( self ):
+		'''
+		Get the values of the process in a form that can be serialized to JSON.
+		'''
+
+		with self.lock:
+			return {
+				"counters": [ [ name, list( labels ), value ] for ( name, labels ), value in self.counters.items() ],
+				"histograms": [ [ name, list( labels ), [ format_value( bound ) for bound in hist[ "buckets" ] ], list( hist[ "counts" ] ), hist[ "sum" ], hist[ "count" ] ] for ( name, labels ), hist in self.histograms.items() ],
+			}
+
+	def flush( self, force = False ):
+		'''
+		Write the values of the process to its file.
+
+		- force: Whether to write even if the last write is more recent than the interval
+		'''
+
+		if self.path is None:
+			return
+
+		now = time.monotonic()
+		if not force and now - self.written < self.interval:
+			return
+
+		self.written = now
+
+		os.makedirs( self.path, exist_ok = True )
+
+		name = os.path.join( self.path, "{:d}.json".format( os.getpid() ) )
+		tmp = name + ".tmp"
+
+		with open( tmp, "w" ) as f:
+			json.dump( self.dump(), f )
+
+		os.replace( tmp, name )
+
+	def remove( self ):
+		'''
+		Remove the file of the process, once it stops; the values of the processes that stopped are not reported anymore.
+		'''
+
+		if self.path is None:
+			return
+
+		try:
+			os.remove( os.path.join( self.path, "{:d}.json".format( os.getpid() ) ) )
+		except OSError:
+			pass
+
+	def collect( self ):
+		'''
+		Get the values summed over all the running processes; the files left by the processes that stopped are removed.
+		Returns a tuple of two dictionaries, one for the counters and one for the histograms.
+		'''
+
+		if self.path is None:
+			dumps = [ self.dump() ]
+		else:
+			self.flush( True )
+
+			dumps = []
+			for entry in sorted( os.listdir( self.path ) ):
+				if not entry.endswith( ".json" ) or not entry[ : -5 ].isdigit():
+					continue
+
+				if not is_alive( int( entry[ : -5 ] ) ):
+					try:
+						os.remove( os.path.join( self.path, entry ) )
+					except OSError:
+						pass
+
+					continue
+
+				try:
+					with open( os.path.join( self.path, entry ), "r" ) as f:
+						dumps.append( json.load( f ) )
+				except ( OSError, ValueError ):
+					continue
+
+		counters = {}
+		histograms = {}
+
+		for dump in dumps:
+			for name, labels, value in dump[ "counters" ]:
+				key = ( name, tuple( tuple( item ) for item in labels ) )
+				counters[ key ] = counters.get( key, 0. ) + value
+
+			for name, labels, buckets, counts, total, count in dump[ "histograms" ]:
+				key = ( name, tuple( tuple( item ) for item in labels ) )
+				if not key in histograms:
+					histograms[ key ] = { "buckets": buckets, "counts": [ 0 ] * len( buckets ), "sum": 0., "count": 0 }
+
+				hist = histograms[ key ]
+				if hist[ "buckets" ] != buckets:
+					continue
+
+				hist[ "counts" ] = [ a + b for a, b in zip( hist[ "counts" ], counts ) ]
+				hist[ "sum" ] += total
+				hist[ "count" ] += count
+
+		return counters, histograms
+
+	def expose( self ):
+		'''
+		Get the values summed over all the processes in the Prometheus text exposition format.
+		'''
+
+		counters, histograms = self.collect()
+
+		# Hit ratio of the caches, derived from the summed hits and misses
+		for ( name, labels ), hits in list( counters.items() ):
+			if name != "hcds_cache_hits_total":
+				continue
+
+			total = hits + counters.get( ( "hcds_cache_misses_total", labels ), 0. )
+			if total > 0.:
+				counters[ ( "hcds_cache_hit_ratio", labels ) ] = hits / total
+
+		lines = []
+		names = sorted( set( [ name for name, labels in counters ] + [ name for name, labels in histograms ] ) )
+
+		for name in names:
+			if name in HELP:
+				lines.append( "# HELP {:s} {:s}".format( name, HELP[ name ][ 1 ] ) )
+				lines.append( "# TYPE {:s} {:s}".format( name, HELP[ name ][ 0 ] ) )
+
+			for ( cur, labels ), value in sorted( counters.items() ):
+				if cur == name:
+					lines.append( "{:s}{:s} {:s}".format( name, format_labels( labels ), format_value( value ) ) )
+
+			for ( cur, labels ), hist in sorted( histograms.items() ):
+				if cur != name:
+					continue
+
+				cumul = 0
+				for bound, count in zip( hist[ "buckets" ], hist[ "counts" ] ):
+					cumul += count
+					lines.append( "{:s}_bucket{:s} {:d}".format( name, format_labels( labels, ( "le", bound ) ), cumul ) )
+
+				lines.append( "{:s}_sum{:s} {:s}".format( name, format_labels( labels ), format_value( hist[ "sum" ] ) ) )
+				lines.append( "{:s}_count{:s} {:d}".format( name, format_labels( labels ), hist[ "count" ] ) )
+
+		return "\n".join( lines ) + "\n"
+
+registry = Registry( hcds_config.METRICS_DIR, hcds_config.METRICS_INTERVAL )
+atexit.register( registry.remove )
+
+def record_request( module, route, responder, exception = None, caches = None ):
+	'''
+	Record the metrics of a request that has been handled.
+
+	- module: Name of the module as given in hcds_config.MODS, or an empty string if it is not known
+	- route: First component of the path inside the module
+	- responder: The hcds_responder_base.BaseResponder object that provided the response
+	- exception: The hcds_exception.HCDSException raised while handling the request, if any
+	- caches: In-memory caches of the module, if they are not provided by the responder
+	'''
+
+	if caches is None:
+		caches = responder.get_caches()
+
+	status = responder.status.split( " " )[ 0 ]
+	timings = responder.get_timings()
+
+	registry.inc( "hcds_requests_total", module = module, route = route, status = status )
+	if not exception is None:
+		registry.inc( "hcds_request_errors_total", module = module, route = route, exception = type( exception ).__name__ )
+
+	registry.observe( "hcds_request_duration_seconds", timings.get( "total", 0. ), module = module, route = route )
+	for phase, duration in timings.items():
+		if phase != "total":
+			registry.inc( "hcds_request_phase_seconds_total", duration, module = module, route = route, phase = phase )
+
+	registry.inc( "hcds_response_bytes_total", sum( [ len( item ) for item in responder.get_output() ] ), module = module, route = route )
+
+	counts = responder.get_counts()
+	if "evaluations" in counts:
+		registry.observe( "hcds_request_evaluations", counts[ "evaluations" ], COUNT_BUCKETS, module = module, route = route )
+
+	for name, cache in caches.items():
+		registry.set( "hcds_cache_hits_total", cache.hits, module = module, cache = name )
+		registry.set( "hcds_cache_misses_total", cache.misses, module = module, cache = name )
+
+	# The compressed responses are shared by all the modules
+	registry.set( "hcds_cache_hits_total", hcds_compress.cache.hits, module = "", cache = "compress" )
+	registry.set( "hcds_cache_misses_total", hcds_compress.cache.misses, module = "", cache = "compress" )
+
+	registry.flush()
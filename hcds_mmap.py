@@ -0,0 +1,154 @@
+# HTTP Collision Data Server (HCDS) memory-mapped datasets of HDF5 files.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Datasets are mapped read-only into memory instead of being copied, so that all the workers share the pages of the operating system's cache.
+# Two sources are supported:
+# - the dataset itself, if it is stored contiguously and without filters in the HDF5 file; its offset is obtained with h5py, if it is installed,
+# - a sidecar .npy export of the dataset, written by this script, which works for any layout.
+#
+# Usage: python hcds_mmap.py FILE.h5 [FILE.h5 ...]
+
+import argparse
+import os
+
+import numpy
+import tables
+
+try:
+	import h5py
+except ImportError:
+	h5py = None
+
+# Suffix of the directory containing the sidecar exports of the datasets of an HDF5 file
+SIDECAR_SUFFIX = ".npy.d"
+
+def get_sidecar( filename, path ):
+	'''
+	Get the path of the sidecar export of a dataset.
+
+	- filename: Path of the HDF5 file
+	- path: Path of the dataset within the file, starting with "/"
+	'''
+
+	return filename + SIDECAR_SUFFIX + path + ".npy"
+
+def is_contiguous( node ):
+	'''
+	Check whether a dataset is stored as one contiguous block of the HDF5 file that can be mapped as is.
+
+	- node: PyTables node of the dataset
+	'''
+
+	return isinstance( node, tables.Array ) and node.chunkshape is None and node.filters.complevel == 0 and not node.filters.fletcher32 and node.dtype.kind in "biuf"
+
+def map_offset( node ):
+	'''
+	Map a contiguous dataset at its offset in the HDF5 file, or return None if it is not possible.
+
+	- node: PyTables node of the dataset
+	'''
+
+	if h5py is None or not is_contiguous( node ):
+		return None
+
+	filename = node._v_file.filename
+
+	with h5py.File( filename, "r" ) as h5file:
+		dataset = h5file[ node._v_pathname ]
+		offset = dataset.id.get_offset()
+		dtype = dataset.dtype
+		shape = dataset.shape
+
+	# The storage of empty or unwritten datasets is not allocated
+	if offset is None or numpy.prod( shape ) == 0:
+		return None
+
+	return numpy.memmap( filename, dtype = dtype, mode = "r", offset = offset, shape = shape )
+
+def map_sidecar( node ):
+	'''
+	Map the sidecar export of a dataset, or return None if there is none or if it is older than the HDF5 file.
+
+	- node: PyTables node of the dataset
+	'''
+
+	filename = node._v_file.filename
+	sidecar = get_sidecar( filename, node._v_pathname )
+
+	try:
+		if os.stat( sidecar ).st_mtime < os.stat( filename ).st_mtime:
+			return None
+	except OSError:
+		return None
+
+	array = numpy.load( sidecar, mmap_mode = "r" )
+	if array.shape != node.shape:
+		return None
+
+	return array
+
+def map_node( node ):
+	'''
+	Map a dataset into memory, from its sidecar export if there is one, or else from the HDF5 file.
+	Returns a read-only array, or None if the dataset cannot be mapped.
+
+	- node: PyTables node of the dataset
+	'''
+
+	array = map_sidecar( node )
+	if array is None:
+		array = map_offset( node )
+
+	if array is None:
+		return None
+
+	return numpy.asarray( array )
+
+def export( filename ):
+	'''
+	Write the sidecar exports of all the numerical datasets of an HDF5 file.
+	Returns the number of exported datasets.
+
+	- filename: Path of the HDF5 file
+	'''
+
+	count = 0
+
+	with tables.open_file( filename, "r" ) as h5file:
+		for node in h5file.walk_nodes( "/", "Array" ):
+			if node.dtype.kind not in "biuf":
+				continue
+
+			sidecar = get_sidecar( filename, node._v_pathname )
+			os.makedirs( os.path.dirname( sidecar ), exist_ok = True )
+
+			# Written to a temporary file first, so that workers never map a partial export
+			tmp = sidecar + ".tmp"
+			with open( tmp, "wb" ) as f:
+				numpy.save( f, numpy.asarray( node[ ... ] ) )
+			os.replace( tmp, sidecar )
+
+			count += 1
+
+	return count
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser( description = "Export the datasets of HDF5 files to .npy files that HCDS maps into memory." )
+	parser.add_argument( "files", nargs = "+", help = "HDF5 files to export" )
+	args = parser.parse_args()
+
+	for filename in args.files:
+		print( "{:s}: {:d} datasets exported".format( filename, export( filename ) ) )
@@ -0,0 +1,113 @@
+# HTTP Collision Data Server (HCDS) profiling of requests.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import random
+import time
+import urllib.parse
+
+import hcds_config
+
+def is_requested( environ, query ):
+	'''
+	Check whether the profiling of a request has been explicitly asked for, with the "profile" parameter or the "X-HCDS-Profile" header set to PROFILE_TOKEN.
+
+	- environ: WSGI environment
+	- query: Query string of the request
+	'''
+
+	if hcds_config.PROFILE_TOKEN is None:
+		return False
+
+	tokens = urllib.parse.parse_qs( query ).get( "profile", [] )
+	if "HTTP_X_HCDS_PROFILE" in environ:
+		tokens.append( environ[ "HTTP_X_HCDS_PROFILE" ] )
+
+	for token in tokens:
+		if hmac.compare_digest( token.encode( "utf-8" ), hcds_config.PROFILE_TOKEN.encode( "utf-8" ) ):
+			return True
+
+	return False
+
+def start( environ, query ):
+	'''
+	Start profiling a request if it has been asked for, or if it is selected by PROFILE_RATE.
+	Returns a tuple of the cProfile.Profile object, or None if the request is not profiled, and whether the profile was explicitly asked for.
+
+	- environ: WSGI environment
+	- query: Query string of the request
+	'''
+
+	requested = is_requested( environ, query )
+
+	if not requested and ( hcds_config.PROFILE_DIR is None or random.random() >= hcds_config.PROFILE_RATE ):
+		return None, False
+
+	profiler = cProfile.Profile()
+	profiler.enable()
+
+	return profiler, requested
+
+def get_report( profiler, limit = 50 ):
+	'''
+	Get a text report of a profile, sorted by cumulative time.
+
+	- profiler: The cProfile.Profile object
+	- limit: Maximum number of functions in the report
+	'''
+
+	out = io.StringIO()
+	stats = pstats.Stats( profiler, stream = out )
+	stats.sort_stats( "cumulative" ).print_stats( limit )
+
+	return out.getvalue()
+
+def finish( profiler, requested, responder, module, route ):
+	'''
+	Stop profiling a request and provide its profile.
+	If PROFILE_DIR is set, the profile is written there in the pstats format and its name is given in the "X-HCDS-Profile" header of the response.
+	Otherwise, if the profile was explicitly asked for, the body of the response is replaced by a text report, which must not be cached by clients or proxies.
+
+	- profiler: The cProfile.Profile object returned by start(), or None if the request is not profiled
+	- requested: Whether the profile was explicitly asked for
+	- responder: The hcds_responder_base.BaseResponder object that provided the response
+	- module: Name of the module as given in hcds_config.MODS
+	- route: First component of the path inside the module
+	'''
+
+	if profiler is None:
+		return
+
+	profiler.disable()
+
+	if not hcds_config.PROFILE_DIR is None:
+		now = time.time()
+		name = "{:s}.{:06d}-{:d}-{:s}-{:s}.pstats".format( time.strftime( "%Y%m%d-%H%M%S", time.gmtime( now ) ), int( ( now % 1. ) * 1.e6 ), os.getpid(), module or "none", route or "none" )
+		name = "".join( [ c if c.isalnum() or c in "-_." else "_" for c in name ] )
+
+		os.makedirs( hcds_config.PROFILE_DIR, exist_ok = True )
+		profiler.dump_stats( os.path.join( hcds_config.PROFILE_DIR, name ) )
+
+		responder.add_header( "X-HCDS-Profile", name )
+	elif requested:
+		responder.validators = []
+		responder.start( "200 OK", [ ( "Content-Type", "text/plain; charset=utf-8" ), ( "Cache-Control", "no-store" ) ] )
+		responder.clear_output()
+		responder.add_output( bytes( get_report( profiler ), "utf-8" ) )
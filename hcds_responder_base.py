@@ -14,14 +14,26 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import contextlib
+import email.utils
+import hashlib
 import math
+import time
 import urllib.parse
 
+import hcds_admission
+import hcds_cache
+import hcds_compress
 import hcds_config
+import hcds_exception
+import hcds_json
+import hcds_singleflight
 
 class BaseResponder( object ):
 	def __init__( self, config ):
 		self.config = config
+		self.flight = None
+		self.admission = None
 		self.clean()
 
 	def clean( self ):
@@ -29,12 +41,28 @@ class BaseResponder( object ):
 		Clean the object as preparation for a new request.
 		'''
 
+		# Requests waiting for the result of a request that failed compute it themselves
+		if not self.flight is None:
+			hcds_singleflight.leave( self.flight, None )
+			self.flight = None
+
+		self.release()
+
 		self.environ = None
 		self.start_response = None
 		self.url = None
 		self.query = None
 		self.sub = None
 		self.out = []
+		self.status = None
+		self.headers = None
+		self.base_headers = None
+		self.timings = {}
+		self.counts = {}
+		self.validators = []
+
+		# Whether the request may share its computation with identical requests, see check_validators()
+		self.singleflight = True
 
 	def get_config( self, key, default = None ):
 		'''
@@ -92,6 +120,26 @@ class BaseResponder( object ):
 		else:
 			return default
 
+	def get_body( self, limit = None ):
+		'''
+		Read the body of the request.
+
+		- limit: Maximum size of the body in bytes; if it is larger, hcds_exception.PayloadTooLarge is raised
+		'''
+
+		try:
+			length = int( self.get_env( "CONTENT_LENGTH", "0" ) or "0" )
+		except ValueError:
+			length = 0
+
+		if not limit is None and length > limit:
+			raise hcds_exception.PayloadTooLarge
+
+		if length <= 0:
+			return b""
+
+		return self.get_env( "wsgi.input" ).read( length )
+
 	def get_param( self, key, default = None ):
 		'''
 		Retrieve a query parameter.
@@ -158,6 +206,7 @@ class BaseResponder( object ):
 		'''
 		Start the reponse.
 		Parameters are the same as for the callback in WSGI interface.
+		The status and headers are passed to the server by finish().
 		'''
 
 		additional = []
@@ -166,7 +215,264 @@ class BaseResponder( object ):
 				additional.append( ( "Access-Control-Allow-Origin", origin ) )
 				break
 
-		self.start_response( status, headers + additional )
+		# The validators only describe the full response
+		if status[ : 3 ] == "200" or status[ : 3 ] == "304":
+			additional += self.validators
+
+		self.status = status
+		self.base_headers = headers
+		self.headers = headers + additional
+
+	def check_validators( self, parts, mtime = None ):
+		'''
+		Set the validators of the response, and check whether the client already has an up-to-date copy of it.
+		This must be called before any computation, once all the parameters that determine the response are known.
+		If an identical heavy request is being computed, its result is awaited and used for this request as well, see hcds_singleflight; light requests are cheaper to compute than to share.
+		Otherwise, the request waits for its admission, see admit().
+		Returns True if the response has been provided, either as a "304 Not Modified" response or from an identical request, in which case nothing else has to be done.
+
+		- parts: List of the normalized parameters that determine the response; they must be serializable to JSON
+		- mtime: Time of the last modification of the data used for the response, if it depends on files; it is also part of the tag
+		'''
+
+		tag = "\"" + hashlib.sha1( bytes( hcds_cache.make_key( hcds_config.CACHE_VERSION, type( self ).__name__, mtime, *parts ), "utf-8" ) ).hexdigest() + "\""
+
+		self.validators = [ ( "ETag", tag ), ( "Cache-Control", "public, max-age={:d}".format( self.get_config( "max_age", hcds_config.CACHE_MAX_AGE ) ) ) ]
+		if not mtime is None:
+			self.validators.append( ( "Last-Modified", email.utils.formatdate( mtime, usegmt = True ) ) )
+
+		match = self.get_env( "HTTP_IF_NONE_MATCH" )
+		since = self.get_env( "HTTP_IF_MODIFIED_SINCE" )
+
+		# The client may hold the compressed response, which has its own tag, see compress_output()
+		tags = [ tag ]
+		encoding = hcds_compress.negotiate( self.get_env( "HTTP_ACCEPT_ENCODING" ) )
+		if not encoding is None:
+			tags.append( hcds_compress.get_tag( tag, encoding ) )
+
+		# If-Modified-Since is ignored when If-None-Match is present
+		if not match is None:
+			matched = [ item.strip().replace( "W/", "", 1 ) for item in match.split( "," ) ]
+			matched = [ item for item in matched if item == "*" or item in tags ]
+			fresh = len( matched ) > 0
+
+			if fresh and matched[ 0 ] != "*":
+				self.validators[ 0 ] = ( "ETag", matched[ 0 ] )
+		elif not since is None and not mtime is None:
+			try:
+				fresh = int( mtime ) <= email.utils.parsedate_to_datetime( since ).timestamp()
+			except ( TypeError, ValueError ):
+				fresh = False
+		else:
+			fresh = False
+
+		if fresh:
+			self.start( "304 Not Modified", [] )
+			return True
+
+		if not self.flight is None:
+			hcds_singleflight.leave( self.flight, None )
+
+		if self.singleflight and self.get_route_class() == "heavy":
+			begin = time.perf_counter()
+			result, self.flight = hcds_singleflight.join( tag )
+
+			if not result is None:
+				self.add_timing( "wait", time.perf_counter() - begin )
+				status, headers, body = result
+
+				self.start( status, list( headers ) )
+				self.clear_output()
+				self.add_output( body )
+				return True
+
+		self.admit()
+
+		return False
+
+	def admit( self ):
+		'''
+		Wait for the request to be allowed to run, according to the class given by get_route_class(), see hcds_admission.
+		This is done by check_validators() once it is known that the response has to be computed, so that requests answered otherwise do not use a slot.
+		Requests that do not call check_validators() must call it before any expensive work; calling it again has no effect.
+		'''
+
+		if self.admission is None:
+			self.admission = hcds_admission.acquire( self.get_route_class(), self )
+
+			# The class is not limited
+			if self.admission is None:
+				self.admission = False
+
+	def release( self ):
+		'''
+		Release the slot obtained by admit(), if any.
+		'''
+
+		admission = self.admission
+		self.admission = None
+
+		if admission:
+			hcds_admission.release( admission )
+
+	def share_result( self ):
+		'''
+		Provide the response to the identical requests waiting for it, see check_validators().
+		Only successful responses are shared; the other requests compute their own otherwise.
+		'''
+
+		if self.flight is None:
+			return
+
+		if not self.status is None and self.status[ : 3 ] == "200":
+			result = ( self.status, self.base_headers, b"".join( self.out ) )
+		else:
+			result = None
+
+		flight = self.flight
+		self.flight = None
+		hcds_singleflight.leave( flight, result )
+
+	def add_header( self, name, value ):
+		'''
+		Add a header to a response that has already been started.
+
+		- name: Name of the header
+		- value: Value of the header
+		'''
+
+		self.headers.append( ( name, value ) )
+
+	def finish( self ):
+		'''
+		Pass the status and headers of the response to the server, along with the timings of the request.
+		The body is compressed beforehand if the client supports it.
+		'''
+
+		self.compress_output()
+
+		headers = list( self.headers )
+
+		if hcds_config.TIMING_HEADER and len( self.timings ):
+			headers.append( ( "Server-Timing", ", ".join( [ "{:s};dur={:.3f}".format( name, duration * 1.e3 ) for name, duration in self.timings.items() ] ) ) )
+
+		self.start_response( self.status, headers )
+
+	def compress_output( self ):
+		'''
+		Compress the body of the response with the best content encoding accepted by the client.
+		Bodies smaller than COMPRESS_MIN_SIZE and data that is already compressed are sent as is.
+		Compressed bodies of responses with an ETag are cached with a hash of their uncompressed body, so that popular responses are only compressed once.
+		The ETag of a compressed response gets the encoding as suffix, so that it differs from the one of the uncompressed response.
+		'''
+
+		# The tag of the copy held by the client depends on the encoding
+		if self.status[ : 3 ] == "304":
+			self.add_header( "Vary", "Accept-Encoding" )
+			return
+
+		if self.status[ : 3 ] != "200":
+			return
+
+		headers = dict( self.headers )
+		if "Content-Encoding" in headers or not hcds_compress.is_compressible( headers.get( "Content-Type", "" ) ):
+			return
+
+		self.add_header( "Vary", "Accept-Encoding" )
+
+		encoding = hcds_compress.negotiate( self.get_env( "HTTP_ACCEPT_ENCODING" ) )
+		if encoding is None:
+			return
+
+		size = sum( [ len( item ) for item in self.out ] )
+		if hcds_config.COMPRESS_MIN_SIZE is None or size < hcds_config.COMPRESS_MIN_SIZE:
+			return
+
+		with self.timing( "compress" ):
+			body = b"".join( self.out )
+
+			# Responses without a tag, such as the profile reports, are not worth keeping
+			key = None
+			if "ETag" in headers:
+				key = hcds_compress.get_key( body, encoding )
+
+			data = None if key is None else hcds_compress.cache.get( key )
+			if data is None:
+				data = hcds_compress.compress( body, encoding )
+
+				if not key is None:
+					hcds_compress.cache.put( key, data )
+
+		# Not worth it
+		if len( data ) >= size:
+			return
+
+		self.out = [ data ]
+		self.headers = [ ( name, hcds_compress.get_tag( value, encoding ) if name == "ETag" else value ) for name, value in self.headers ]
+		self.add_header( "Content-Encoding", encoding )
+
+	@contextlib.contextmanager
+	def timing( self, name ):
+		'''
+		Measure the time spent in a phase of the request, to be used in a "with" statement.
+		Times of phases with the same name are added up.
+
+		- name: Name of the phase
+		'''
+
+		begin = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.add_timing( name, time.perf_counter() - begin )
+
+	def add_timing( self, name, duration ):
+		'''
+		Add time spent in a phase of the request.
+
+		- name: Name of the phase
+		- duration: Time in seconds
+		'''
+
+		self.timings[ name ] = self.timings.get( name, 0. ) + duration
+
+	def get_timings( self ):
+		'''
+		Get the time spent in each phase of the request, in seconds.
+		'''
+
+		return self.timings
+
+	def add_count( self, name, count ):
+		'''
+		Add to the number of items of some kind processed during the request, such as the number of evaluations of a model.
+
+		- name: Name of the kind of items
+		- count: Number of items to add
+		'''
+
+		self.counts[ name ] = self.counts.get( name, 0 ) + count
+
+	def get_counts( self ):
+		'''
+		Get the number of items of each kind processed during the request.
+		'''
+
+		return self.counts
+
+	def get_caches( self ):
+		'''
+		Get the in-memory caches of the module, as a dictionary of hcds_cache.LRUCache objects, for the metrics.
+		'''
+
+		return {}
+
+	def get_route_class( self ):
+		'''
+		Get the class of the request for the admission control, either "light" or "heavy", see hcds_config.ADMISSION.
+		'''
+
+		return "light"
 
 	def add_output( self, out ):
 		'''
@@ -177,6 +483,23 @@ class BaseResponder( object ):
 
 		self.out.append( out )
 
+	def add_json( self, data ):
+		'''
+		Add an object encoded in JSON to the output.
+
+		- data: Object to encode
+		'''
+
+		with self.timing( "encode" ):
+			self.add_output( hcds_json.dumps( data ) )
+
+	def clear_output( self ):
+		'''
+		Remove all the data that has been added to the output.
+		'''
+
+		self.out = []
+
 	def get_output( self ):
 		return self.out
 
@@ -194,6 +517,6 @@ class ErrorResponder( BaseResponder ):
 		self.exception = exception
 
 	def __call__( self ):
-		self.start( self.exception.get_status(), [ ( "Content-Type", self.exception.get_content_type() ) ] )
+		self.start( self.exception.get_status(), [ ( "Content-Type", self.exception.get_content_type() ) ] + self.exception.get_headers() )
 		self.add_output( self.exception.get_body() )
 
@@ -19,14 +19,16 @@ import math
 import json
 
 import numpy
-import matplotlib
-matplotlib.use( "agg" )
-import matplotlib.pyplot
 
-import mpl_tune
 import collresolve
 
+import hcds_cache
+import hcds_coll_grid
+import hcds_coll_jobs
+import hcds_coll_plot
+import hcds_coll_table
 import hcds_exception
+import hcds_json
 import hcds_responder_base
 
 class CollResponder( hcds_responder_base.BaseResponder ):
@@ -42,11 +44,76 @@ class CollResponder( hcds_responder_base.BaseResponder ):
 		self.DIST_M_AU = 1.495978707e+11
 		self.VEL_KMS_AUD = 1.495978707e+8 / 86400.
 
+		# Conversion factors of masses and radii, as ( multiplier, divisor ) pairs, for the bulk requests
+		self.MASS_UNITS = {
+			"kg": ( 1., self.MASS_KG_MSOL ),
+			"moon": ( 7.342e22, self.MASS_KG_MSOL ),
+			"mars": ( 6.4171e23, self.MASS_KG_MSOL ),
+			"earth": ( 1., self.MASS_MEARTH_MSOL ),
+			"jupiter": ( 1., self.MASS_MJUP_MSOL ),
+		}
+		self.DIST_UNITS = {
+			"m": ( 1., self.DIST_M_AU ),
+			"km": ( 1.e3, self.DIST_M_AU ),
+			"moon": ( 1.7371e5, self.DIST_M_AU ),
+			"mars": ( 3.396e6, self.DIST_M_AU ),
+			"earth": ( 1., self.DIST_REARTH_AU ),
+			"jupiter": ( 1., self.DIST_RJUP_AU ),
+		}
+
+		# Domain of the maps: impact angle in degrees and impact velocity relative to the mutual escape velocity
+		self.ANG_MIN = 0.
+		self.ANG_MAX = 90.
+		self.VEL_MIN = 0.99
+		self.VEL_MAX = 4.01
+
 		# collresolve's configuration object
 		self.conf = collresolve.Conf()
 		collresolve.conf_unit_msun_au_day( self.conf )
 		collresolve.conf_model( self.conf, collresolve.MODEL_C2019 )
 
+		# Figures for the maps, built once per quantity
+		self.templates = {}
+
+		# Tiles of the zoomable maps
+		self.tiles = hcds_cache.LRUCache( self.get_config( "tile_cache", 1024 ) )
+
+		# Derived properties of the bodies, which depend only on their mass and size
+		self.bodies = hcds_cache.LRUCache( self.get_config( "body_cache", 4096 ) )
+		self.escape = hcds_cache.LRUCache( self.get_config( "body_cache", 4096 ) )
+
+		# Maps of all the quantities computed for recent requests
+		self.maps = hcds_cache.LRUCache( self.get_config( "map_cache", 32 ) )
+
+		# Precomputed table of outcomes, if enabled; its error bounds must have been estimated for the configured interpolation
+		if self.get_config( "table" ) is None:
+			self.table = None
+		else:
+			self.table = hcds_coll_table.OutcomeTable( self.get_config( "table" ), self.get_config( "table_method", "linear" ) )
+
+		# Store of the background jobs computing maps, if enabled; the jobs left unfinished by a previous worker are run again
+		if self.get_config( "job_dir" ) is None:
+			self.jobs = None
+		else:
+			self.jobs = hcds_coll_jobs.JobStore( self.get_config( "job_dir" ), self.run_job, self.get_config( "job_workers", 1 ), self.get_config( "job_ttl", 86400. ), self.get_config( "job_max_pending", 16 ) )
+			self.jobs.resume()
+
+	def get_template( self, quant, panels = 1 ):
+		'''
+		Get the figure used to render maps of a given quantity.
+		It is created on first use and then kept for subsequent requests.
+
+		- quant: Name of the quantity shown on the map
+		- panels: Number of maps shown side by side
+		'''
+
+		key = ( quant, panels )
+
+		if not key in self.templates:
+			self.templates[ key ] = hcds_coll_plot.GridTemplate( quant, self.get_config( "usetex", False ), panels )
+
+		return self.templates[ key ]
+
 	def retrieve_body_mass( self, body, target = False ):
 		value = self.parse_float_query( "m" + body + "_value" )
 		unit = self.parse_list_query( "m" + body + "_unit", [ "jupiter", "earth", "mars", "moon", "kg" ] if target is False else [ "target", "jupiter", "earth", "mars", "moon", "kg" ] )
@@ -138,7 +205,11 @@ class CollResponder( hcds_responder_base.BaseResponder ):
 			if mass is None or dens is None:
 				size = None
 			else:
-				size = math.pow( 3. / 4. / math.pi * ( mass * self.MASS_KG_MSOL ) / dens, 1. / 3. ) / 1.495978707e+11
+				key = ( "dens", mass, dens )
+				size = self.bodies.get( key )
+				if size is None:
+					size = math.pow( 3. / 4. / math.pi * ( mass * self.MASS_KG_MSOL ) / dens, 1. / 3. ) / 1.495978707e+11
+					self.bodies.put( key, size )
 		else:
 			size = None
 
@@ -179,7 +250,7 @@ class CollResponder( hcds_responder_base.BaseResponder ):
 			response.update( rtar_params )
 
 		if "rimp" in items or "imp" in items:
-			rimp, rimp_params = self.retrieve_body_size( "imp", mtar, model )
+			rimp, rimp_params = self.retrieve_body_size( "imp", mimp, model )
 			values[ "rimp" ] = rimp
 			response.update( rimp_params )
 
@@ -221,9 +292,7 @@ class CollResponder( hcds_responder_base.BaseResponder ):
 		if "tar" in items:
 			# Create the target object
 			if response[ "rtar_type" ] == "e2020":
-				collresolve.conf_model( self.conf, collresolve.MODEL_C2019 )
-				values[ "tar" ] = collresolve.Body( mass = values[ "mtar" ] )
-				collresolve.body_radius( self.conf, values[ "tar" ] )
+				values[ "tar" ] = collresolve.Body( mass = values[ "mtar" ], radius = self.body_radius( values[ "mtar" ] ) )
 			else:
 				values[ "tar" ] = collresolve.Body( mass = values[ "mtar" ], radius = values[ "rtar" ] )
 
@@ -233,9 +302,7 @@ class CollResponder( hcds_responder_base.BaseResponder ):
 		if "imp" in items:
 			# Create the impactor object
 			if response[ "rimp_type" ] == "e2020":
-				collresolve.conf_model( self.conf, collresolve.MODEL_C2019 )
-				values[ "imp" ] = collresolve.Body( mass = values[ "mimp" ] )
-				collresolve.body_radius( self.conf, values[ "imp" ] )
+				values[ "imp" ] = collresolve.Body( mass = values[ "mimp" ], radius = self.body_radius( values[ "mimp" ] ) )
 			else:
 				values[ "imp" ] = collresolve.Body( mass = values[ "mimp" ], radius = values[ "rimp" ] )
 
@@ -245,22 +312,75 @@ class CollResponder( hcds_responder_base.BaseResponder ):
 		if "model" in items:
 			# Apply the correct model to the collresolve configuration
 			# This needs to be done *after* setting-up the bodies, otherwise the model may be changed!
-			if values[ "model" ] == "c2019":
-				collresolve.conf_model( self.conf, collresolve.MODEL_C2019 )
-			elif values[ "model" ] == "sl2012":
-				collresolve.conf_model( self.conf, collresolve.MODEL_SL2012 )
-			elif values[ "model" ] == "ls2012":
-				collresolve.conf_model( self.conf, collresolve.MODEL_LS2012 )
-			else:
-				collresolve.conf_model( self.conf, collresolve.MODEL_PERFECT_MERGE )
+			self.set_model( values[ "model" ] )
 
 		return values, response
 
+	def body_radius( self, mass ):
+		'''
+		Get the radius of a body as computed by collresolve from its mass with the "c2019" model.
+		This changes the model of the collresolve configuration; the results are memoized.
+
+		- mass: Mass of the body
+		'''
+
+		radius = self.bodies.get( ( "e2020", mass ) )
+
+		if radius is None:
+			collresolve.conf_model( self.conf, collresolve.MODEL_C2019 )
+			body = collresolve.Body( mass = mass )
+			collresolve.body_radius( self.conf, body )
+			radius = body.radius
+
+			self.bodies.put( ( "e2020", mass ), radius )
+
+		return radius
+
+	def escape_velocity( self, tar, imp, conf = None ):
+		'''
+		Get the mutual escape velocity of two bodies; the results are memoized.
+
+		- tar: collresolve.Body object of the target
+		- imp: collresolve.Body object of the impactor
+		- conf: collresolve configuration object to use, by default the one of the module
+		'''
+
+		key = ( tar.mass, tar.radius, imp.mass, imp.radius )
+		esc = self.escape.get( key )
+
+		if esc is None:
+			esc = collresolve.escape_velocity( self.conf if conf is None else conf, tar, imp )
+			self.escape.put( key, esc )
+
+		return esc
+
+	def set_model( self, model, conf = None ):
+		'''
+		Apply a collision model to the collresolve configuration.
+
+		- model: Name of the model, one of "merge", "ls2012", "sl2012" or "c2019"
+		- conf: collresolve configuration object to change, by default the one of the module
+		'''
+
+		if conf is None:
+			conf = self.conf
+
+		if model == "c2019":
+			collresolve.conf_model( conf, collresolve.MODEL_C2019 )
+		elif model == "sl2012":
+			collresolve.conf_model( conf, collresolve.MODEL_SL2012 )
+		elif model == "ls2012":
+			collresolve.conf_model( conf, collresolve.MODEL_LS2012 )
+		else:
+			collresolve.conf_model( conf, collresolve.MODEL_PERFECT_MERGE )
+
 	def get_types( self ):
-		format = self.parse_list_query( "format", [ "jsoncheck", "jsondata", "jsonsvg", "svg", "pdf", "png", "jpg" ] )
+		format = self.parse_list_query( "format", [ "jsoncheck", "jsondata", "jsonpoly", "jsonsvg", "svg", "pdf", "png", "jpg" ] )
 
 		if format == "jsondata":
 			return { "ctype": "application/json", "data": "json", "image": None }
+		if format == "jsonpoly":
+			return { "ctype": "application/json", "data": "poly", "image": None }
 		if not format is None and format[ 0:4 ] == "json" and format != "jsoncheck":
 			return { "ctype": "application/json", "data": "json", "image": format[ 4: ] }
 		elif format == "svg":
@@ -274,6 +394,42 @@ class CollResponder( hcds_responder_base.BaseResponder ):
 		else:
 			return { "ctype": "application/json", "data": "check", "image": None }
 
+	def get_caches( self ):
+		'''
+		Get the in-memory caches of the module, for the metrics.
+		'''
+
+		return { "tiles": self.tiles, "bodies": self.bodies, "escape": self.escape, "maps": self.maps }
+
+	def get_route_class( self ):
+		'''
+		Get the class of the request for the admission control.
+		Maps, tiles, bulk requests and results of jobs are heavy, except for the check of the parameters of a map.
+		'''
+
+		sub = self.get_sub()
+
+		if sub == "grid" or sub == "grid/":
+			return "light" if self.get_types()[ "data" ] == "check" else "heavy"
+		elif sub == "bulk" or sub == "bulk/" or ( not sub is None and sub[ : 5 ] == "tile/" ):
+			return "heavy"
+		elif not sub is None and sub[ : 4 ] == "job/" and sub.rstrip( "/" )[ -7 : ] == "/result":
+			return "heavy"
+		else:
+			return "light"
+
+	def check_cache( self, *parts ):
+		'''
+		Check whether the client already has an up-to-date copy of the response, see BaseResponder.check_validators().
+		The configuration of the module and the precomputed table also determine the response, so they are included in the validators.
+
+		- parts: Normalized parameters of the request
+		'''
+
+		table = None if self.table is None else self.table.get_error()
+
+		return self.check_validators( [ self.config, table ] + list( parts ) )
+
 	def __call__( self ):
 		'''
 		Main entry point of the module.
@@ -285,23 +441,165 @@ class CollResponder( hcds_responder_base.BaseResponder ):
 			return self.single()
 		elif sub == "grid" or sub == "grid/":
 			return self.grid()
+		elif sub == "bulk" or sub == "bulk/":
+			return self.bulk()
+		elif not sub is None and sub[ : 5 ] == "tile/":
+			return self.tile( sub[ 5 : ] )
+		elif sub == "job" or sub == "job/":
+			return self.job_submit()
+		elif not sub is None and sub[ : 4 ] == "job/":
+			return self.job( sub[ 4 : ] )
 		else:
 			raise hcds_exception.NotFound
 
+	def compute_grid( self, values, x, y, conf = None, progress = None ):
+		'''
+		Compute the outcome of collisions over a grid of impact angles and velocities.
+		All the quantities are obtained from the same evaluation of each collision.
+		Returns a hcds_coll_grid.GridResult object.
+
+		- values: Parameters as returned by retrieve_params(), including the target and the impactor
+		- x: Impact angles in degrees
+		- y: Impact velocities relative to the mutual escape velocity
+		- conf: collresolve configuration object to use, by default the one of the module; the evaluations are only counted for the request in the latter case
+		- progress: Function called with the number of rows completed and the total number of rows, or None
+		'''
+
+		esc = self.escape_velocity( values[ "tar" ], values[ "imp" ], conf )
+
+		nx = len( x )
+		ny = len( y )
+
+		result = hcds_coll_grid.empty( x, y )
+
+		if conf is None:
+			conf = self.conf
+			self.add_count( "evaluations", nx * ny )
+
+		for j in range( ny ):
+			vel = esc * y[ j ]
+
+			for i in range( nx ):
+				ang = x[ i ]
+
+				collresolve.setup( conf, values[ "tar" ], values[ "imp" ], vel, math.radians( ang ) )
+
+				try:
+					res, regime = collresolve.resolve( conf, values[ "tar" ], values[ "imp" ], 2, 1 )
+
+					result.regime[ j, i ] = regime
+					result.acclr[ j, i ] = ( res[ 0 ].mass - values[ "tar" ].mass ) / values[ "imp" ].mass
+					if regime == hcds_coll_grid.REGIME_HIT_AND_RUN:
+						result.accsr[ j, i ] = res[ 1 ].mass / values[ "imp" ].mass - 1.
+					result.acctr[ j, i ] = res[ 2 ].mass / values[ "imp" ].mass
+					result.valid[ j, i ] = True
+				except:
+					pass
+
+			if not progress is None:
+				progress( j + 1, ny )
+
+		return result
+
+	def get_table_point( self, values, response ):
+		'''
+		Get the parameters of the collision in the precomputed table, as a tuple of the model, total mass and mass ratio.
+		None is returned if the table is not enabled or does not cover the collision; it only applies to bodies whose radius is computed from their mass.
+
+		- values: Parameters as returned by retrieve_params(), including the model and the masses
+		- response: Parameters sent to the caller, as returned by retrieve_params()
+		'''
+
+		if self.table is None or response.get( "rtar_type" ) != "e2020" or response.get( "rimp_type" ) != "e2020":
+			return None
+
+		mass = ( values[ "mtar" ] + values[ "mimp" ] ) * self.MASS_MEARTH_MSOL
+		ratio = values[ "mimp" ] / values[ "mtar" ]
+
+		if not self.table.covers( values[ "model" ], mass, ratio ):
+			return None
+
+		return ( values[ "model" ], mass, ratio )
+
+	def compute_map( self, values, response, x, y, conf = None, progress = None, keep = True ):
+		'''
+		Get the outcome of collisions over a grid of impact angles and velocities, as a hcds_coll_grid.GridResult object.
+		The values are taken from the precomputed table if it is enabled and covers the parameters, in which case its error bounds are added to the response.
+		Otherwise they are computed with compute_grid(); the maps are kept in memory, so that another quantity of the same map does not need to be computed again.
+		The arrays of the result must not be modified.
+
+		- values: Parameters as returned by retrieve_params(), including the model, the target and the impactor
+		- response: Parameters sent to the caller, as returned by retrieve_params()
+		- x: Impact angles in degrees
+		- y: Impact velocities relative to the mutual escape velocity
+		- conf, progress: See compute_grid(); the maps of background jobs are not kept in memory
+		- keep: Whether to keep the map in memory; tiles have their own cache
+		'''
+
+		point = self.get_table_point( values, response )
+		if point is None or not self.table.covers( *point, vel = y, angle = x ):
+			key = hcds_cache.make_key( values[ "model" ], values[ "tar" ].mass, values[ "tar" ].radius, values[ "imp" ].mass, values[ "imp" ].radius, x.tolist(), y.tolist() )
+			keep = keep and conf is None
+			result = self.maps.get( key ) if keep else None
+
+			if result is None:
+				result = self.compute_grid( values, x, y, conf, progress )
+
+				if keep:
+					result.freeze()
+					self.maps.put( key, result )
+
+			return result
+
+		res = self.table.lookup( *point, y[ :, numpy.newaxis ], x[ numpy.newaxis, : ] )
+
+		response[ "table" ] = self.table.get_error()
+
+		# Non-finite values are handled by GridResult.get()
+		return hcds_coll_grid.GridResult( x, y, numpy.maximum( res[ "regime" ], 0 ), res[ "acclr" ], res[ "accsr" ], res[ "acctr" ], res[ "regime" ] >= 0 )
+
 	def single( self ):
 		'''
 		Handle a request to obtain the outcome of one precise collision.
 		'''
 
-		values, response = self.retrieve_params( [ "model", "tar", "imp", "vel", "angle" ] )
+		with self.timing( "params" ):
+			values, response = self.retrieve_params( [ "model", "tar", "imp", "vel", "angle" ] )
+
+		if self.check_cache( "single", response ):
+			return
+
+		esc = self.escape_velocity( values[ "tar" ], values[ "imp" ] )
 
 		vel = values[ "vel" ]
 		if response[ "vel_unit" ] == "escape":
-			vel *= collresolve.escape_velocity( self.conf, values[ "tar" ], values[ "imp" ] )
+			vel *= esc
+
+		point = self.get_table_point( values, response )
+		if not point is None and self.table.covers( *point, vel = vel / esc, angle = values[ "angle" ] ):
+			with self.timing( "resolve" ):
+				res = self.table.lookup( *point, vel / esc, values[ "angle" ] )
+
+			# Outcomes that are not available in the table are computed
+			if res[ "regime" ] >= 0 and all( [ numpy.isfinite( res[ quant ] ) for quant in [ "acclr", "accsr", "acctr" ] ] ):
+				response[ "regime" ] = collresolve.regime_desc( int( res[ "regime" ] ) )
+
+				response[ "acclr" ] = float( res[ "acclr" ] )
+				response[ "accsr" ] = float( res[ "accsr" ] )
+				response[ "acctr" ] = float( res[ "acctr" ] )
 
-		collresolve.setup( self.conf, values[ "tar" ], values[ "imp" ], vel, math.radians( values[ "angle" ] ) )
+				response[ "table" ] = self.table.get_error()
 
-		res, regime = collresolve.resolve( self.conf, values[ "tar" ], values[ "imp" ], 2, 1 )
+				self.start( '200 OK', [ ( "Content-Type", "application/json" ) ] )
+				self.add_json( response )
+				return
+
+		with self.timing( "resolve" ):
+			collresolve.setup( self.conf, values[ "tar" ], values[ "imp" ], vel, math.radians( values[ "angle" ] ) )
+
+			res, regime = collresolve.resolve( self.conf, values[ "tar" ], values[ "imp" ], 2, 1 )
+
+		self.add_count( "evaluations", 1 )
 
 		response[ "regime" ] = collresolve.regime_desc( regime )
 
@@ -310,205 +608,650 @@ class CollResponder( hcds_responder_base.BaseResponder ):
 		response[ "acctr" ] = ( res[ 2 ].mass ) / values[ "imp" ].mass
 
 		self.start( '200 OK', [ ( "Content-Type", "application/json" ) ] )
-		self.add_output( bytes( json.dumps( response ), "utf-8" ) )
+		self.add_json( response )
+
+	def retrieve_models( self ):
+		'''
+		Retrieve the list of models to compare, given by the "models" parameter either repeated or as a comma-separated list.
+		Returns None if the parameter is not given, in which case the single "model" parameter applies.
+		hcds_exception.JSONBadRequest is raised if one of the models is invalid or given twice.
+		'''
+
+		if not "models" in self.query:
+			return None
+
+		models = []
+		for value in self.query[ "models" ]:
+			models.extend( value.split( "," ) )
+
+		if len( models ) == 0 or len( set( models ) ) != len( models ) or not all( [ model in [ "merge", "ls2012", "sl2012", "c2019" ] for model in models ] ):
+			raise hcds_exception.JSONBadRequest( { "models": None } )
+
+		return models
+
+	def retrieve_grid_params( self ):
+		'''
+		Retrieve the parameters of a map, with either a single model or several models to compare, see retrieve_models().
+		The bodies are shared between the models; they are computed as for the "c2019" model if it is one of them.
+		Returns the list of models, or None, along with the values and response of retrieve_params().
+		'''
+
+		models = self.retrieve_models()
+
+		if models is None:
+			values, response = self.retrieve_params( [ "model", "tar", "imp" ] )
+		else:
+			values, response = self.retrieve_params( [ "tar", "imp" ], "c2019" if "c2019" in models else None )
+			response[ "models" ] = models
+
+		return models, values, response
+
+	def retrieve_quant( self, formats, response, default = "regime" ):
+		'''
+		Retrieve the quantity to show on a map, one of hcds_coll_grid.QUANTS or "all".
+		hcds_exception.JSONBadRequest is raised if all the quantities are requested in another format than data.
+
+		- formats: Output format, as returned by get_types()
+		- response: Parameters sent to the caller
+		- default: Quantity to use if the parameter is not given or invalid
+		'''
+
+		quant = self.parse_list_query( "quant", hcds_coll_grid.QUANTS + [ "all" ] )
+		if quant is None:
+			quant = default
+
+		if quant == "all" and ( formats[ "data" ] != "json" or not formats[ "image" ] is None ):
+			response[ "quant" ] = None
+			raise hcds_exception.JSONBadRequest( response )
+
+		return quant
 
 	def grid( self ):
 		'''
 		Handle a request to obtain a map of outcomes.
+		With the "all" quantity, the maps of all the quantities are sent as data, in a dictionary keyed by the name of the quantity.
+		With the "models" parameter, maps of several models are computed over the same grid and returned together:
+		the data are stacked along a first axis and images have one panel per model.
 		'''
 
 		# First, we parse all the input parameters from the query string and validate the ones given as string against the list of allowed values
 		formats = self.get_types()
 
-		values, response = self.retrieve_params( [ "model", "tar", "imp" ] )
+		with self.timing( "params" ):
+			models, values, response = self.retrieve_grid_params()
 
 		if formats[ "data" ] == "check":
 			response[ "check" ] = True
 
 			self.start( "200 OK", [ ( "Content-Type", formats[ "ctype" ] ) ] )
-			self.add_output( bytes( json.dumps( response ), "utf-8" ) )
+			self.add_json( response )
 
 			return
 
-		esc = collresolve.escape_velocity( self.conf, values[ "tar" ], values[ "imp" ] )
+		quant = self.retrieve_quant( formats, response )
+
+		render = self.parse_list_query( "render", [ "contour", "raster" ] )
+		if render is None:
+			render = self.get_config( "render", "contour" )
+
+		if self.check_cache( "grid", formats, quant, render, response ):
+			return
+
+		x = numpy.linspace( self.ANG_MIN, self.ANG_MAX, 91 )
+		y = numpy.linspace( self.VEL_MIN, self.VEL_MAX, 91 )
+
+		with self.timing( "resolve" ):
+			if models is None:
+				result = self.compute_map( values, response, x, y )
+			else:
+				results = []
+				for model in models:
+					values[ "model" ] = model
+					self.set_model( model )
+					results.append( self.compute_map( values, response, x, y ) )
+
+				result = hcds_coll_grid.stack( results )
+
+		self.output_grid( formats, quant, render, response, result, models )
+
+	def output_grid( self, formats, quant, render, response, result, titles = None ):
+		'''
+		Send a map of outcomes in the requested format.
+
+		- formats: Output format, as returned by get_types()
+		- quant: Name of the quantity, or "all" for all of them, which can only be sent as data
+		- render: Rendering of PNG and JPG images, either "contour" or "raster"
+		- response: Parameters sent to the caller, to which the data are added
+		- result: hcds_coll_grid.GridResult object, as returned by compute_map(), possibly with several maps stacked
+		- titles: Titles of the stacked maps, or None for a single map
+		'''
+
+		x = result.x
+		y = result.y
+
+		if formats[ "data" ] == "poly":
+			z = result.get( quant )
+
+			with self.timing( "render" ):
+				polygons = [ hcds_coll_plot.get_polygons( x, y, data, hcds_coll_plot.get_style( quant ), hcds_coll_plot.get_cmap() ) for data in ( z if result.is_stacked() else [ z ] ) ]
+
+			# Stacked maps share everything but their layers
+			response.update( polygons[ 0 ] )
+			if result.is_stacked():
+				response[ "layers" ] = [ item[ "layers" ] for item in polygons ]
+		elif formats[ "image" ] is None:
+			response[ "vels" ] = y
+			response[ "angs" ] = x
+			if quant == "all":
+				response[ "vals" ] = { name: result.get( name ) for name in hcds_coll_grid.QUANTS }
+			else:
+				response[ "vals" ] = result.get( quant )
+		else:
+			z = result.get( quant )
+			template = self.get_template( quant, len( z ) if result.is_stacked() else 1 )
+
+			with self.timing( "render" ):
+				if render == "raster" and ( formats[ "image" ] == "png" or formats[ "image" ] == "jpg" ):
+					image = template.render_raster( x, y, z, formats[ "image" ], self.get_config( "raster_dpi", 100 ), titles )
+				else:
+					image = template.render( x, y, z, formats[ "image" ], titles )
+
+			if formats[ "data" ] != "image":
+				response[ "image" ] = image.decode( "utf-8" )
+
+		self.start( "200 OK", [ ( "Content-Type", formats[ "ctype" ] ) ] )
+		if formats[ "data" ] == "image":
+			self.add_output( image )
+		else:
+			self.add_json( response )
+
+	def tile( self, path ):
+		'''
+		Handle a request to obtain one tile of a zoomable map of outcomes.
+		The map covers the same domain as grid(). At zoom level n, it is divided into 2^n by 2^n tiles, which are indexed from the top-left corner.
+
+		- path: Remainder of the path, of the form "<zoom>/<x>/<y>"
+		'''
+
+		try:
+			zoom, tx, ty = [ int( item ) for item in path.split( "/" ) ]
+		except ValueError:
+			raise hcds_exception.NotFound
+
+		count = 2 ** zoom if zoom >= 0 else 0
+		if zoom < 0 or zoom > self.get_config( "tile_max_zoom", 8 ) or tx < 0 or tx >= count or ty < 0 or ty >= count:
+			raise hcds_exception.NotFound
+
+		format = self.parse_list_query( "format", [ "png", "npy", "json" ] )
+		if format is None:
+			format = "png"
+
+		with self.timing( "params" ):
+			values, response = self.retrieve_params( [ "model", "tar", "imp" ] )
 
-		quant = self.parse_list_query( "quant", [ "regime", "acclr", "accsr", "acctr" ] )
+		quant = self.parse_list_query( "quant", hcds_coll_grid.QUANTS )
 		if quant is None:
 			quant = "regime"
 
-		xmin = 0.
-		xmax = 90.
-		xscale = "linear"
-		xname = "\\theta_{coll}~[deg]"
-		nx = 91
-		x = numpy.linspace( xmin, xmax, nx )
-		xt = [ 0., 15., 30., 45., 60., 75., 90. ]
-		xl = None
+		size = self.get_config( "tile_size", 64 )
 
-		ymin = 0.99
-		ymax = 4.01
-		yscale = "linear"
-		yname = "v_{coll}/v_{esc}"
-		ny = 91
-		y = numpy.linspace( ymin, ymax, ny )
-		yt = None
-		yl = None
+		if self.check_cache( "tile", format, quant, zoom, tx, ty, size, response ):
+			return
 
-		z = numpy.zeros( ( ny, nx ) )
+		# The tile is shared by all the quantities
+		key = hcds_cache.make_key( response, zoom, tx, ty, size )
+		tile = self.tiles.get( key )
+
+		if tile is None:
+			# The values are taken at the center of the pixels, so that adjacent tiles do not overlap
+			width = ( self.ANG_MAX - self.ANG_MIN ) / count
+			height = ( self.VEL_MAX - self.VEL_MIN ) / count
+			x = self.ANG_MIN + width * ( tx + ( numpy.arange( size ) + 0.5 ) / size )
+			y = self.VEL_MAX - height * ( ty + ( numpy.arange( size ) + 0.5 ) / size )
+
+			with self.timing( "resolve" ):
+				tile = self.compute_map( values, response, x, y, keep = False )
+			tile.freeze()
+			self.tiles.put( key, tile )
+
+		x = tile.x
+		y = tile.y
+		z = tile.get( quant )
+
+		if format == "png":
+			with self.timing( "render" ):
+				colors = hcds_coll_plot.map_colors( z, hcds_coll_plot.get_style( quant ), hcds_coll_plot.get_cmap() )
+				image = hcds_coll_plot.encode_image( colors, "png" )
+
+			self.start( "200 OK", [ ( "Content-Type", "image/png" ) ] )
+			self.add_output( image )
+		elif format == "npy":
+			buffer = io.BytesIO()
+			numpy.save( buffer, z )
+
+			self.start( "200 OK", [ ( "Content-Type", "application/octet-stream" ) ] )
+			self.add_output( buffer.getvalue() )
+		else:
+			response[ "vels" ] = y
+			response[ "angs" ] = x
+			response[ "vals" ] = z
 
-		for i in range( nx ):
-			ang = x[ i ]
+			self.start( "200 OK", [ ( "Content-Type", "application/json" ) ] )
+			self.add_json( response )
 
-			for j in range( ny ):
-				vel = esc * y[ j ]
+	def job_submit( self ):
+		'''
+		Handle a request to compute a map in a background job.
+		The parameters are the same as for grid(), given either in the body of the POST request, encoded as a form, or in the query string.
+		The "points" parameter sets the number of points along each side of the map, up to the "job_max_points" configuration item.
+		The response gives the identifier of the job and its state, see job().
+		If there are already "job_max_pending" jobs queued or running, the request is rejected with a "503 Service Unavailable" error.
+		'''
 
-				collresolve.setup( self.conf, values[ "tar" ], values[ "imp" ], vel, math.radians( ang ) )
+		if self.jobs is None:
+			raise hcds_exception.NotFound
 
-				try:
-					res, regime = collresolve.resolve( self.conf, values[ "tar" ], values[ "imp" ], 2, 1 )
-
-					if quant == "acclr":
-						val = ( res[ 0 ].mass - values[ "tar" ].mass ) / values[ "imp" ].mass
-					elif quant == "accsr":
-						if regime != 5:
-							val = -1.1
-						else:
-							val = res[ 1 ].mass / values[ "imp" ].mass - 1.
-					elif quant == "acctr":
-						val = res[ 2 ].mass / values[ "imp" ].mass
-					else:
-						val = regime
-
-					z[ j, i ] = val
-				except:
-					z[ j, i ] = 0.
+		if self.get_env( "REQUEST_METHOD" ) != "POST":
+			raise hcds_exception.MethodNotAllowed
+
+		body = self.get_body( self.get_config( "job_max_bytes", 65536 ) )
+		if len( body ) > 0:
+			self.set_query( body.decode( "utf-8", "replace" ) )
 
-		buffer = None
+		with self.timing( "params" ):
+			models, values, response = self.retrieve_grid_params()
 
-		if formats[ "image" ] is None:
-			response[ "vels" ] = y.tolist()
-			response[ "angs" ] = x.tolist()
-			response[ "vals" ] = z.tolist()
+		quant = self.parse_list_query( "quant", hcds_coll_grid.QUANTS )
+		if quant is None:
+			quant = "regime"
+
+		points = self.parse_float_query( "points" )
+		if not "points" in self.query:
+			points = 91
+		elif points is None or points != int( points ) or points < 2 or points > self.get_config( "job_max_points", 1001 ):
+			points = None
 		else:
-			# Matplotlib
+			points = int( points )
+
+		response[ "quant" ] = quant
+		response[ "points" ] = points
 
-			matplotlib.rc( "font", family = "serif" )
+		if points is None:
+			raise hcds_exception.JSONBadRequest( response )
 
-			if self.get_config( "usetex" ):
-				matplotlib.rc( "text", usetex = True )
-				matplotlib.rc( "text.latex", preamble = "\\usepackage{amsmath}\n\\usepackage{wasysym}\n\\usepackage{mathptmx}" )
+		spec = {
+			"model": values.get( "model" ),
+			"models": models,
+			"tar": [ values[ "tar" ].mass, values[ "tar" ].radius ],
+			"imp": [ values[ "imp" ].mass, values[ "imp" ].radius ],
+			"quant": quant,
+			"points": points,
+			"response": response,
+		}
 
-			figtext = mpl_tune.FigText( size = "large", color = "black", tex = self.get_config( "usetex" ) )
+		status = self.jobs.submit( spec )
+		if status is None:
+			raise hcds_exception.ServiceUnavailable( self.get_config( "job_retry_after", 60 ) )
 
-			figsize = mpl_tune.FigSize()
-			figsize.set_size_h( 5.0, mpl_tune.FigSize.SIZE_NO_CBAR )
-			figsize.set_size_v( 5.0, mpl_tune.FigSize.SIZE_NO_CBAR )
-			figsize.set_margin_left( 0.52 )
-			figsize.set_margin_bottom( 0.52 )
-			figsize.set_margin_right( 0.08 )
-			figsize.set_margin_top( 0.08 )
+		self.start( "202 Accepted", [ ( "Content-Type", "application/json" ) ] )
+		self.add_json( self.get_job_state( status ) )
 
-			# Color bar
-			figsize.set_cbar_loc( "right" )
-			figsize.set_cbar_width( 0.1 )
-			figsize.set_cbar_pad( 0.75 )
+	def get_job_state( self, status ):
+		'''
+		Get the state of a job as sent to the caller.
 
-			fig = matplotlib.pyplot.figure( **figsize.get_figure_args() )
-			fig.subplots_adjust( **figsize.get_subplots_args() )
+		- status: State of the job, as returned by hcds_coll_jobs.JobStore.read_status()
+		'''
 
-			ax = fig.add_subplot( 1, 1, 1 )
+		return {
+			"id": status[ "id" ],
+			"state": status[ "state" ],
+			"rows": status[ "done" ],
+			"total": status[ "total" ],
+			"created": status[ "created" ],
+			"started": status[ "started" ],
+			"finished": status[ "finished" ],
+			"error": status[ "error" ],
+			"params": status[ "spec" ][ "response" ],
+		}
+
+	def job( self, path ):
+		'''
+		Handle a request about a background job.
+		"<id>" gives the state of the job, including its progress as the number of rows of the map completed;
+		"<id>/result" gives the map once the job is done, in any of the formats of grid().
 
-			if quant == "regime":
-				vmin = 0.5
-				vmax = 5.5
-				n = [ 0.5, 1.5, 2.5, 3.5, 4.5, 5.5 ]
+		- path: Remainder of the path, of the form "<id>" or "<id>/result"
+		'''
+
+		if self.jobs is None:
+			raise hcds_exception.NotFound
+
+		parts = path.rstrip( "/" ).split( "/" )
+		if len( parts ) > 2 or ( len( parts ) == 2 and parts[ 1 ] != "result" ):
+			raise hcds_exception.NotFound
+
+		status = self.jobs.read_status( parts[ 0 ] )
+		if status is None:
+			raise hcds_exception.NotFound
+
+		if len( parts ) == 1:
+			self.start( "200 OK", [ ( "Content-Type", "application/json" ) ] )
+			self.add_json( self.get_job_state( status ) )
+			return
+
+		if status[ "state" ] != "done":
+			raise hcds_exception.Conflict
+
+		formats = self.get_types()
+		response = dict( status[ "result" ] )
+
+		# All the quantities are available, the one of the submission is the default
+		quant = self.retrieve_quant( formats, response, status[ "spec" ][ "quant" ] )
+
+		render = self.parse_list_query( "render", [ "contour", "raster" ] )
+		if render is None:
+			render = self.get_config( "render", "contour" )
+
+		# The result of a job never changes
+		if self.check_cache( "job", status[ "id" ], formats, quant, render ):
+			return
+
+		arrays = self.jobs.read_result( status[ "id" ] )
+		if arrays is None:
+			raise hcds_exception.NotFound
+
+		self.output_grid( formats, quant, render, response, hcds_coll_grid.from_arrays( arrays ), status[ "spec" ][ "models" ] )
+
+	def run_job( self, spec, progress ):
+		'''
+		Compute the map of a background job, see job_submit().
+		This runs in a thread of the job store, so it uses its own collresolve configuration and bodies.
+		Returns the parameters sent to the caller and the arrays of the map, as expected by hcds_coll_jobs.JobStore.
+
+		- spec: Specification of the job, as built by job_submit()
+		- progress: Function called with the number of rows completed and the total number of rows
+		'''
+
+		conf = collresolve.Conf()
+		collresolve.conf_unit_msun_au_day( conf )
+
+		values = {
+			"mtar": spec[ "tar" ][ 0 ],
+			"mimp": spec[ "imp" ][ 0 ],
+			"tar": collresolve.Body( mass = spec[ "tar" ][ 0 ], radius = spec[ "tar" ][ 1 ] ),
+			"imp": collresolve.Body( mass = spec[ "imp" ][ 0 ], radius = spec[ "imp" ][ 1 ] ),
+		}
+
+		response = dict( spec[ "response" ] )
+
+		x = numpy.linspace( self.ANG_MIN, self.ANG_MAX, spec[ "points" ] )
+		y = numpy.linspace( self.VEL_MIN, self.VEL_MAX, spec[ "points" ] )
+
+		# The rows of all the models are counted for the progress
+		models = [ spec[ "model" ] ] if spec[ "models" ] is None else spec[ "models" ]
+		total = len( models ) * len( y )
+
+		results = []
+		for i, model in enumerate( models ):
+			values[ "model" ] = model
+			self.set_model( model, conf )
+			results.append( self.compute_map( values, response, x, y, conf, lambda done, count: progress( i * count + done, total ) ) )
+
+		progress( total, total )
+
+		result = results[ 0 ] if spec[ "models" ] is None else hcds_coll_grid.stack( results )
+
+		return response, result.get_arrays()
+
+	def get_bulk_columns( self ):
+		'''
+		Read the scenarios sent in the body of a bulk request.
+		The body is either a NPY structured array, a JSON list of objects or a JSON object of lists, using the same names as the query parameters of single().
+		In a JSON object, a single value instead of a list applies to all the scenarios.
+		Returns the number of scenarios and a dictionary of columns.
+		'''
+
+		body = self.get_body( self.get_config( "bulk_max_bytes", 64 * 1024 * 1024 ) )
+
+		try:
+			if body[ : 6 ] == b"\x93NUMPY":
+				array = numpy.load( io.BytesIO( body ), allow_pickle = False )
+				count = len( array )
+				columns = { name: array[ name ] for name in array.dtype.names }
 			else:
-				vmin = -1.
-				vmax = 1.
-				n = [ -100., -1.05, -0.95, -0.85, -0.75, -0.65, -0.55, -0.45, -0.35, -0.25, -0.15, -0.05, 0.05, 0.15, 0.25, 0.35, 0.45, 0.55, 0.65, 0.75, 0.85, 0.95, 1.05, 100. ]
-
-			cmap = matplotlib.cm.get_cmap( "RdBu" )
-			cmap.set_under( "black" )
-			cmap.set_bad( "black" )
-
-			ax.patch.set_facecolor( "white" )
-			ax.patch.set_edgecolor( "white" )
-			ax.contourf( x, y, z, n, cmap = cmap, vmin = vmin, vmax = vmax )
-
-			if figsize.has_cbar():
-				cax = fig.add_axes( figsize.get_cbar_ax_spec() )
-				if quant == "regime":
-					kwargs = { "boundaries": [ 0.5, 1.5, 2.5, 3.5, 4.5, 5.5 ], "values": [ 1., 2., 3., 4., 5. ] }
+				data = json.loads( body )
+
+				if isinstance( data, list ):
+					count = len( data )
+					names = set()
+					for row in data:
+						names.update( row.keys() )
+					columns = { name: [ row.get( name ) for row in data ] for name in names }
 				else:
-					bounds = [ v for v in n ]
-					bounds.pop()
-					bounds.pop( 0 )
-					kwargs = { "boundaries": bounds }
-				norm = matplotlib.colors.Normalize( vmin = vmin, vmax = vmax )
-				mappabble = matplotlib.cm.ScalarMappable( norm, cmap )
-
-				cb = fig.colorbar( mappabble, orientation = figsize.get_cbar_orientation(), cax = cax, **kwargs, filled = True )
-
-			if xscale == "log":
-				ax.set_xscale( "log" )
-				ax.set_xlim( 10 ** xmin, 10 ** xmax )
+					lengths = [ len( value ) for value in data.values() if isinstance( value, list ) ]
+					count = max( lengths ) if len( lengths ) else 1
+					columns = data
+		except:
+			raise hcds_exception.JSONBadRequest( { "error": "invalid payload" } )
+
+		if count > self.get_config( "bulk_max", 100000 ):
+			raise hcds_exception.PayloadTooLarge
+
+		for name in columns:
+			if isinstance( columns[ name ], ( list, numpy.ndarray ) ):
+				if len( columns[ name ] ) != count:
+					raise hcds_exception.JSONBadRequest( { "error": "invalid length", "field": name } )
 			else:
-				ax.set_xlim( xmin, xmax )
+				columns[ name ] = [ columns[ name ] ] * count
 
-			if yscale == "log":
-				ax.set_yscale( "log" )
-				ax.set_ylim( 10 ** ymin, 10 ** ymax )
-			else:
-				ax.set_ylim( ymin, ymax )
-
-			ax.set_xlabel( "$\\mathrm{" + xname + "}$", **figtext.get_text_args() )
-			if not xt is None:
-				ax.set_xticks( xt )
-				ax.set_xticks( [], minor = True )
-			if not xl is None:
-				ax.set_xticklabels( xl, **figtext.get_text_args() )
-
-			ax.set_ylabel( "$\\mathrm{" + yname + "}$", **figtext.get_text_args() )
-			if not yt is None:
-				ax.set_yticks( yt )
-				ax.set_yticks( [], minor = True )
-			if not yl is None:
-				ax.set_yticklabels( yl, **figtext.get_text_args() )
-
-			if figsize.has_cbar():
-				if quant == "acclr":
-					cb.set_label( "Accretion efficiency of largest remnant", **figtext.get_text_args() )
-				elif quant == "accsr":
-					cb.set_label( "Accretion efficiency of second remnant", **figtext.get_text_args() )
-				elif quant == "acctr":
-					cb.set_label( "Accretion efficiency of debris", **figtext.get_text_args() )
-				else:
-					cb.set_label( "Collision regime", **figtext.get_text_args() )
+		return count, columns
 
-				if quant == "regime":
-					cb.set_ticks( [ 1., 2., 3., 4., 5. ] )
-					cb.set_ticklabels( [ "Accretion", "Erosion", "Super cat.", "Graze and Merge", "Hit and Run" ] )
-				else:
-					cb.set_ticks( [ -1., -0.5, 0., 0.5, 1. ] )
+	def bulk_float( self, columns, name, count ):
+		'''
+		Get a column of a bulk request as floating-point numbers; missing, invalid or non-finite values are set to NaN.
+		'''
 
-				figtext.set_cbar( cb )
+		if not name in columns:
+			return numpy.full( count, numpy.nan )
 
-			figtext.set_axes( ax )
+		try:
+			res = numpy.asarray( columns[ name ], dtype = numpy.float64 )
+		except ( TypeError, ValueError ):
+			res = numpy.full( count, numpy.nan )
+			for i, value in enumerate( columns[ name ] ):
+				try:
+					res[ i ] = float( value )
+				except:
+					pass
 
-			if formats[ "data" ] == "image":
-				buffer = io.BytesIO()
-			else:
-				buffer = io.StringIO()
+		res[ ~numpy.isfinite( res ) ] = numpy.nan
 
-			fig.savefig( buffer, dpi = 250, format = formats[ "image" ], facecolor = "none", edgecolor = "none" )
+		return res
 
-			if formats[ "data" ] != "image":
-				response[ "image" ] = buffer.getvalue()
+	def bulk_str( self, columns, name, count ):
+		'''
+		Get a column of a bulk request as strings.
+		'''
 
-			matplotlib.pyplot.close( fig )
+		if not name in columns:
+			return numpy.full( count, "" )
 
-		self.start( "200 OK", [ ( "Content-Type", formats[ "ctype" ] ) ] )
-		if formats[ "data" ] == "image":
+		return numpy.asarray( columns[ name ] ).astype( str )
+
+	def bulk_units( self, units, table ):
+		'''
+		Get the conversion factors of a column of units; unknown units have NaN factors.
+
+		- units: Array of units
+		- table: Dictionary of ( multiplier, divisor ) pairs
+		'''
+
+		keys, inverse = numpy.unique( units, return_inverse = True )
+		factors = numpy.array( [ table.get( key, ( numpy.nan, numpy.nan ) ) for key in keys ] ).reshape( ( len( keys ), 2 ) )
+
+		return factors[ inverse, 0 ], factors[ inverse, 1 ]
+
+	def bulk_mass( self, columns, body, count, target = None ):
+		'''
+		Vectorized version of retrieve_body_mass() for bulk requests; invalid masses are set to NaN.
+		'''
+
+		value = self.bulk_float( columns, "m" + body + "_value", count )
+		unit = self.bulk_str( columns, "m" + body + "_unit", count )
+
+		mul, div = self.bulk_units( unit, self.MASS_UNITS )
+		mass = value * mul / div
+
+		if not target is None:
+			relative = unit == "target"
+			mass[ relative ] = value[ relative ] * target[ relative ]
+
+		with numpy.errstate( invalid = "ignore" ):
+			invalid = ~( mass > 0. )
+			if not target is None:
+				invalid |= mass > target
+
+		mass[ invalid ] = numpy.nan
+
+		return mass
+
+	def bulk_size( self, columns, body, count, mass, model ):
+		'''
+		Vectorized version of retrieve_body_size() for bulk requests.
+		Returns the radii, with NaN for invalid values, and a mask of the bodies whose radius has to be computed by collresolve.
+		'''
+
+		size_type = self.bulk_str( columns, "r" + body + "_type", count )
+		rad_value = self.bulk_float( columns, "r" + body + "_value", count )
+		rad_unit = self.bulk_str( columns, "r" + body + "_unit", count )
+		dens_value = self.bulk_float( columns, "d" + body + "_value", count )
+		dens_unit = self.bulk_str( columns, "d" + body + "_unit", count )
+
+		size = numpy.full( count, numpy.nan )
+
+		e2020 = ( model == "c2019" ) | ( size_type == "e2020" )
+		size[ e2020 ] = 0.
+
+		rad = ( size_type == "rad" ) & ~e2020
+		mul, div = self.bulk_units( rad_unit[ rad ], self.DIST_UNITS )
+		size[ rad ] = rad_value[ rad ] * mul / div
+
+		dens = ( size_type == "dens" ) & ~e2020
+		factor = numpy.where( dens_unit[ dens ] == "cgs", 1.e3, numpy.where( dens_unit[ dens ] == "si", 1., numpy.nan ) )
+		with numpy.errstate( invalid = "ignore" ):
+			density = numpy.where( dens_value[ dens ] * factor > 0., dens_value[ dens ] * factor, numpy.nan )
+			size[ dens ] = numpy.power( 3. / 4. / math.pi * ( mass[ dens ] * self.MASS_KG_MSOL ) / density, 1. / 3. ) / 1.495978707e+11
+
+			size[ ( rad | dens ) & ~( size > 0. ) ] = numpy.nan
+
+		return size, e2020
+
+	def bulk( self ):
+		'''
+		Handle a request to obtain the outcome of many collisions at once.
+		The scenarios are POSTed in the body of the request, see get_bulk_columns().
+		The result is given by columns, with one entry per scenario; the "error" column is 0 for a successful scenario, 1 for invalid parameters and 2 if the outcome could not be computed.
+		'''
+
+		if self.get_env( "REQUEST_METHOD" ) != "POST":
+			raise hcds_exception.MethodNotAllowed
+
+		# The responses are not cached, so that the request always runs
+		self.admit()
+
+		format = self.parse_list_query( "format", [ "json", "npy" ] )
+
+		with self.timing( "params" ):
+			count, columns = self.get_bulk_columns()
+
+			# Validation of all the parameters
+			model = self.bulk_str( columns, "model", count )
+			mtar = self.bulk_mass( columns, "tar", count )
+			mimp = self.bulk_mass( columns, "imp", count, mtar )
+			rtar, etar = self.bulk_size( columns, "tar", count, mtar, model )
+			rimp, eimp = self.bulk_size( columns, "imp", count, mimp, model )
+
+			vel_value = self.bulk_float( columns, "vel_value", count )
+			vel_unit = self.bulk_str( columns, "vel_unit", count )
+			vel = numpy.where( vel_unit == "escape", vel_value, numpy.where( vel_unit == "kms", vel_value / self.VEL_KMS_AUD, numpy.nan ) )
+
+			angle = self.bulk_float( columns, "angle_value", count )
+
+			with numpy.errstate( invalid = "ignore" ):
+				valid = numpy.isin( model, [ "merge", "ls2012", "sl2012", "c2019" ] ) & numpy.isfinite( mtar ) & numpy.isfinite( mimp ) & numpy.isfinite( rtar ) & numpy.isfinite( rimp ) & ( vel > 0. ) & ( angle >= 0. ) & ( angle <= 90. )
+
+		error = numpy.where( valid, 0, 1 ).astype( numpy.int8 )
+		regime = numpy.full( count, -1, dtype = numpy.int8 )
+		acclr = numpy.full( count, numpy.nan )
+		accsr = numpy.full( count, numpy.nan )
+		acctr = numpy.full( count, numpy.nan )
+
+		with self.timing( "resolve" ):
+			# Radii that are computed by collresolve
+			for mass, size, mask in [ ( mtar, rtar, etar ), ( mimp, rimp, eimp ) ]:
+				for i in numpy.nonzero( mask & valid )[ 0 ]:
+					size[ i ] = self.body_radius( float( mass[ i ] ) )
+
+			# Resolve all the collisions, grouped by model to avoid switching the configuration for each scenario
+			for name in numpy.unique( model[ valid ] ):
+				self.set_model( name )
+
+				for i in numpy.nonzero( valid & ( model == name ) )[ 0 ]:
+					tar = collresolve.Body( mass = mtar[ i ], radius = rtar[ i ] )
+					imp = collresolve.Body( mass = mimp[ i ], radius = rimp[ i ] )
+
+					cur_vel = vel[ i ]
+					if vel_unit[ i ] == "escape":
+						cur_vel *= self.escape_velocity( tar, imp )
+
+					self.add_count( "evaluations", 1 )
+
+					try:
+						collresolve.setup( self.conf, tar, imp, cur_vel, math.radians( angle[ i ] ) )
+						res, cur_regime = collresolve.resolve( self.conf, tar, imp, 2, 1 )
+					except:
+						error[ i ] = 2
+						continue
+
+					regime[ i ] = cur_regime
+
+					acclr[ i ] = ( res[ 0 ].mass - tar.mass ) / imp.mass
+					accsr[ i ] = ( res[ 1 ].mass - imp.mass ) / imp.mass
+					acctr[ i ] = ( res[ 2 ].mass ) / imp.mass
+
+		rtar = numpy.where( error == 1, numpy.nan, rtar * self.DIST_REARTH_AU )
+		rimp = numpy.where( error == 1, numpy.nan, rimp * self.DIST_REARTH_AU )
+
+		if format == "npy":
+			array = numpy.zeros( count, dtype = [ ( "error", "i1" ), ( "regime", "i1" ), ( "acclr", "f8" ), ( "accsr", "f8" ), ( "acctr", "f8" ), ( "rtar", "f8" ), ( "rimp", "f8" ) ] )
+			array[ "error" ] = error
+			array[ "regime" ] = regime
+			array[ "acclr" ] = acclr
+			array[ "accsr" ] = accsr
+			array[ "acctr" ] = acctr
+			array[ "rtar" ] = rtar
+			array[ "rimp" ] = rimp
+
+			buffer = io.BytesIO()
+			numpy.save( buffer, array )
+
+			self.start( "200 OK", [ ( "Content-Type", "application/octet-stream" ) ] )
 			self.add_output( buffer.getvalue() )
-		else:
-			self.add_output( bytes( json.dumps( response ), "utf-8" ) )
+			return
+
+		# Non-finite values are encoded as null
+		response = {
+			"count": count,
+			"error": error,
+			"regime": hcds_json.masked( regime, regime < 0 ),
+			"regime_desc": { str( value ): collresolve.regime_desc( value ) for value in numpy.unique( regime[ regime >= 0 ] ).tolist() },
+			"acclr": acclr,
+			"accsr": accsr,
+			"acctr": acctr,
+			"rtar": rtar,
+			"rimp": rimp,
+		}
+
+		self.start( "200 OK", [ ( "Content-Type", "application/json" ) ] )
+		self.add_json( response )
@@ -23,68 +23,180 @@ import tables
 import yaml
 import maexpa
 
+import hcds_db_store
 import hcds_exception
+import hcds_json
 import hcds_responder_sph
 
 class DBResponder( hcds_responder_sph.SPHResponder ):
-	def compute_item( self, config, sub ):
-		h5file = tables.open_file( config[ "file" ] )
+	def retrieve_params( self, config, sub ):
+		'''
+		Retrieve the parameters of the list of simulations: the fields to return and the ranges of values of the fields.
+		The "fields" parameter is a comma-separated list of names of base fields, and the "<name>.min" and "<name>.max" parameters are bounds of the values of a base field.
 
+		- config: Definition of the database
+		- sub: Part of the path after the identifier of the database
+		'''
+
+		if not ( sub is None or sub == "" ):
+			return None
+
+		names = [ item[ "name" ] for item in config[ "base_fields" ] ]
+
+		fields = self.get_param( "fields" )
+		if fields is None:
+			fields = names
+		else:
+			fields = fields.split( "," )
+			if any( [ not name in names for name in fields ] ) or len( set( fields ) ) != len( fields ):
+				raise hcds_exception.JSONBadRequest( { "fields": None } )
+
+		ranges = {}
+		for name in names:
+			bounds = []
+			for bound in [ "min", "max" ]:
+				key = name + "." + bound
+				value = self.parse_float_query( key )
+				if value is None and not self.get_param( key ) is None:
+					raise hcds_exception.JSONBadRequest( { key: None } )
+
+				bounds.append( value )
+
+			if bounds != [ None, None ]:
+				ranges[ name ] = bounds
+
+		return { "fields": fields, "ranges": ranges }
+
+	def open_store( self, config ):
+		'''
+		Open the columnar store of a database, or return None if there is none or if it is out of date, see hcds_db_store.
+
+		- config: Definition of the database
+		'''
+
+		if not self.get_config( "store", True ):
+			return None
+
+		return hcds_db_store.open_store( config[ "file" ], config, self.get_mtime( [ config[ "file" ] ] ) )
+
+	def get_plan_groups( self, h5file ):
+		'''
+		Get the groups over which the fields are evaluated: "base" for the base fields, and one for each simulation, named "sim_NNN", for the other fields.
+		'''
+
+		return { "base_fields": [ "base" ], "fields": [ "sim_{:03d}".format( n ) for n in hcds_db_store.get_sims( h5file ) ] }
+
+	def compute_item( self, plan, sub, params ):
 		if sub is None or sub == "":
-			group = h5file.root.base
+			self.compute_base( plan, params )
+		else:
+			self.compute_sim( plan, sub )
 
-			defs = config[ "base_fields" ]
+	def compute_base( self, plan, params ):
+		'''
+		Send the base fields of the simulations of a database.
 
-			get_data = lambda name: numpy.asarray( getattr( group, name )[ ... ] )
+		- plan: Plan of the database, see hcds_responder_sph.ItemPlan
+		- params: Parameters returned by retrieve_params()
+		'''
 
-			data = [ maexpa.Expression( item[ "data" ], var = get_data )() for item in defs ]
+		config = plan.config
+		names = [ item[ "name" ] for item in config[ "base_fields" ] ]
 
-			items = []
-			for i in range( data[ 0 ].shape[ 0 ] ):
-				entry = {}
-				for j, item in enumerate( defs ):
-					if str( data[ j ].dtype ) == "int64":
-						entry[ item[ "name" ] ] = int( data[ j ][ i ] )
-					else:
-						entry[ item[ "name" ] ] = data[ j ][ i ]
-				items.append( entry )
+		# Fields that are filtered are read as well, even if they are not returned
+		used = params[ "fields" ] + [ name for name in params[ "ranges" ] if not name in params[ "fields" ] ]
+		bounds = [ params[ "ranges" ][ name ] for name in params[ "ranges" ] ]
 
-			h5file.close()
+		store = self.open_store( config )
 
-			fields = []
-			for item in defs:
-				fields.append( { "name": item[ "name" ], "desc": item[ "desc" ], "format": item[ "format" ] } )
+		if not store is None:
+			with self.timing( "read" ):
+				columns = [ store.get_base( names.index( name ) ) for name in used ]
+		else:
+			with self.timing( "read" ):
+				h5file = tables.open_file( config[ "file" ] )
 
-			response = {
-				"fields": fields,
-				"series": items,
-			}
+			try:
+				columns = [ numpy.asarray( column ) for column in self.evaluate( [ config[ "base_fields" ][ names.index( name ) ] for name in used ], h5file.root.base, plan ) ]
+			finally:
+				h5file.close()
+
+		# Only numerical fields can be filtered
+		filtered = [ columns[ used.index( name ) ] for name in params[ "ranges" ] ]
+		for name, column in zip( params[ "ranges" ], filtered ):
+			if column.dtype.kind not in "biuf":
+				raise hcds_exception.JSONBadRequest( { name + ".min": None, name + ".max": None } )
+
+		rows = None
+		if len( bounds ) and not store is None:
+			# Only the chunks whose values may be within the ranges are read
+			chunks = store.select_chunks( { names.index( name ): params[ "ranges" ][ name ] for name in params[ "ranges" ] } )
+			self.add_count( "chunks_skipped", store.get_chunk_count() - len( chunks ) )
+
+			with self.timing( "read" ):
+				rows = [ start + numpy.flatnonzero( hcds_db_store.get_mask( [ column[ start : stop ] for column in filtered ], bounds ) ) for start, stop in chunks ]
+				rows = numpy.concatenate( rows ) if len( rows ) else numpy.zeros( 0, dtype = numpy.int64 )
+		elif len( bounds ):
+			rows = numpy.flatnonzero( hcds_db_store.get_mask( filtered, bounds ) )
+
+		data = columns[ : len( params[ "fields" ] ) ]
+		if not rows is None:
+			data = [ column[ rows ] for column in data ]
+
+		with self.timing( "encode" ):
+			items = hcds_json.records( params[ "fields" ], data )
+
+		fields = []
+		for name in params[ "fields" ]:
+			item = config[ "base_fields" ][ names.index( name ) ]
+			fields.append( { "name": item[ "name" ], "desc": item[ "desc" ], "format": item[ "format" ] } )
+
+		response = {
+			"fields": fields,
+			"series": items,
+		}
+
+		self.start( "200 OK", [ ( "Content-Type", "application/json" ) ] )
+		self.add_json( response )
+
+	def compute_sim( self, plan, sub ):
+		'''
+		Send the fields of one simulation of a database.
 
-			self.start( "200 OK", [ ( "Content-Type", "application/json" ) ] )
-			self.add_output( bytes( json.dumps( response ), "utf-8" ) )
-			return
+		- plan: Plan of the database, see hcds_responder_sph.ItemPlan
+		- sub: Number of the simulation
+		'''
 
 		try:
-			try:
-				num = int( sub )
-				group = h5file.root.__getattr__( "sim_{:03d}".format( num ) )
-			except:
-				raise hcds_exception.NotFound
+			num = int( sub )
+		except ValueError:
+			raise hcds_exception.NotFound
+
+		# Simulations that are not in the file are known from the plan
+		if num < 0 or not "sim_{:03d}".format( num ) in plan.groups.get( "fields", [] ):
+			raise hcds_exception.NotFound
 
-			defs = config[ "fields" ]
+		config = plan.config
+		defs = config[ "fields" ]
+		store = self.open_store( config )
 
-			get_data = lambda name: numpy.asarray( getattr( group, name )[ ... ] )
+		if not store is None:
+			if not store.has_sim( num ):
+				raise hcds_exception.NotFound
+
+			with self.timing( "read" ):
+				data = [ store.get_sim( num, i ) for i in range( len( defs ) ) ]
+		else:
+			with self.timing( "read" ):
+				h5file = tables.open_file( config[ "file" ] )
 
-			data = [ maexpa.Expression( item[ "data" ], var = get_data )() for item in defs ]
+			try:
+				data = self.evaluate( defs, h5file.get_node( "/sim_{:03d}".format( num ) ), plan )
+			finally:
+				h5file.close()
 
-			series = []
-			for i in range( len( data[ 0 ] ) ):
-				point = {}
-				for j, field in enumerate( defs ):
-					point[ field[ "name" ] ] = self.num( data[ j ][ i ] )
-				series.append( point )
-		finally:
-			h5file.close()
+		with self.timing( "encode" ):
+			series = hcds_json.records( [ field[ "name" ] for field in defs ], data )
 
 		response = {
 			"plots": config[ "plots" ],
@@ -92,4 +204,4 @@ class DBResponder( hcds_responder_sph.SPHResponder ):
 		}
 
 		self.start( "200 OK", [ ( "Content-Type", "application/json" ) ] )
-		self.add_output( bytes( json.dumps( response ), "utf-8" ) )
+		self.add_json( response )
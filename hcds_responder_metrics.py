@@ -0,0 +1,34 @@
+# HTTP Collision Data Server (HCDS) Responder for the metrics of the server.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hcds_exception
+import hcds_metrics
+import hcds_responder_base
+
+class MetricsResponder( hcds_responder_base.BaseResponder ):
+	'''
+	Expose the metrics of all the workers in the Prometheus text format.
+	'''
+
+	def __call__( self ):
+		sub = self.get_sub()
+
+		# Disallow subpages
+		if not ( sub is None or sub == "" ):
+			raise hcds_exception.NotFound
+
+		self.start( "200 OK", [ ( "Content-Type", "text/plain; version=0.0.4; charset=utf-8" ) ] )
+		self.add_output( bytes( hcds_metrics.registry.expose(), "utf-8" ) )
@@ -24,37 +24,45 @@ import yaml
 import maexpa
 
 import hcds_exception
+import hcds_json
 import hcds_responder_sph
 
 class SetResponder( hcds_responder_sph.SPHResponder ):
-	def compute_item( self, config, sub ):
+	def get_plan_groups( self, h5file ):
+		'''
+		Get the groups over which the fields are evaluated: one for each series, named "file_NNN".
+		'''
+
+		names = [ name for name in h5file.root._v_groups if name.startswith( "file_" ) and name[ 5 : ].isdigit() ]
+		nums = sorted( [ int( name[ 5 : ] ) for name in names if name == "file_{:03d}".format( int( name[ 5 : ] ) ) ] )
+
+		return { "fields": [ "file_{:03d}".format( n ) for n in nums if n < 1000 ] }
+
+	def compute_item( self, plan, sub, params ):
 		# Disallow subpages
 		if not ( sub is None or sub == "" ):
 			raise hcds_exception.NotFound
 
+		config = plan.config
 		defs = config[ "fields" ]
-		h5file = tables.open_file( config[ "file" ] )
+
+		with self.timing( "read" ):
+			h5file = tables.open_file( config[ "file" ] )
 
 		data = []
 		labels = []
 
 		try:
-			for n in range( 1000 ):
-				try:
-					group = h5file.root.__getattr__( "file_{:03d}".format( n ) )
-				except:
-					continue
-
-				get_data = lambda name: numpy.asarray( getattr( group, name )[ ... ] )
+			for name in plan.groups.get( "fields", [] ):
+				group = h5file.get_node( "/" + name )
 
-				sets = [ maexpa.Expression( item[ "data" ], var = get_data )() for item in defs ]
+				sets = self.evaluate( defs, group, plan )
 
-				items = []
-				for i in range( len( sets[ 0 ] ) ):
-					items.append( [ self.num( dset[ i ] ) for dset in sets ] )
+				with self.timing( "encode" ):
+					items = hcds_json.rows( sets )
 
 				data.append( items )
-				labels.append( group._v_attrs[ "desc" ] )
+				labels.append( plan.labels.get( name ) )
 		finally:
 			h5file.close()
 
@@ -67,4 +75,4 @@ class SetResponder( hcds_responder_sph.SPHResponder ):
 		}
 
 		self.start( "200 OK", [ ( "Content-Type", "application/json" ) ] )
-		self.add_output( bytes( json.dumps( response ), "utf-8" ) )
+		self.add_json( response )
@@ -16,6 +16,8 @@
 
 import math
 import json
+import logging
+import os
 
 import numpy
 import tables
@@ -23,22 +25,107 @@ import tables
 import yaml
 import maexpa
 
+import hcds_cache
 import hcds_exception
+import hcds_materialize
+import hcds_mmap
 import hcds_responder_base
 
+# Problems found in the definitions of the items
+logger = logging.getLogger( "hcds.sph" )
+
+class ItemPlan( object ):
+	'''
+	Definition of an item checked against its HDF5 file, prepared when the definitions are loaded so that requests do not have to look for the groups and datasets.
+	'''
+
+	def __init__( self, config ):
+		'''
+		- config: Definition of the item
+		'''
+
+		self.config = config
+
+		# Names of the groups over which each list of fields is evaluated
+		self.groups = {}
+
+		# Description of each group, from its "desc" attribute
+		self.labels = {}
+
+		# Shape and type of each dataset, for each group
+		self.datasets = {}
+
+		# Fields whose values have been materialized, for each group, see hcds_materialize.find()
+		self.materialized = {}
+
+		# Problems found in the definition
+		self.errors = []
+
 class SPHResponder( hcds_responder_base.BaseResponder ):
 	def __init__( self, config ):
 		hcds_responder_base.BaseResponder.__init__( self, config )
 
-	def get_item_defs( self ):
+		# Datasets mapped into memory, keyed by the file, the dataset and the modification times of their sources
+		self.mmaps = hcds_cache.LRUCache( self.get_config( "mmap_cache", 256 ) )
+
+		# Plans of the items, with the modification times of the files from which they were made, see get_plans()
+		self.plans = None
+		self.plans_key = None
+
+		# Parsed expressions of the fields
+		self.expressions = {}
+
+	def get_defs_file( self ):
+		'''
+		Get the path of the YAML file containing the definitions, or None if it is not set.
+		'''
+
 		confdir = self.get_config( "dir" )
 		conffile = self.get_config( "file" )
 
+		if not conffile is None and not confdir is None:
+			conffile = confdir + "/" + conffile
+
+		return conffile
+
+	def get_mtime( self, names ):
+		'''
+		Get the time of the last modification of a set of files, or None if one of them cannot be accessed.
+
+		- names: Paths of the files, None items are ignored
+		'''
+
+		names = [ name for name in names if not name is None ]
+		if len( names ) == 0:
+			return None
+
+		try:
+			return max( [ os.stat( name ).st_mtime for name in names ] )
+		except OSError:
+			return None
+
+	def get_caches( self ):
+		'''
+		Get the in-memory caches of the module, for the metrics.
+		'''
+
+		return { "mmaps": self.mmaps }
+
+	def get_route_class( self ):
+		'''
+		Get the class of the request for the admission control; only the list of items is light.
+		'''
+
+		sub = self.get_sub()
+
+		return "light" if sub is None or sub == "" else "heavy"
+
+	def get_item_defs( self ):
+		confdir = self.get_config( "dir" )
+		conffile = self.get_defs_file()
+
 		items = None
 		if not conffile is None:
-			if not confdir is None:
-				conffile = confdir + "/" + conffile
-
 			try:
 				items = yaml.load( open( conffile ), Loader = yaml.Loader )
 			except FileNotFoundError:
@@ -48,18 +135,234 @@ class SPHResponder( hcds_responder_base.BaseResponder ):
 		if items is None:
 			items = self.get_config( "items", {} )
 
-		# If it was set, we add the directory path to all data files as well
+		# If it was set, we add the directory path to all data files as well; the definitions are copied so that the configuration is not modified
 		if not confdir is None:
-			for key in items:
-				items[ key ][ "file" ] = confdir + "/" + items[ key ][ "file" ]
+			items = { key: dict( items[ key ], file = confdir + "/" + items[ key ][ "file" ] ) for key in items }
 
 		return items
 
-	def num( self, val ):
-		if math.isfinite( val ):
-			return val
-		else:
-			return None
+	def get_plan_groups( self, h5file ):
+		'''
+		Get the groups of an HDF5 file over which the lists of fields of an item are evaluated, as a dictionary with the keys of the lists of fields as keys and lists of the names of the groups as values.
+
+		- h5file: PyTables file of the item
+		'''
+
+		return {}
+
+	def make_plan( self, key, config ):
+		'''
+		Make the plan of an item, checking that its file, groups and datasets exist and that the expressions of its fields can be evaluated.
+		The expressions are evaluated over single values of the types of the datasets, without reading them, and the shapes of the datasets they use are checked separately.
+
+		- key: Identifier of the item
+		- config: Definition of the item
+		'''
+
+		plan = ItemPlan( config )
+
+		try:
+			h5file = tables.open_file( config[ "file" ] )
+		except Exception as ex:
+			plan.errors.append( "{:s}: cannot open file: {:s}".format( key, str( ex ) ) )
+			return plan
+
+		failed = set()
+
+		try:
+			for defs_key, names in self.get_plan_groups( h5file ).items():
+				plan.groups[ defs_key ] = names
+
+				if not defs_key in config:
+					plan.errors.append( "{:s}: no \"{:s}\" definitions".format( key, defs_key ) )
+					continue
+
+				for name in names:
+					try:
+						group = h5file.get_node( "/" + name )
+					except tables.NoSuchNodeError:
+						plan.errors.append( "{:s}: no group {:s}".format( key, name ) )
+						continue
+
+					datasets = { node._v_name: ( node.shape, node.dtype ) for node in group._f_iter_nodes( "Leaf" ) }
+					plan.datasets[ name ] = datasets
+
+					if "desc" in group._v_attrs:
+						plan.labels[ name ] = group._v_attrs[ "desc" ]
+
+					if self.get_config( "materialized", True ):
+						plan.materialized[ name ] = hcds_materialize.find( h5file, name )
+
+					def get_var( var ):
+						if not var in datasets:
+							raise maexpa.exception.NoVarException( var, -1 )
+
+						shapes.append( datasets[ var ][ 0 ] )
+						return numpy.zeros( (), datasets[ var ][ 1 ] )
+
+					for item in config[ defs_key ]:
+						# Each expression is only reported for the first group where it fails
+						if item[ "data" ] in failed:
+							continue
+
+						shapes = []
+
+						try:
+							# The placeholder values may not be valid for some operations, which is not a problem
+							with numpy.errstate( all = "ignore" ):
+								self.compile( item[ "data" ] )( var = get_var )
+
+							numpy.broadcast_shapes( *shapes )
+						except Exception as ex:
+							failed.add( item[ "data" ] )
+							plan.errors.append( "{:s}: cannot evaluate \"{:s}\" in group {:s}: {:s}".format( key, item[ "data" ], name, str( ex ) ) )
+		finally:
+			h5file.close()
+
+		return plan
+
+	def load_plans( self ):
+		'''
+		Load the definitions of the items and make their plans, reporting the problems found in the log.
+		'''
+
+		self.expressions = {}
+		items = self.get_item_defs()
+
+		plans = {}
+		for key in items:
+			plans[ key ] = self.make_plan( key, items[ key ] )
+			for error in plans[ key ].errors:
+				logger.warning( error )
+
+		self.plans = plans
+		self.plans_key = self.get_plans_key( plans )
+
+	def get_plans_key( self, plans ):
+		'''
+		Get the modification times of the files from which the plans were made, including the directories of the sidecar files, to check whether they are up to date.
+
+		- plans: Dictionary of plans
+		'''
+
+		mtimes = [ self.get_mtime( [ self.get_defs_file() ] ) ]
+		for key in plans:
+			mtimes.append( self.get_mtime( [ plans[ key ].config[ "file" ] ] ) )
+			mtimes.append( self.get_mtime( [ plans[ key ].config[ "file" ] + hcds_mmap.SIDECAR_SUFFIX ] ) )
+
+		return mtimes
+
+	def get_plans( self ):
+		'''
+		Get the plans of the items, as a dictionary with the identifiers of the items as keys.
+		They are made again if the definitions or one of the data files have been modified.
+		'''
+
+		if self.plans is None or self.get_plans_key( self.plans ) != self.plans_key:
+			with self.timing( "plan" ):
+				self.load_plans()
+
+		return self.plans
+
+	def preload( self ):
+		'''
+		Make the plans of the items before the first request, so that problems in the definitions are reported at startup.
+		'''
+
+		self.load_plans()
+
+	def read_data( self, group, name ):
+		'''
+		Read a dataset of an HDF5 file.
+
+		- group: Group of the HDF5 file containing the dataset
+		- name: Name of the dataset
+		'''
+
+		with self.timing( "read" ):
+			node = getattr( group, name )
+
+			if self.get_config( "mmap", True ):
+				array = self.map_data( node )
+				if not array is None:
+					self.add_count( "mapped", 1 )
+					return array
+
+			return numpy.asarray( node[ ... ] )
+
+	def map_data( self, node ):
+		'''
+		Get a read-only array mapped into memory for a dataset, or None if it cannot be mapped, see hcds_mmap.
+
+		- node: PyTables node of the dataset
+		'''
+
+		filename = node._v_file.filename
+		key = ( filename, node._v_pathname, self.get_mtime( [ filename ] ), self.get_mtime( [ hcds_mmap.get_sidecar( filename, node._v_pathname ) ] ) )
+
+		# Datasets that cannot be mapped are also remembered, so that they are not checked again on each request
+		array = self.mmaps.get( key, False )
+		if array is False:
+			array = hcds_mmap.map_node( node )
+			self.mmaps.put( key, array )
+
+		return array
+
+	def evaluate( self, defs, group, plan = None ):
+		'''
+		Evaluate the expressions of a list of field definitions, with the datasets of an HDF5 group available as variables.
+		Returns a list with the values of each field.
+		Fields whose values have been materialized with hcds_materialize.py are read instead of being evaluated.
+
+		- defs: List of field definitions, each with a "data" key containing the expression
+		- group: Group of the HDF5 file containing the datasets
+		- plan: Plan of the item, used to find the materialized fields; if not set, all the fields are evaluated
+		'''
+
+		get_data = lambda name: self.read_data( group, name )
+
+		name = group._v_pathname[ 1 : ]
+		materialized = {} if plan is None else plan.materialized.get( name, {} )
+
+		values = []
+		for item in defs:
+			source = materialized.get( hcds_materialize.get_name( item[ "data" ] ) )
+
+			if source == "file":
+				values.append( self.read_data( getattr( group, hcds_materialize.FIELDS_GROUP ), hcds_materialize.get_name( item[ "data" ] ) ) )
+			elif source == "sidecar":
+				with self.timing( "read" ):
+					values.append( hcds_materialize.load_sidecar( plan.config[ "file" ], name, item[ "data" ] ) )
+			else:
+				with self.timing( "eval" ):
+					values.append( self.compile( item[ "data" ] )( var = get_data ) )
+				continue
+
+			self.add_count( "materialized", 1 )
+
+		return values
+
+	def compile( self, expr ):
+		'''
+		Get the parsed form of an expression, which is kept so that it is only parsed once.
+
+		- expr: Expression
+		'''
+
+		if not expr in self.expressions:
+			self.expressions[ expr ] = maexpa.Expression( expr )
+
+		return self.expressions[ expr ]
+
+	def retrieve_params( self, config, sub ):
+		'''
+		Retrieve and normalize the parameters of the query string used by compute_item(); there are none by default.
+
+		- config: Definition of the item
+		- sub: Part of the path after the identifier of the item
+		'''
+
+		return None
 
 	def __call__( self ):
 		"""
@@ -67,16 +370,19 @@ class SPHResponder( hcds_responder_base.BaseResponder ):
 		"""
 
 		sub = self.get_sub()
-		items = self.get_item_defs()
+		plans = self.get_plans()
 
 		# The base URL lists all available items
 		if sub is None or sub == "":
 			response = []
-			for key in items:
-				response.append( { "name": key, "desc": items[ key ][ "desc" ] } )
+			for key in plans:
+				response.append( { "name": key, "desc": plans[ key ].config[ "desc" ] } )
+
+			if self.check_validators( [ response ], self.get_mtime( [ self.get_defs_file() ] ) ):
+				return
 
 			self.start( "200 OK", [ ( "Content-Type", "application/json" ) ] )
-			self.add_output( bytes( json.dumps( response ), "utf-8" ) )
+			self.add_json( response )
 			return
 
 		sep = sub.find( "/" )
@@ -87,9 +393,17 @@ class SPHResponder( hcds_responder_base.BaseResponder ):
 			item = sub[ : sep ]
 			query = sub[ sep + 1 : ]
 
-		for key in items:
-			if item == key:
-				self.compute_item( items[ key ], query )
-				return
+		if not item in plans:
+			raise hcds_exception.NotFound
+
+		plan = plans[ item ]
+		params = self.retrieve_params( plan.config, query )
+
+		# The response only depends on the definition of the item, on its parameters and on the files from which its values are read
+		mtimes = [ self.get_mtime( [ name ] ) for name in [ plan.config[ "file" ], self.get_defs_file(), plan.config[ "file" ] + hcds_mmap.SIDECAR_SUFFIX ] ]
+		if mtimes[ 0 ] is None:
+			self.admit()
+		elif self.check_validators( [ item, plan.config, query, params, mtimes ], max( [ mtime for mtime in mtimes if not mtime is None ] ) ):
+			return
 
-		raise hcds_exception.NotFound
+		self.compute_item( plan, query, params )
@@ -0,0 +1,227 @@
+# HTTP Collision Data Server (HCDS) coalescing of identical requests.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+
+import hcds_config
+
+# Time between two attempts to lock the file of a computation run by another worker
+POLL = 0.01
+
+# Minimum time in seconds between two removals of the expired files of SINGLEFLIGHT_DIR by a worker
+SWEEP_INTERVAL = 60.
+
+class Flight( object ):
+	'''
+	Computation in progress in the current process, which other requests can wait for.
+	'''
+
+	def __init__( self, key ):
+		self.key = key
+		self.event = threading.Event()
+		self.result = None
+		self.fd = None
+
+flights = {}
+lock = threading.Lock()
+
+# Time of the last removal of the expired files by this process, see sweep()
+swept = None
+
+def get_file( key, ext ):
+	return os.path.join( hcds_config.SINGLEFLIGHT_DIR, hashlib.sha1( bytes( key, "utf-8" ) ).hexdigest() + ext )
+
+def read_result( key ):
+	'''
+	Read the result of a computation shared by another worker, if it is recent enough.
+	Returns a tuple of the status, the headers and the body, or None.
+
+	- key: Key of the computation
+	'''
+
+	name = get_file( key, ".result" )
+
+	try:
+		if time.time() - os.stat( name ).st_mtime > hcds_config.SINGLEFLIGHT_TTL:
+			return None
+
+		with open( name, "rb" ) as f:
+			head = json.loads( f.readline() )
+			body = f.read()
+	except ( OSError, ValueError ):
+		return None
+
+	if head[ "key" ] != key:
+		return None
+
+	return ( head[ "status" ], [ tuple( item ) for item in head[ "headers" ] ], body )
+
+def write_result( key, result ):
+	'''
+	Share the result of a computation with the other workers.
+
+	- key: Key of the computation
+	- result: Tuple of the status, the headers and the body
+	'''
+
+	name = get_file( key, ".result" )
+	tmp = name + ".{:d}.tmp".format( os.getpid() )
+
+	with open( tmp, "wb" ) as f:
+		f.write( bytes( json.dumps( { "key": key, "status": result[ 0 ], "headers": result[ 1 ] } ), "utf-8" ) + b"\n" )
+		f.write( result[ 2 ] )
+
+	os.replace( tmp, name )
+
+def sweep( force = False ):
+	'''
+	Remove the results that expired and the lock files that are not used anymore, at most once every SWEEP_INTERVAL seconds.
+	A lock file is only removed if it has not been used for longer than SINGLEFLIGHT_TIMEOUT and if it is not locked.
+	A worker that opened it just before it is removed may compute the same response as another one, which is harmless.
+
+	- force: Whether to remove the files even if the last removal is more recent than the interval
+	'''
+
+	global swept
+
+	now = time.monotonic()
+	if not force and not swept is None and now - swept < SWEEP_INTERVAL:
+		return
+
+	swept = now
+	now = time.time()
+
+	try:
+		entries = list( os.scandir( hcds_config.SINGLEFLIGHT_DIR ) )
+	except OSError:
+		return
+
+	for entry in entries:
+		try:
+			age = now - entry.stat().st_mtime
+
+			if entry.name.endswith( ".result" ) and age > hcds_config.SINGLEFLIGHT_TTL:
+				os.remove( entry.path )
+			elif entry.name.endswith( ".lock" ) and age > hcds_config.SINGLEFLIGHT_TIMEOUT + hcds_config.SINGLEFLIGHT_TTL:
+				fd = os.open( entry.path, os.O_RDWR )
+
+				try:
+					fcntl.flock( fd, fcntl.LOCK_EX | fcntl.LOCK_NB )
+					os.remove( entry.path )
+				finally:
+					os.close( fd )
+		except OSError:
+			pass
+
+def lock_file( key, timeout ):
+	'''
+	Lock the file of a computation, waiting for another worker that computes it.
+	Returns the file descriptor, or None if the lock could not be obtained in time.
+
+	- key: Key of the computation
+	- timeout: Maximum time to wait, in seconds
+	'''
+
+	os.makedirs( hcds_config.SINGLEFLIGHT_DIR, exist_ok = True )
+
+	fd = os.open( get_file( key, ".lock" ), os.O_RDWR | os.O_CREAT, 0o644 )
+	deadline = time.monotonic() + timeout
+
+	while True:
+		try:
+			fcntl.flock( fd, fcntl.LOCK_EX | fcntl.LOCK_NB )
+
+			# The time of the last use tells sweep() which files can be removed
+			os.utime( fd )
+			return fd
+		except OSError:
+			if time.monotonic() >= deadline:
+				os.close( fd )
+				return None
+
+			time.sleep( POLL )
+
+def join( key ):
+	'''
+	Join the computation of a response.
+	If an identical computation is in progress, in this process or in another worker, its result is awaited; nothing is shared if SINGLEFLIGHT_DIR is not set.
+	Returns a tuple with the result as (status, headers, body), or None if the response has to be computed,
+	and a Flight object to pass to leave() once it is computed, or None if the result is not to be shared.
+
+	- key: Key of the computation, such as the ETag of the response
+	'''
+
+	if not hcds_config.SINGLEFLIGHT or hcds_config.SINGLEFLIGHT_DIR is None:
+		return None, None
+
+	with lock:
+		flight = flights.get( key )
+		leader = flight is None
+		if leader:
+			flight = Flight( key )
+			flights[ key ] = flight
+
+	if not leader:
+		flight.event.wait( hcds_config.SINGLEFLIGHT_TIMEOUT )
+
+		# If the computation failed or took too long, the request runs its own
+		return flight.result, None
+
+	sweep()
+
+	flight.fd = lock_file( key, 0. )
+
+	# Another worker computes the response; its result is used once it has finished
+	if flight.fd is None:
+		flight.fd = lock_file( key, hcds_config.SINGLEFLIGHT_TIMEOUT )
+
+		if not flight.fd is None:
+			result = read_result( key )
+			if not result is None:
+				leave( flight, result, False )
+				return result, None
+
+	return None, flight
+
+def leave( flight, result, share = True ):
+	'''
+	Provide the result of a computation to the requests that wait for it.
+
+	- flight: The Flight object returned by join()
+	- result: Result as (status, headers, body), or None if the computation failed
+	- share: Whether to share the result with the other workers
+	'''
+
+	if not flight.fd is None:
+		try:
+			if share and not result is None:
+				write_result( flight.key, result )
+		finally:
+			# Closing the file releases the lock
+			os.close( flight.fd )
+			flight.fd = None
+
+	with lock:
+		if flights.get( flight.key ) is flight:
+			del flights[ flight.key ]
+
+	flight.result = result
+	flight.event.set()
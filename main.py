@@ -16,15 +16,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+import logging
+import time
 import urllib.parse
 import wsgiref.simple_server
 
 import hcds_config
 import hcds_exception
+import hcds_metrics
+import hcds_profile
 import hcds_responder_base
 
+# Responders of the modules; they hold the state of the request being handled, so each worker must handle one request at a time
 responder_cache = {}
 
+# Structured log of the requests, one JSON object per line
+request_log = logging.getLogger( "hcds.request" )
+if not hcds_config.REQUEST_LOG is None:
+	if hcds_config.REQUEST_LOG == "-":
+		request_log_handler = logging.StreamHandler()
+	else:
+		request_log_handler = logging.FileHandler( hcds_config.REQUEST_LOG )
+	request_log_handler.setFormatter( logging.Formatter( "%(message)s" ) )
+	request_log.addHandler( request_log_handler )
+	request_log.setLevel( logging.INFO )
+	request_log.propagate = False
+
 def get_responder( path ):
 	'''
 	Get a responder for the given path component.
@@ -50,16 +68,61 @@ def get_responder( path ):
 		elif name == "db":
 			import hcds_responder_db
 			responder_cache[ path ] = hcds_responder_db.DBResponder( config )
+		elif name == "metrics":
+			import hcds_responder_metrics
+			responder_cache[ path ] = hcds_responder_metrics.MetricsResponder( config )
 		else:
 			raise hcds_exception.NotFound
 
 	return responder_cache[ path ]
 
+def preload():
+	'''
+	Create the responders of the "sph" and "db" modules and make the plans of their items, so that problems in their definitions are reported at startup.
+	The other modules are created on their first request, since some start threads that would not survive the fork of the workers.
+	'''
+
+	for path in hcds_config.MODS:
+		if hcds_config.MODS[ path ][ 0 ] in [ "sph", "db" ]:
+			get_responder( path ).preload()
+
+def log_request( environ, module, begin ):
+	'''
+	Write the summary of a request to the request log.
+
+	- environ: WSGI environment
+	- module: The hcds_responder_base.BaseResponder object that handled the request
+	- begin: Time at which the request started, as given by time.time()
+	'''
+
+	if not request_log.isEnabledFor( logging.INFO ):
+		return
+
+	request_log.info( json.dumps( {
+		"time": begin,
+		"method": environ.get( "REQUEST_METHOD" ),
+		"path": environ.get( "PATH_INFO" ),
+		"query": environ.get( "QUERY_STRING", "" ),
+		"status": int( module.status.split( " " )[ 0 ] ),
+		"bytes": sum( [ len( item ) for item in module.get_output() ] ),
+		"duration": module.get_timings().get( "total", 0. ) * 1.e3,
+		"timings": { name: duration * 1.e3 for name, duration in module.get_timings().items() },
+	} ) )
+
 def hcds_app( environ, respond ):
 	'''
 	Main WSGI entry point for the package.
 	'''
 
+	begin = time.time()
+	begin_perf = time.perf_counter()
+	module = None
+	url = None
+	base = ""
+	route = ""
+
+	profiler, profile_requested = hcds_profile.start( environ, environ.get( "QUERY_STRING", "" ) )
+
 	try:
 		url = urllib.parse.urlparse( wsgiref.util.request_uri( environ ) )
 
@@ -75,25 +138,79 @@ def hcds_app( environ, respond ):
 		else:
 			base = path[ : next_div ]
 			sub = path[ next_div + 1 : ]
+			route = sub.split( "/" )[ 0 ]
 
 		module = get_responder( base )
 		module.set_request( environ, respond )
 		module.set_url( url, sub )
-		module()
+
+		# The profile of a request must cover its own computation, and the report must not be given to other requests
+		module.singleflight = not profile_requested
+
+		# The responder waits for its admission once it knows that the response has to be computed, see BaseResponder.check_validators()
+		try:
+			module()
+		finally:
+			module.release()
+		module.share_result()
+		hcds_profile.finish( profiler, profile_requested, module, base, route )
+		module.add_timing( "total", time.perf_counter() - begin_perf )
+		module.finish()
 		out = module.get_output()
+		log_request( environ, module, begin )
+		hcds_metrics.record_request( base, route, module )
 		module.clean()
 
 		return out
 	except hcds_exception.HCDSException as ex:
+		timings = {}
+		counts = {}
+		caches = {}
+		if not module is None:
+			timings = module.get_timings()
+			counts = module.get_counts()
+			caches = module.get_caches()
+			module.clean()
+		else:
+			# Unknown paths must not create new series in the metrics
+			base = ""
+			route = ""
+
+		if isinstance( ex, hcds_exception.NotFound ):
+			route = ""
+
 		error = hcds_responder_base.ErrorResponder( {}, ex )
 
 		error.set_request( environ, respond )
-		error.set_url( url, None )
+		if not url is None:
+			error.set_url( url, None )
 
 		error()
+		hcds_profile.finish( profiler, profile_requested, error, base, route )
+		for name, duration in timings.items():
+			error.add_timing( name, duration )
+		for name, count in counts.items():
+			error.add_count( name, count )
+		error.add_timing( "total", time.perf_counter() - begin_perf )
+		error.finish()
+		log_request( environ, error, begin )
+		hcds_metrics.record_request( base, route, error, ex, caches )
 
 		return error.get_output()
+	except Exception:
+		# The identical requests must not wait for a computation that failed, see BaseResponder.clean()
+		if not module is None:
+			module.clean()
+
+		raise
+	finally:
+		# The profiler must not keep running for the next requests if the request failed; it was already stopped otherwise
+		if not profiler is None:
+			profiler.disable()
+
 
+if hcds_config.PRELOAD:
+	preload()
 
 if __name__ == '__main__':
 	server = wsgiref.simple_server.make_server( hcds_config.SERVER_ADDRESS, hcds_config.SERVER_PORT, hcds_app )
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+#
+# Replay of recorded requests to the HTTP Collision Data Server (HCDS)
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import concurrent.futures
+import fnmatch
+import io
+import json
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import wsgiref.util
+
+import numpy
+
+import hcds_config
+
+def read_log( name, methods ):
+	'''
+	Read the requests from a log written with the REQUEST_LOG setting.
+	Returns a list of dictionaries with the time, path and query string of the requests, sorted by time.
+
+	- name: Name of the log file, or "-" for the standard input
+	- methods: HTTP methods of the requests to keep
+	'''
+
+	requests = []
+	skipped = 0
+
+	f = sys.stdin if name == "-" else open( name, "r" )
+	try:
+		for line in f:
+			line = line.strip()
+			if len( line ) == 0:
+				continue
+
+			try:
+				item = json.loads( line )
+			except ValueError:
+				skipped += 1
+				continue
+
+			# The bodies are not logged, so requests that need one cannot be replayed
+			if not isinstance( item, dict ) or not "path" in item or not item.get( "method", "GET" ) in methods:
+				skipped += 1
+				continue
+
+			requests.append( { "time": float( item.get( "time", 0. ) ), "path": item[ "path" ], "query": item.get( "query", "" ) or "" } )
+	finally:
+		if not f is sys.stdin:
+			f.close()
+
+	if skipped > 0:
+		print( "Skipped {:d} lines that are not replayable requests".format( skipped ), file = sys.stderr )
+
+	requests.sort( key = lambda item: item[ "time" ] )
+
+	return requests
+
+def get_endpoint( path ):
+	'''
+	Get the name of the endpoint of a request, made of the module and the first component of the path inside the module.
+
+	- path: Path of the request
+	'''
+
+	if path.startswith( hcds_config.BASE_PATH ):
+		path = path[ len( hcds_config.BASE_PATH ) : ]
+
+	return "/".join( path.split( "/" )[ : 2 ] )
+
+def send_local( request ):
+	'''
+	Send a request to hcds_app in the current process.
+	Returns the status code and the size of the body.
+
+	- request: Request as returned by read_log()
+	'''
+
+	import main
+
+	environ = {}
+	wsgiref.util.setup_testing_defaults( environ )
+	environ[ "PATH_INFO" ] = request[ "path" ]
+	environ[ "QUERY_STRING" ] = request[ "query" ]
+	environ[ "wsgi.input" ] = io.BytesIO()
+
+	status = []
+	out = main.hcds_app( environ, lambda cur, headers: status.append( cur ) )
+
+	return int( status[ 0 ].split( " " )[ 0 ] ), sum( [ len( item ) for item in out ] )
+
+def send_remote( url, request, timeout ):
+	'''
+	Send a request to a running server.
+	Returns the status code and the size of the body.
+
+	- url: Base URL of the server, without trailing "/"
+	- request: Request as returned by read_log()
+	- timeout: Timeout in seconds
+	'''
+
+	full = url + request[ "path" ]
+	if len( request[ "query" ] ):
+		full += "?" + request[ "query" ]
+
+	try:
+		with urllib.request.urlopen( full, timeout = timeout ) as res:
+			return res.status, len( res.read() )
+	except urllib.error.HTTPError as ex:
+		return ex.code, len( ex.read() )
+
+def replay( requests, send, speed, concurrency ):
+	'''
+	Replay the requests.
+	Returns a list of tuples of the endpoint, the status code, the size of the body, the latency and the delay between the scheduled and the actual start of each request, in seconds.
+
+	- requests: Requests as returned by read_log()
+	- send: Function sending one request and returning its status code and size
+	- speed: Factor by which the original rate is multiplied, or 0 to send the requests as fast as possible
+	- concurrency: Maximum number of requests in progress at the same time
+	'''
+
+	results = []
+	lock = threading.Lock()
+
+	def run( request, scheduled ):
+		start = time.perf_counter()
+
+		try:
+			status, size = send( request )
+		except Exception as ex:
+			print( "{:s}: {:s}".format( request[ "path" ], str( ex ) ), file = sys.stderr )
+			status, size = 0, 0
+
+		latency = time.perf_counter() - start
+
+		with lock:
+			results.append( ( get_endpoint( request[ "path" ] ), status, size, latency, start - scheduled ) )
+
+	begin = time.perf_counter()
+	first = requests[ 0 ][ "time" ] if len( requests ) else 0.
+
+	with concurrent.futures.ThreadPoolExecutor( max_workers = concurrency ) as pool:
+		# Limits the number of requests waiting for a worker, so that a slow server delays the schedule instead of filling the memory
+		slots = threading.Semaphore( concurrency * 2 )
+
+		for request in requests:
+			if speed > 0.:
+				scheduled = begin + ( request[ "time" ] - first ) / speed
+				wait = scheduled - time.perf_counter()
+				if wait > 0.:
+					time.sleep( wait )
+			else:
+				scheduled = time.perf_counter()
+
+			slots.acquire()
+			future = pool.submit( run, request, scheduled )
+			future.add_done_callback( lambda future: slots.release() )
+
+	return results, time.perf_counter() - begin
+
+def summarize( results ):
+	'''
+	Compute the latency distribution of each endpoint.
+	Returns a dictionary with the endpoints as keys, and "all" for all the requests.
+
+	- results: Results as returned by replay()
+	'''
+
+	groups = {}
+	for endpoint, status, size, latency, delay in results:
+		groups.setdefault( endpoint, [] ).append( ( status, size, latency, delay ) )
+	groups[ "all" ] = [ item[ 1 : ] for item in results ]
+
+	summary = {}
+	for endpoint, items in groups.items():
+		latency = numpy.array( [ item[ 2 ] for item in items ] ) * 1.e3
+
+		summary[ endpoint ] = {
+			"count": len( items ),
+			"errors": sum( [ 1 for item in items if item[ 0 ] < 200 or item[ 0 ] >= 400 ] ),
+			"bytes": sum( [ item[ 1 ] for item in items ] ),
+			"mean": float( latency.mean() ),
+			"p50": float( numpy.percentile( latency, 50 ) ),
+			"p90": float( numpy.percentile( latency, 90 ) ),
+			"p99": float( numpy.percentile( latency, 99 ) ),
+			"max": float( latency.max() ),
+			"delay": float( max( [ item[ 3 ] for item in items ] ) ) * 1.e3,
+		}
+
+	return summary
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser( description = "Replay requests recorded in the log set by REQUEST_LOG." )
+	parser.add_argument( "log", help = "Log file, or \"-\" for the standard input" )
+	parser.add_argument( "--url", help = "Base URL of the server to send the requests to, e.g. http://localhost:9099; if not set, the requests are handled in this process with the configuration of hcds_config.py" )
+	parser.add_argument( "--speed", type = float, default = 1., help = "Factor by which the original rate is multiplied; 0 sends the requests as fast as possible" )
+	parser.add_argument( "--concurrency", type = int, default = 1, help = "Maximum number of requests in progress at the same time" )
+	parser.add_argument( "--timeout", type = float, default = 60., help = "Timeout of each request sent to a server, in seconds" )
+	parser.add_argument( "--only", action = "append", help = "Only replay requests whose endpoint matches this shell pattern; can be given multiple times" )
+	parser.add_argument( "--limit", type = int, help = "Maximum number of requests to replay" )
+	parser.add_argument( "--json", help = "Write the summary to this JSON file" )
+	args = parser.parse_args()
+
+	if args.url is None and args.concurrency > 1:
+		# The responders are shared between requests in a worker, as in uwsgi without threads
+		parser.error( "requests handled in this process cannot be concurrent; use --url with a server running several workers" )
+
+	requests = read_log( args.log, [ "GET", "HEAD" ] )
+
+	if not args.only is None:
+		requests = [ item for item in requests if any( [ fnmatch.fnmatchcase( get_endpoint( item[ "path" ] ), pattern ) for pattern in args.only ] ) ]
+
+	if not args.limit is None:
+		requests = requests[ : args.limit ]
+
+	if len( requests ) == 0:
+		print( "No request to replay", file = sys.stderr )
+		sys.exit( 1 )
+
+	if args.url is None:
+		send = send_local
+	else:
+		url = args.url.rstrip( "/" )
+		send = lambda request: send_remote( url, request, args.timeout )
+
+	results, duration = replay( requests, send, args.speed, args.concurrency )
+	summary = summarize( results )
+
+	print( "Replayed {:d} requests in {:.3f} s ({:.2f} req/s)".format( len( results ), duration, len( results ) / duration ) )
+	print( "{:30s} {:>7s} {:>6s} {:>9s} {:>9s} {:>9s} {:>9s} {:>9s} {:>9s}".format( "endpoint", "count", "errors", "mean ms", "p50 ms", "p90 ms", "p99 ms", "max ms", "late ms" ) )
+	for endpoint in sorted( summary, key = lambda name: ( name == "all", name ) ):
+		res = summary[ endpoint ]
+		print( "{:30s} {:7d} {:6d} {:9.3f} {:9.3f} {:9.3f} {:9.3f} {:9.3f} {:9.3f}".format( endpoint, res[ "count" ], res[ "errors" ], res[ "mean" ], res[ "p50" ], res[ "p90" ], res[ "p99" ], res[ "max" ], res[ "delay" ] ) )
+
+	if not args.json is None:
+		with open( args.json, "w" ) as f:
+			json.dump( { "duration": duration, "endpoints": summary }, f, indent = "\t" )
@@ -0,0 +1,124 @@
+# Unit testing for the hcds_admission module.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import multiprocessing
+import tempfile
+import threading
+
+import hcds_admission
+import hcds_config
+import hcds_exception
+import hcds_responder_base
+
+def hold_slot( path, acquired, done ):
+	'''
+	Take the slot of a limiter in another process until the test is done.
+	'''
+
+	limiter = hcds_admission.FileLimiter( path, "heavy", 1, 0 )
+	token = limiter.acquire( 1. )
+	acquired.set()
+	done.wait( 10. )
+	limiter.release( token )
+
+class AdmissionTestCase( unittest.TestCase ):
+	def test_local( self ):
+		limiter = hcds_admission.LocalLimiter( 1, 0 )
+
+		token = limiter.acquire( 0.1 )
+		self.assertTrue( token )
+		self.assertEqual( limiter.acquire( 0.1 ), None )
+
+		limiter.release( token )
+		self.assertTrue( limiter.acquire( 0.1 ) )
+
+	def test_local_queue( self ):
+		limiter = hcds_admission.LocalLimiter( 1, 1 )
+
+		token = limiter.acquire( 0.1 )
+		threading.Timer( 0.05, limiter.release, [ token ] ).start()
+
+		self.assertTrue( limiter.acquire( 5. ) )
+		self.assertEqual( limiter.waiting, 0 )
+
+	def test_file( self ):
+		with tempfile.TemporaryDirectory() as path:
+			limiter = hcds_admission.FileLimiter( path, "heavy", 1, 1 )
+			other = hcds_admission.FileLimiter( path, "heavy", 1, 1 )
+
+			token = limiter.acquire( 0.1 )
+			self.assertFalse( token is None )
+			self.assertEqual( other.acquire( 0.05 ), None )
+
+			threading.Timer( 0.05, limiter.release, [ token ] ).start()
+
+			token = other.acquire( 5. )
+			self.assertFalse( token is None )
+			other.release( token )
+
+	def test_file_process( self ):
+		with tempfile.TemporaryDirectory() as path:
+			acquired = multiprocessing.Event()
+			done = multiprocessing.Event()
+
+			process = multiprocessing.Process( target = hold_slot, args = ( path, acquired, done ) )
+			process.start()
+
+			try:
+				self.assertTrue( acquired.wait( 10. ) )
+
+				# The slot is used by the other process
+				limiter = hcds_admission.FileLimiter( path, "heavy", 1, 0 )
+				self.assertEqual( limiter.acquire( 0.05 ), None )
+			finally:
+				done.set()
+				process.join( 10. )
+
+			token = limiter.acquire( 0.1 )
+			self.assertFalse( token is None )
+			limiter.release( token )
+
+	def test_admit( self ):
+		saved = ( hcds_config.ADMISSION, hcds_config.ADMISSION_DIR, hcds_admission.limiters )
+		hcds_config.ADMISSION = { "heavy": { "slots": 1, "queue": 0, "retry_after": 7 } }
+
+		try:
+			with tempfile.TemporaryDirectory() as path:
+				for admission_dir in [ None, path ]:
+					hcds_config.ADMISSION_DIR = admission_dir
+					hcds_admission.limiters = {}
+
+					resp = hcds_responder_base.BaseResponder( {} )
+
+					with hcds_admission.admit( "light", resp ):
+						with hcds_admission.admit( "heavy", resp ):
+							with self.assertRaises( hcds_exception.ServiceUnavailable ) as cm:
+								with hcds_admission.admit( "heavy", resp ):
+									pass
+
+					self.assertEqual( cm.exception.get_headers(), [ ( "Retry-After", "7" ) ] )
+					self.assertIn( "queue", resp.get_timings() )
+
+					# The slot is available again
+					with hcds_admission.admit( "heavy", resp ):
+						pass
+		finally:
+			hcds_config.ADMISSION, hcds_config.ADMISSION_DIR, hcds_admission.limiters = saved
+
+if __name__ == '__main__':
+	unittest.main()
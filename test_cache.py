@@ -0,0 +1,59 @@
+# Unit testing for the hcds_cache module.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import hcds_cache
+
+class LRUCacheTestCase( unittest.TestCase ):
+	def test_get_put( self ):
+		cache = hcds_cache.LRUCache( 2 )
+
+		self.assertEqual( cache.get( "none" ), None )
+		self.assertEqual( cache.get( "none", 123. ), 123. )
+
+		cache.put( "key", "value" )
+
+		self.assertEqual( cache.get( "key" ), "value" )
+		self.assertEqual( cache.hits, 1 )
+		self.assertEqual( cache.misses, 2 )
+
+	def test_eviction( self ):
+		cache = hcds_cache.LRUCache( 2 )
+
+		cache.put( "one", 1 )
+		cache.put( "two", 2 )
+		cache.get( "one" )
+		cache.put( "three", 3 )
+
+		self.assertEqual( len( cache ), 2 )
+		self.assertTrue( "one" in cache )
+		self.assertFalse( "two" in cache )
+		self.assertTrue( "three" in cache )
+
+	def test_disabled( self ):
+		cache = hcds_cache.LRUCache( 0 )
+
+		cache.put( "key", "value" )
+
+		self.assertEqual( len( cache ), 0 )
+
+	def test_make_key( self ):
+		self.assertEqual( hcds_cache.make_key( { "a": 1, "b": 2 }, "x" ), hcds_cache.make_key( { "b": 2, "a": 1 }, "x" ) )
+		self.assertNotEqual( hcds_cache.make_key( { "a": 1 }, "x" ), hcds_cache.make_key( { "a": 1 }, "y" ) )
+
+if __name__ == '__main__':
+	unittest.main()
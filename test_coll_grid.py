@@ -0,0 +1,93 @@
+# Unit testing for the hcds_coll_grid module.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy
+
+import hcds_coll_grid
+import hcds_config
+import hcds_json
+
+class GridResultTestCase( unittest.TestCase ):
+	def make_result( self ):
+		result = hcds_coll_grid.empty( numpy.array( [ 0., 45., 90. ] ), numpy.array( [ 1., 2. ] ) )
+
+		result.regime[ 0, : ] = [ 1, 5, 5 ]
+		result.acclr[ 0, : ] = [ 1., 0.5, 0.25 ]
+		result.accsr[ 0, : ] = [ 0., -0.5, numpy.nan ]
+		result.valid[ 0, : ] = True
+
+		return result
+
+	def test_empty( self ):
+		result = hcds_coll_grid.empty( numpy.zeros( 3 ), numpy.zeros( 2 ) )
+
+		self.assertEqual( result.regime.dtype, numpy.int8 )
+		self.assertEqual( result.acclr.dtype, numpy.float32 )
+		self.assertEqual( result.valid.shape, ( 2, 3 ) )
+		self.assertFalse( result.valid.any() )
+		self.assertFalse( result.is_stacked() )
+
+	def test_get( self ):
+		result = self.make_result()
+
+		self.assertEqual( result.get( "regime" ).tolist(), [ [ 1, 5, 5 ], [ 0, 0, 0 ] ] )
+		self.assertEqual( result.get( "acclr" ).tolist(), [ [ 1., 0.5, 0.25 ], [ 0., 0., 0. ] ] )
+
+		# The second remnant only exists in hit and run collisions; non-finite values are replaced
+		accsr = result.get( "accsr" )
+		self.assertAlmostEqual( float( accsr[ 0, 0 ] ), -1.1, 6 )
+		self.assertEqual( accsr[ 0, 1 : ].tolist(), [ -0.5, 0. ] )
+		self.assertEqual( accsr[ 1 ].tolist(), [ 0., 0., 0. ] )
+
+	def test_json( self ):
+		saved = hcds_config.JSON_ENCODER
+		hcds_config.JSON_ENCODER = "json"
+
+		try:
+			result = self.make_result()
+			result.acclr[ 0, 0 ] = 0.1
+
+			# The values are encoded as they are in single precision, and the missing second remnant as exactly -1.1
+			self.assertEqual( hcds_json.dumps( result.get( "acclr" )[ 0 ] ), b"[0.1, 0.5, 0.25]" )
+			self.assertEqual( hcds_json.dumps( result.get( "accsr" )[ 0 ] ), b"[-1.1, -0.5, 0.0]" )
+		finally:
+			hcds_config.JSON_ENCODER = saved
+
+	def test_arrays( self ):
+		result = self.make_result()
+		other = hcds_coll_grid.from_arrays( result.get_arrays() )
+
+		for quant in hcds_coll_grid.QUANTS:
+			numpy.testing.assert_array_equal( other.get( quant ), result.get( quant ) )
+
+	def test_stack( self ):
+		result = hcds_coll_grid.stack( [ self.make_result(), hcds_coll_grid.empty( numpy.zeros( 3 ), numpy.zeros( 2 ) ) ] )
+
+		self.assertTrue( result.is_stacked() )
+		self.assertEqual( result.get( "regime" ).shape, ( 2, 2, 3 ) )
+		self.assertEqual( result.get( "regime" )[ 1 ].tolist(), [ [ 0, 0, 0 ], [ 0, 0, 0 ] ] )
+
+	def test_freeze( self ):
+		result = self.make_result()
+		result.freeze()
+
+		with self.assertRaises( ValueError ):
+			result.regime[ 0, 0 ] = 2
+
+if __name__ == '__main__':
+	unittest.main()
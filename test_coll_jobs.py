@@ -0,0 +1,116 @@
+# Unit testing for the hcds_coll_jobs module.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import tempfile
+import time
+
+import numpy
+
+import hcds_coll_jobs
+
+def run( spec, progress ):
+	if spec[ "fail" ]:
+		raise ValueError( "invalid" )
+
+	for i in range( spec[ "rows" ] ):
+		progress( i + 1, spec[ "rows" ] )
+
+	return { "rows": spec[ "rows" ] }, { "z": numpy.arange( spec[ "rows" ] ) }
+
+class JobStoreTestCase( unittest.TestCase ):
+	def setUp( self ):
+		self.dir = tempfile.TemporaryDirectory()
+
+	def tearDown( self ):
+		self.dir.cleanup()
+
+	def wait( self, store, id ):
+		for i in range( 500 ):
+			status = store.read_status( id )
+			if status[ "state" ] == "done" or status[ "state" ] == "failed":
+				return status
+
+			time.sleep( 0.01 )
+
+		self.fail( "The job did not finish" )
+
+	def test_submit( self ):
+		store = hcds_coll_jobs.JobStore( self.dir.name, run )
+
+		status = store.submit( { "fail": False, "rows": 3 } )
+		status = self.wait( store, status[ "id" ] )
+
+		self.assertEqual( status[ "state" ], "done" )
+		self.assertEqual( status[ "done" ], 3 )
+		self.assertEqual( status[ "total" ], 3 )
+		self.assertEqual( status[ "result" ], { "rows": 3 } )
+		self.assertEqual( store.read_result( status[ "id" ] )[ "z" ].tolist(), [ 0, 1, 2 ] )
+
+	def test_failed( self ):
+		store = hcds_coll_jobs.JobStore( self.dir.name, run )
+
+		status = self.wait( store, store.submit( { "fail": True } )[ "id" ] )
+
+		self.assertEqual( status[ "state" ], "failed" )
+		self.assertEqual( status[ "error" ], "invalid" )
+		self.assertEqual( store.read_result( status[ "id" ] ), None )
+
+	def test_invalid_id( self ):
+		store = hcds_coll_jobs.JobStore( self.dir.name, run )
+
+		self.assertEqual( store.read_status( "../passwd" ), None )
+		self.assertEqual( store.read_status( "0" * 32 ), None )
+		self.assertEqual( store.read_result( "0" * 32 ), None )
+
+	def test_resume( self ):
+		# A job left queued by a worker that stopped
+		store = hcds_coll_jobs.JobStore( self.dir.name, run )
+		status = { "id": "1" * 32, "state": "running", "spec": { "fail": False, "rows": 2 }, "done": 1, "total": 2, "created": time.time(), "started": time.time(), "finished": None, "result": None, "error": None }
+		store.write_status( status )
+
+		other = hcds_coll_jobs.JobStore( self.dir.name, run )
+		other.resume()
+
+		self.assertEqual( self.wait( other, status[ "id" ] )[ "state" ], "done" )
+
+	def test_max_pending( self ):
+		store = hcds_coll_jobs.JobStore( self.dir.name, run, max_pending = 1 )
+
+		# A job left queued by a worker that stopped
+		status = { "id": "1" * 32, "state": "queued", "spec": { "fail": False, "rows": 2 }, "done": 0, "total": None, "created": time.time(), "started": None, "finished": None, "result": None, "error": None }
+		store.write_status( status )
+
+		self.assertEqual( store.submit( { "fail": False, "rows": 1 } ), None )
+
+		# Finished jobs do not count
+		status[ "state" ] = "done"
+		store.write_status( status )
+
+		self.assertEqual( self.wait( store, store.submit( { "fail": False, "rows": 1 } )[ "id" ] )[ "state" ], "done" )
+
+	def test_expire( self ):
+		store = hcds_coll_jobs.JobStore( self.dir.name, run, ttl = 0. )
+
+		first = self.wait( store, store.submit( { "fail": False, "rows": 1 } )[ "id" ] )
+		time.sleep( 0.01 )
+		store.submit( { "fail": False, "rows": 1 } )
+
+		self.assertEqual( store.read_status( first[ "id" ] ), None )
+
+if __name__ == '__main__':
+	unittest.main()
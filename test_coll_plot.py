@@ -0,0 +1,228 @@
+# Unit testing for the hcds_coll_plot module.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import unittest
+
+import matplotlib
+matplotlib.use( "agg" )
+import matplotlib.pyplot
+import mpl_tune
+import numpy
+
+import hcds_coll_plot
+
+def render_figure( x, y, z, quant, format ):
+	'''
+	Render a map with a new figure, as done before the templates were introduced.
+
+	- x: Values along the horizontal axis (impact angle)
+	- y: Values along the vertical axis (impact velocity)
+	- z: Values of the quantity
+	- quant: Name of the quantity
+	- format: File format, as understood by matplotlib
+	'''
+
+	style = hcds_coll_plot.get_style( quant )
+	cmap = hcds_coll_plot.get_cmap()
+
+	matplotlib.rc( "font", family = "serif" )
+
+	figtext = mpl_tune.FigText( size = "large", color = "black", tex = False )
+
+	figsize = mpl_tune.FigSize()
+	figsize.set_size_h( 5.0, mpl_tune.FigSize.SIZE_NO_CBAR )
+	figsize.set_size_v( 5.0, mpl_tune.FigSize.SIZE_NO_CBAR )
+	figsize.set_margin_left( 0.52 )
+	figsize.set_margin_bottom( 0.52 )
+	figsize.set_margin_right( 0.08 )
+	figsize.set_margin_top( 0.08 )
+	figsize.set_cbar_loc( "right" )
+	figsize.set_cbar_width( 0.1 )
+	figsize.set_cbar_pad( 0.75 )
+
+	fig = matplotlib.pyplot.figure( **figsize.get_figure_args() )
+	fig.subplots_adjust( **figsize.get_subplots_args() )
+
+	ax = fig.add_subplot( 1, 1, 1 )
+	ax.patch.set_facecolor( "white" )
+	ax.patch.set_edgecolor( "white" )
+	ax.contourf( x, y, z, style[ "levels" ], cmap = cmap, vmin = style[ "vmin" ], vmax = style[ "vmax" ] )
+
+	cax = fig.add_axes( figsize.get_cbar_ax_spec() )
+	kwargs = { "boundaries": style[ "boundaries" ] }
+	if not style[ "values" ] is None:
+		kwargs[ "values" ] = style[ "values" ]
+	norm = matplotlib.colors.Normalize( vmin = style[ "vmin" ], vmax = style[ "vmax" ] )
+	cb = fig.colorbar( matplotlib.cm.ScalarMappable( norm, cmap ), orientation = figsize.get_cbar_orientation(), cax = cax, **kwargs, **hcds_coll_plot.COLORBAR_ARGS )
+
+	ax.set_xlim( 0., 90. )
+	ax.set_ylim( 0.99, 4.01 )
+	ax.set_xlabel( "$\\mathrm{\\theta_{coll}~[deg]}$", **figtext.get_text_args() )
+	ax.set_xticks( [ 0., 15., 30., 45., 60., 75., 90. ] )
+	ax.set_xticks( [], minor = True )
+	ax.set_ylabel( "$\\mathrm{v_{coll}/v_{esc}}$", **figtext.get_text_args() )
+
+	cb.set_label( style[ "label" ], **figtext.get_text_args() )
+	cb.set_ticks( style[ "ticks" ] )
+	if not style[ "ticklabels" ] is None:
+		cb.set_ticklabels( style[ "ticklabels" ] )
+
+	figtext.set_cbar( cb )
+	figtext.set_axes( ax )
+
+	buffer = io.BytesIO()
+	fig.savefig( buffer, dpi = 250, format = format, facecolor = "none", edgecolor = "none" )
+	matplotlib.pyplot.close( fig )
+
+	return buffer.getvalue()
+
+def get_grid():
+	'''
+	Get a map of outcomes with the accretion regime below 45 degrees and the hit-and-run regime above.
+	'''
+
+	x = numpy.linspace( 0., 90., 19 )
+	y = numpy.linspace( 1., 4., 7 )
+	regime = numpy.where( x < 45., 1., 5. )[ numpy.newaxis, : ].repeat( len( y ), axis = 0 )
+	acc = numpy.outer( numpy.linspace( -1., 1., len( y ) ), numpy.ones( len( x ) ) )
+
+	return x, y, regime, acc
+
+class CollPlotTestCase( unittest.TestCase ):
+	def test_map_colors_regime( self ):
+		style = hcds_coll_plot.get_style( "regime" )
+		cmap = hcds_coll_plot.get_cmap()
+
+		colors = hcds_coll_plot.map_colors( numpy.array( [ 0., 1., 2., 5., 6. ] ), style, cmap )
+
+		self.assertEqual( colors.shape, ( 5, 4 ) )
+		self.assertEqual( colors.dtype, numpy.uint8 )
+
+		# Outside of the levels, the background is shown
+		self.assertEqual( colors[ 0 ].tolist(), [ 255, 255, 255, 255 ] )
+		self.assertEqual( colors[ 4 ].tolist(), [ 255, 255, 255, 255 ] )
+
+		self.assertEqual( colors[ 1 ].tolist(), list( cmap( 0.1, bytes = True ) ) )
+		self.assertEqual( colors[ 3 ].tolist(), list( cmap( 0.9, bytes = True ) ) )
+
+	def test_map_colors_under( self ):
+		style = hcds_coll_plot.get_style( "accsr" )
+		cmap = hcds_coll_plot.get_cmap()
+
+		colors = hcds_coll_plot.map_colors( numpy.array( [ -1.1, 0. ] ), style, cmap )
+
+		self.assertEqual( colors[ 0 ].tolist(), [ 0, 0, 0, 255 ] )
+		self.assertEqual( colors[ 1 ].tolist(), list( cmap( 0.5, bytes = True ) ) )
+
+	def test_resample( self ):
+		x = numpy.array( [ 0., 1., 2. ] )
+		y = numpy.array( [ 0., 2. ] )
+		z = numpy.array( [ [ 0., 1., 2. ], [ 2., 3., 4. ] ] )
+
+		res = hcds_coll_plot.resample( x, y, z, numpy.array( [ 0., 0.5, 2., 3. ] ), numpy.array( [ 0., 1. ] ) )
+
+		self.assertEqual( res.shape, ( 2, 4 ) )
+		self.assertEqual( res.tolist(), [ [ 0., 0.5, 2., 2. ], [ 1., 1.5, 3., 3. ] ] )
+
+	def test_get_polygons( self ):
+		x = numpy.array( [ 0., 1., 2. ] )
+		y = numpy.array( [ 0., 1. ] )
+		z = numpy.array( [ [ 1., 1., 2. ], [ 1., 1., 2. ] ] )
+
+		res = hcds_coll_plot.get_polygons( x, y, z, hcds_coll_plot.get_style( "regime" ), hcds_coll_plot.get_cmap() )
+
+		self.assertEqual( res[ "xlim" ], [ 0., 2. ] )
+		self.assertEqual( res[ "ylim" ], [ 0., 1. ] )
+		self.assertEqual( len( res[ "layers" ] ), 5 )
+		self.assertEqual( len( res[ "layers" ][ 0 ][ "polygons" ] ), 1 )
+		self.assertEqual( len( res[ "layers" ][ 1 ][ "polygons" ] ), 1 )
+		self.assertEqual( len( res[ "layers" ][ 2 ][ "polygons" ] ), 0 )
+
+		# One outer ring, given as alternating coordinates
+		ring = res[ "layers" ][ 0 ][ "polygons" ][ 0 ][ 0 ]
+		self.assertEqual( len( ring ) % 2, 0 )
+		self.assertEqual( max( ring[ 0 : : 2 ] ), 1.5 )
+
+	def test_template_figure( self ):
+		x, y, regime, acc = get_grid()
+
+		template = hcds_coll_plot.GridTemplate( "regime" )
+
+		self.assertEqual( template.render( x, y, regime, "rgba" ), render_figure( x, y, regime, "regime", "rgba" ) )
+
+	def test_template_reuse( self ):
+		x, y, regime, acc = get_grid()
+
+		regime_template = hcds_coll_plot.GridTemplate( "regime" )
+		acc_template = hcds_coll_plot.GridTemplate( "acclr" )
+		stacked_template = hcds_coll_plot.GridTemplate( "acclr", panels = 2 )
+
+		first = regime_template.render( x, y, regime, "rgba" )
+		acc_template.render( x, y, -acc, "rgba" )
+		stacked = stacked_template.render( x, y, [ acc, -acc ], "rgba", titles = [ "a", "b" ] )
+
+		# The contours of the previous maps are replaced and no state leaks between templates
+		self.assertEqual( acc_template.render( x, y, acc, "rgba" ), render_figure( x, y, acc, "acclr", "rgba" ) )
+		self.assertEqual( regime_template.render( x, y, regime, "rgba" ), first )
+		self.assertEqual( stacked_template.render( x, y, [ acc, -acc ], "rgba", titles = [ "a", "b" ] ), stacked )
+		self.assertEqual( stacked, hcds_coll_plot.GridTemplate( "acclr", panels = 2 ).render( x, y, [ acc, -acc ], "rgba", titles = [ "a", "b" ] ) )
+
+		self.assertEqual( sum( 1 for contours in regime_template.contours if not contours is None ), 1 )
+		self.assertEqual( sum( 1 for contours in stacked_template.contours if not contours is None ), 2 )
+
+	def test_render_raster( self ):
+		x, y, regime, acc = get_grid()
+		cmap = hcds_coll_plot.get_cmap()
+		first = list( cmap( 0.1, bytes = True ) )
+		last = list( cmap( 0.9, bytes = True ) )
+
+		for panels in ( 1, 2 ):
+			template = hcds_coll_plot.GridTemplate( "regime", panels = panels )
+			z = regime if panels == 1 else [ regime, 6. - regime ]
+
+			data = template.render_raster( x, y, z, "png", dpi = 80 )
+			rgba = numpy.array( hcds_coll_plot.PIL.Image.open( io.BytesIO( data ) ).convert( "RGBA" ) )
+			overlay, boxes = template.get_overlay( 80 )
+
+			self.assertEqual( rgba.shape, overlay.shape )
+			self.assertEqual( len( boxes ), panels )
+
+			for i, ( ax, ( row0, row1, col0, col1 ) ) in enumerate( zip( template.axes, boxes ) ):
+				# The plot area is the extent of the axes, with the first row at the top
+				template.fig.set_dpi( 80 )
+				bbox = ax.get_window_extent()
+				self.assertEqual( ( col0, col1 ), ( int( round( bbox.x0 ) ), int( round( bbox.x1 ) ) ) )
+				self.assertEqual( ( row0, row1 ), ( rgba.shape[ 0 ] - int( round( bbox.y1 ) ), rgba.shape[ 0 ] - int( round( bbox.y0 ) ) ) )
+
+				# The colors at the left and right of the plot area match the values at the extremes of the horizontal axis
+				row = ( row0 + row1 ) // 2
+				left = rgba[ row, col0 + 3 ].tolist()
+				right = rgba[ row, col1 - 4 ].tolist()
+				self.assertEqual( ( left, right ), ( first, last ) if i == 0 else ( last, first ) )
+
+				# The values change between 40 and 45 degrees; at 42.5 degrees, the interpolated value is in the middle regime
+				col = lambda angle: col0 + int( angle / 90. * ( col1 - col0 ) )
+				self.assertEqual( rgba[ row, col( 39. ) ].tolist(), left )
+				self.assertEqual( rgba[ row, col( 42.5 ) ].tolist(), list( cmap( 0.5, bytes = True ) ) )
+				self.assertEqual( rgba[ row, col( 46. ) ].tolist(), right )
+
+				# Outside of the plot area, the overlay is kept as is
+				self.assertEqual( rgba[ row, col0 - 2 ].tolist(), overlay[ row, col0 - 2 ].tolist() )
+				self.assertEqual( rgba[ row, col1 + 1 ].tolist(), overlay[ row, col1 + 1 ].tolist() )
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,130 @@
+# Unit testing for the hcds_coll_table.OutcomeTable class.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import json
+import os
+import tempfile
+
+import numpy
+
+import hcds_coll_table
+
+class OutcomeTableTestCase( unittest.TestCase ):
+	def setUp( self ):
+		self.dir = tempfile.TemporaryDirectory()
+
+		axes = {
+			"mass": hcds_coll_table.make_axis( 0.1, 10., 3, True ),
+			"ratio": hcds_coll_table.make_axis( 0.1, 1., 2, True ),
+			"vel": hcds_coll_table.make_axis( 1., 3., 3, False ),
+			"angle": hcds_coll_table.make_axis( 0., 90., 4, False ),
+		}
+
+		shape = ( 1, 3, 2, 3, 4 )
+
+		# The efficiencies only depend on the velocity and the angle
+		vel = hcds_coll_table.axis_values( axes[ "vel" ] )[ numpy.newaxis, numpy.newaxis, numpy.newaxis, :, numpy.newaxis ]
+		angle = hcds_coll_table.axis_values( axes[ "angle" ] )[ numpy.newaxis, numpy.newaxis, numpy.newaxis, numpy.newaxis, : ]
+		acc = numpy.broadcast_to( vel + angle / 30., shape ).astype( numpy.float32 )
+		regime = numpy.broadcast_to( numpy.where( vel > 2., 5, 1 ), shape ).astype( numpy.int8 ).copy()
+		regime[ 0, 0, 0, 0, 0 ] = -1
+
+		numpy.save( os.path.join( self.dir.name, "regime.npy" ), regime )
+		for quant in [ "acclr", "acctr" ]:
+			numpy.save( os.path.join( self.dir.name, quant + ".npy" ), acc )
+
+		# The second remnant is not defined in the hit-and-run regime
+		numpy.save( os.path.join( self.dir.name, "accsr.npy" ), numpy.where( regime == 5, numpy.float32( numpy.nan ), acc ) )
+
+		with open( os.path.join( self.dir.name, "table.json" ), "w" ) as f:
+			json.dump( { "models": [ "c2019" ], "axes": axes, "method": "linear", "error": { "method": "linear" } }, f )
+
+		self.table = hcds_coll_table.OutcomeTable( self.dir.name )
+
+	def tearDown( self ):
+		self.dir.cleanup()
+
+	def test_covers( self ):
+		self.assertTrue( self.table.covers( "c2019", 1., 0.5 ) )
+		self.assertTrue( self.table.covers( "c2019", 1., 0.5, numpy.array( [ 1., 3. ] ), numpy.array( [ 0., 90. ] ) ) )
+		self.assertFalse( self.table.covers( "merge", 1., 0.5 ) )
+		self.assertFalse( self.table.covers( "c2019", 100., 0.5 ) )
+		self.assertFalse( self.table.covers( "c2019", 1., 0.5, 4., 0. ) )
+
+	def test_lookup_exact( self ):
+		res = self.table.lookup( "c2019", 1., 1., 2., 30. )
+
+		self.assertEqual( int( res[ "regime" ] ), 1 )
+		self.assertAlmostEqual( float( res[ "acclr" ] ), 3. )
+
+	def test_lookup_linear( self ):
+		res = self.table.lookup( "c2019", 0.3, 0.5, numpy.array( [ 1.5, 2.5 ] ), numpy.array( [ 15., 45. ] ) )
+
+		self.assertEqual( res[ "regime" ].tolist(), [ 1, 5 ] )
+
+		# The point of the table where the outcome is not available is left out of the interpolation
+		weight = ( 1. - self.table.position( "mass", 0.3 ) ) * ( 1. - self.table.position( "ratio", 0.5 ) ) * 0.25
+		self.assertAlmostEqual( res[ "acclr" ][ 0 ], ( 2. - weight ) / ( 1. - weight ) )
+		self.assertAlmostEqual( res[ "accsr" ][ 0 ], ( 2. - weight ) / ( 1. - weight ) )
+
+		# Only the points at the velocity of 3, which are in the regime of the nearest point, are used
+		self.assertAlmostEqual( res[ "acclr" ][ 1 ], 4.5 )
+		self.assertTrue( numpy.isnan( res[ "accsr" ][ 1 ] ) )
+
+	def test_lookup_regime( self ):
+		res = self.table.lookup( "c2019", 1., 1., numpy.array( [ 1.8, 2.4 ] ), 30. )
+
+		# The points at the velocity of 3 are in another regime and the values of the second remnant are not available there
+		self.assertEqual( res[ "regime" ].tolist(), [ 1, 1 ] )
+		self.assertAlmostEqual( res[ "acclr" ][ 0 ], 2.8 )
+		self.assertAlmostEqual( res[ "acclr" ][ 1 ], 3. )
+		self.assertAlmostEqual( res[ "accsr" ][ 1 ], 3. )
+
+	def test_lookup_unavailable( self ):
+		# Points whose values are not available are not used, but the nearest point is kept if there is nothing else
+		data = numpy.load( os.path.join( self.dir.name, "acctr.npy" ) )
+		data[ 0, :, :, 1, 1 ] = numpy.nan
+		data[ 0, :, :, 0, 3 ] = numpy.nan
+		numpy.save( os.path.join( self.dir.name, "acctr.npy" ), data )
+
+		table = hcds_coll_table.OutcomeTable( self.dir.name )
+		res = table.lookup( "c2019", 1., 1., numpy.array( [ 1.8, 1., 1. ] ), numpy.array( [ 30., 89., 90. ] ) )
+
+		self.assertAlmostEqual( res[ "acctr" ][ 0 ], 2. )
+		self.assertAlmostEqual( res[ "acctr" ][ 1 ], 3. )
+		self.assertTrue( numpy.isnan( res[ "acctr" ][ 2 ] ) )
+
+	def test_method( self ):
+		self.assertEqual( hcds_coll_table.OutcomeTable( self.dir.name, "linear" ).method, "linear" )
+
+		# The error bounds would not apply to another method
+		with self.assertRaises( ValueError ):
+			hcds_coll_table.OutcomeTable( self.dir.name, "nearest" )
+
+	def test_lookup_nearest( self ):
+		res = self.table.lookup( "c2019", 1., 1., 1.4, 40., method = "nearest" )
+
+		self.assertAlmostEqual( float( res[ "acclr" ] ), 2. )
+
+	def test_lookup_missing( self ):
+		res = self.table.lookup( "c2019", 0.1, 0.1, 1., 0. )
+
+		self.assertEqual( int( res[ "regime" ] ), -1 )
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,134 @@
+# Unit testing for the hcds_compress module.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import gzip
+
+import hcds_compress
+import hcds_config
+import hcds_responder_base
+
+class CompressTestCase( unittest.TestCase ):
+	def setUp( self ):
+		self.saved = hcds_config.COMPRESS_ENCODINGS
+		hcds_config.COMPRESS_ENCODINGS = [ "gzip" ]
+
+	def tearDown( self ):
+		hcds_config.COMPRESS_ENCODINGS = self.saved
+
+	def make_responder( self, accept, ctype = "application/json", body = b"[" + b"0, " * 1000 + b"0]" ):
+		started = []
+
+		resp = hcds_responder_base.BaseResponder( {} )
+		resp.set_request( { "HTTP_ACCEPT_ENCODING": accept }, lambda status, headers: started.append( headers ) )
+		resp.start( "200 OK", [ ( "Content-Type", ctype ) ] )
+		resp.add_output( body )
+		resp.finish()
+
+		return resp, dict( started[ 0 ] )
+
+	def test_negotiate( self ):
+		self.assertEqual( hcds_compress.negotiate( None ), None )
+		self.assertEqual( hcds_compress.negotiate( "gzip, deflate" ), "gzip" )
+		self.assertEqual( hcds_compress.negotiate( "deflate, *;q=0.5" ), "gzip" )
+		self.assertEqual( hcds_compress.negotiate( "gzip;q=0, deflate" ), None )
+		self.assertEqual( hcds_compress.negotiate( "identity" ), None )
+
+	def test_compress( self ):
+		resp, headers = self.make_responder( "gzip" )
+
+		self.assertEqual( headers[ "Content-Encoding" ], "gzip" )
+		self.assertEqual( headers[ "Vary" ], "Accept-Encoding" )
+		self.assertEqual( gzip.decompress( b"".join( resp.get_output() ) ), b"[" + b"0, " * 1000 + b"0]" )
+
+	def test_skipped( self ):
+		# Not accepted by the client
+		resp, headers = self.make_responder( None )
+		self.assertNotIn( "Content-Encoding", headers )
+		self.assertEqual( headers[ "Vary" ], "Accept-Encoding" )
+
+		# Too small
+		resp, headers = self.make_responder( "gzip", body = b"[]" )
+		self.assertNotIn( "Content-Encoding", headers )
+
+		# Already compressed
+		resp, headers = self.make_responder( "gzip", ctype = "image/png" )
+		self.assertNotIn( "Content-Encoding", headers )
+		self.assertNotIn( "Vary", headers )
+
+	def test_cache( self ):
+		hcds_compress.cache.clear()
+		hits = hcds_compress.cache.hits
+
+		for i in range( 2 ):
+			started = []
+
+			resp = hcds_responder_base.BaseResponder( {} )
+			resp.set_request( { "HTTP_ACCEPT_ENCODING": "gzip" }, lambda status, headers: started.append( headers ) )
+			resp.check_validators( [ "data" ] )
+			resp.start( "200 OK", [ ( "Content-Type", "application/json" ) ] )
+			resp.add_output( b"[" + b"1, " * 1000 + b"1]" )
+			resp.share_result()
+			resp.finish()
+
+		self.assertEqual( hcds_compress.cache.hits, hits + 1 )
+		self.assertEqual( dict( started[ 0 ] )[ "Content-Encoding" ], "gzip" )
+
+	def test_cache_body( self ):
+		# Responses with the same tag but different bodies do not share their compressed body
+		for value in [ b"1", b"2" ]:
+			started = []
+
+			resp = hcds_responder_base.BaseResponder( {} )
+			resp.set_request( { "HTTP_ACCEPT_ENCODING": "gzip" }, lambda status, headers: started.append( headers ) )
+			resp.check_validators( [ "body" ] )
+			resp.start( "200 OK", [ ( "Content-Type", "application/json" ) ] )
+			resp.add_output( b"[" + ( value + b", " ) * 1000 + value + b"]" )
+			resp.finish()
+
+			self.assertEqual( gzip.decompress( b"".join( resp.get_output() ) ), b"[" + ( value + b", " ) * 1000 + value + b"]" )
+			resp.clean()
+
+	def test_tag( self ):
+		resp = hcds_responder_base.BaseResponder( {} )
+		resp.set_request( { "HTTP_ACCEPT_ENCODING": "gzip" }, lambda status, headers: None )
+		resp.check_validators( [ "tag" ] )
+		resp.start( "200 OK", [ ( "Content-Type", "application/json" ) ] )
+		tag = dict( resp.headers )[ "ETag" ]
+		resp.add_output( b"[" + b"0, " * 1000 + b"0]" )
+		resp.finish()
+
+		# The compressed response has its own tag
+		self.assertEqual( dict( resp.headers )[ "ETag" ], tag[ : -1 ] + "-gzip\"" )
+		resp.clean()
+
+		# Which is only valid for clients that accept the encoding
+		for accept, status in [ ( "gzip", "304 Not Modified" ), ( None, None ) ]:
+			resp = hcds_responder_base.BaseResponder( {} )
+			resp.set_request( { "HTTP_ACCEPT_ENCODING": accept, "HTTP_IF_NONE_MATCH": tag[ : -1 ] + "-gzip\"" }, lambda status, headers: None )
+			resp.check_validators( [ "tag" ] )
+			self.assertEqual( resp.status, status )
+
+			if not status is None:
+				resp.finish()
+				self.assertEqual( dict( resp.headers )[ "ETag" ], tag[ : -1 ] + "-gzip\"" )
+				self.assertEqual( dict( resp.headers )[ "Vary" ], "Accept-Encoding" )
+
+			resp.clean()
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,175 @@
+# Unit testing for the hcds_db_store module.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import json
+import os
+import tempfile
+import urllib.parse
+
+import numpy
+import tables
+
+import hcds_admission
+import hcds_config
+import hcds_db_store
+import hcds_exception
+import hcds_responder_db
+
+class DBStoreTestCase( unittest.TestCase ):
+	def setUp( self ):
+		self.dir = tempfile.TemporaryDirectory()
+		self.file = os.path.join( self.dir.name, "db.h5" )
+
+		with tables.open_file( self.file, "w" ) as h5file:
+			base = h5file.create_group( h5file.root, "base" )
+			h5file.create_array( base, "id", numpy.arange( 10, dtype = numpy.int64 ) )
+			h5file.create_array( base, "mtar", numpy.linspace( 1., 2., 10 ) )
+			h5file.create_array( base, "mimp", numpy.linspace( 0.1, 0.2, 10 ) )
+
+			for n in range( 2 ):
+				group = h5file.create_group( h5file.root, "sim_{:03d}".format( n ) )
+				h5file.create_array( group, "time", numpy.linspace( 0., 3600., 4 ) )
+				h5file.create_array( group, "mlr", numpy.full( 4, n + 0.5 ) )
+
+		self.config = {
+			"file": self.file,
+			"desc": "Test database",
+			"base_fields": [
+				{ "name": "id", "data": "id", "desc": "Identifier", "format": "d" },
+				{ "name": "mtar", "data": "mtar", "desc": "Target mass", "format": ".2f" },
+				{ "name": "ratio", "data": "mimp / mtar", "desc": "Mass ratio", "format": ".3f" },
+			],
+			"fields": [
+				{ "name": "time", "data": "time / 3600" },
+				{ "name": "mlr", "data": "mlr" },
+			],
+			"plots": [],
+		}
+
+		# Lock files of the requests are kept out of the default directories
+		self.saved = ( hcds_config.SINGLEFLIGHT_DIR, hcds_config.ADMISSION_DIR, hcds_admission.limiters )
+		self.run_dir = tempfile.TemporaryDirectory()
+
+		hcds_admission.limiters = {}
+		hcds_config.SINGLEFLIGHT_DIR = os.path.join( self.run_dir.name, "singleflight" )
+		hcds_config.ADMISSION_DIR = os.path.join( self.run_dir.name, "admission" )
+
+	def tearDown( self ):
+		self.dir.cleanup()
+
+		hcds_config.SINGLEFLIGHT_DIR, hcds_config.ADMISSION_DIR, hcds_admission.limiters = self.saved
+		self.run_dir.cleanup()
+
+	def make_obj( self, store, sub, query = "" ):
+		resp = hcds_responder_db.DBResponder( { "items": { "db": self.config }, "store": store, "mmap": False } )
+		resp.set_request( {}, None )
+		resp.set_url( urllib.parse.urlparse( "http://localhost/db/" + sub + "?" + query ), sub )
+
+		return resp
+
+	def call( self, store, sub, query = "" ):
+		resp = self.make_obj( store, sub, query )
+		resp()
+		data = json.loads( b"".join( resp.get_output() ) )
+		resp.clean()
+
+		return data
+
+	def ingest( self, chunk ):
+		resp = self.make_obj( False, "db" )
+
+		return hcds_db_store.ingest( self.file, self.config, resp.evaluate, chunk )
+
+	def test_mask( self ):
+		mask = hcds_db_store.get_mask( [ numpy.arange( 5 ), numpy.array( [ 1., numpy.nan, 1., 1., 3. ] ) ], [ [ 1, None ], [ None, 2. ] ] )
+
+		self.assertEqual( mask.tolist(), [ False, False, True, True, False ] )
+
+	def test_ingest( self ):
+		self.assertEqual( self.ingest( 4 ), 2 )
+
+		store = hcds_db_store.open_store( self.file, self.config, os.stat( self.file ).st_mtime )
+		self.assertEqual( store.get_chunk_count(), 3 )
+		self.assertEqual( store.get_base( 0 ).tolist(), list( range( 10 ) ) )
+		self.assertTrue( store.has_sim( 1 ) )
+		self.assertFalse( store.has_sim( 2 ) )
+		self.assertEqual( store.get_sim( 1, 1 ).tolist(), [ 1.5 ] * 4 )
+
+		# Only the chunks containing the values within the range are kept
+		self.assertEqual( store.select_chunks( { 0: [ 5, None ] } ), [ ( 4, 8 ), ( 8, 10 ) ] )
+		self.assertEqual( store.select_chunks( { 0: [ 5, 6 ], 1: [ None, 1. ] } ), [] )
+
+	def test_sims( self ):
+		# Groups that are not named exactly "sim_NNN" are ignored, both by the store and by the responder
+		with tables.open_file( self.file, "a" ) as h5file:
+			for name in [ "sim_2", "sim_0003", "sim_x" ]:
+				group = h5file.create_group( h5file.root, name )
+				h5file.create_array( group, "time", numpy.linspace( 0., 3600., 4 ) )
+				h5file.create_array( group, "mlr", numpy.zeros( 4 ) )
+
+		with tables.open_file( self.file ) as h5file:
+			self.assertEqual( hcds_db_store.get_sims( h5file ), [ 0, 1 ] )
+
+		self.assertEqual( self.ingest( 4 ), 2 )
+
+		store = hcds_db_store.open_store( self.file, self.config, os.stat( self.file ).st_mtime )
+		self.assertFalse( store.has_sim( 2 ) )
+		self.assertFalse( store.has_sim( 3 ) )
+		self.assertEqual( self.make_obj( True, "db" ).get_plans()[ "db" ].groups[ "fields" ], [ "sim_000", "sim_001" ] )
+
+	def test_stale( self ):
+		self.ingest( 4 )
+
+		mtime = os.stat( self.file ).st_mtime
+		self.assertEqual( hcds_db_store.open_store( self.file, self.config, mtime + 1. ), None )
+
+		# The store depends on the definitions of the fields
+		self.config[ "fields" ][ 1 ][ "data" ] = "mlr * 2"
+		self.assertEqual( hcds_db_store.open_store( self.file, self.config, mtime ), None )
+
+	def test_responder( self ):
+		expected = [
+			( "db", "" ),
+			( "db", "fields=ratio,id" ),
+			( "db", "id.min=3&id.max=6&fields=mtar" ),
+			( "db", "mtar.max=1.5" ),
+			( "db", "id.min=20" ),
+			( "db/1", "" ),
+		]
+		expected = [ ( sub, query, self.call( False, sub, query ) ) for sub, query in expected ]
+
+		self.ingest( 4 )
+
+		for sub, query, data in expected:
+			self.assertEqual( self.call( True, sub, query ), data )
+
+		data = self.call( True, "db", "id.min=3&id.max=6&fields=mtar" )
+		self.assertEqual( [ item[ "name" ] for item in data[ "fields" ] ], [ "mtar" ] )
+		self.assertEqual( len( data[ "series" ] ), 4 )
+
+	def test_params( self ):
+		for query, key in [ ( "fields=none", "fields" ), ( "fields=id,id", "fields" ), ( "id.min=abc", "id.min" ) ]:
+			resp = self.make_obj( False, "db", query )
+
+			with self.assertRaises( hcds_exception.JSONBadRequest ) as cm:
+				resp.retrieve_params( self.config, None )
+
+			self.assertEqual( cm.exception.data, { key: None } )
+
+if __name__ == '__main__':
+	unittest.main()
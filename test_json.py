@@ -0,0 +1,74 @@
+# Unit testing for the hcds_json module.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import json
+import math
+
+import numpy
+
+import hcds_config
+import hcds_json
+
+class JSONTestCase( unittest.TestCase ):
+	def setUp( self ):
+		self.saved = hcds_config.JSON_ENCODER
+
+	def tearDown( self ):
+		hcds_config.JSON_ENCODER = self.saved
+
+	def check_encoders( self, data, expected ):
+		for encoder in [ "json", "orjson" ]:
+			hcds_config.JSON_ENCODER = encoder
+			self.assertEqual( json.loads( hcds_json.dumps( data ) ), expected )
+
+	def test_to_list( self ):
+		self.assertEqual( hcds_json.to_list( numpy.array( [ 1., math.nan, -math.inf ] ) ), [ 1., None, None ] )
+		self.assertEqual( hcds_json.to_list( numpy.array( [ 1, 2 ], dtype = numpy.int32 ) ), [ 1, 2 ] )
+
+	def test_arrays( self ):
+		data = {
+			"float": numpy.array( [ [ 1., math.nan ], [ math.inf, 2.5 ] ] ),
+			"int": numpy.arange( 3, dtype = numpy.int8 ),
+			"masked": hcds_json.masked( numpy.array( [ 1, -1 ] ), numpy.array( [ False, True ] ) ),
+			"scalar": numpy.int64( 4 ),
+			"strided": numpy.arange( 6. )[ : : 2 ],
+		}
+
+		self.check_encoders( data, { "float": [ [ 1., None ], [ None, 2.5 ] ], "int": [ 0, 1, 2 ], "masked": [ 1, None ], "scalar": 4, "strided": [ 0., 2., 4. ] } )
+
+	def test_single( self ):
+		values = numpy.array( [ 0.1, -1.1, 1. / 3., 0., math.nan, 1.e30, 123456.7 ], dtype = numpy.float32 )
+
+		self.assertEqual( hcds_json.to_list( values ), [ 0.1, -1.1, 0.33333334, 0., None, 1.e30, 123456.7 ] )
+		self.check_encoders( { "array": values[ : 2 ], "scalar": values[ 1 ] }, { "array": [ 0.1, -1.1 ], "scalar": -1.1 } )
+
+		# The values are the same in single precision
+		values = numpy.random.default_rng( 1 ).standard_normal( 1000 ).astype( numpy.float32 )
+		self.assertTrue( ( numpy.array( hcds_json.to_list( values ), dtype = numpy.float32 ) == values ).all() )
+
+	def test_rows( self ):
+		self.check_encoders( hcds_json.rows( [ numpy.array( [ 1., math.nan ] ), numpy.array( [ 3., 4. ] ) ] ), [ [ 1., 3. ], [ None, 4. ] ] )
+		self.check_encoders( hcds_json.rows( [ numpy.array( [ 1, 2 ] ), numpy.array( [ 3., math.nan ] ) ] ), [ [ 1, 3. ], [ 2, None ] ] )
+
+	def test_records( self ):
+		res = hcds_json.records( [ "a", "b" ], [ numpy.array( [ 1, 2 ] ), numpy.array( [ 3., math.nan ] ) ] )
+
+		self.assertEqual( res, [ { "a": 1, "b": 3. }, { "a": 2, "b": None } ] )
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,117 @@
+# Unit testing for the main module.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import cProfile
+import io
+import tempfile
+import wsgiref.util
+
+import hcds_admission
+import hcds_config
+import hcds_metrics
+import hcds_profile
+import hcds_responder_base
+import hcds_singleflight
+import main
+
+class FailingResponder( hcds_responder_base.BaseResponder ):
+	'''
+	Responder that fails with an exception that is not an hcds_exception.HCDSException, once it has joined the computation of its response.
+	'''
+
+	def get_route_class( self ):
+		return "heavy"
+
+	def __call__( self ):
+		self.check_validators( [ "failing" ] )
+		raise ValueError( "failed" )
+
+# The profiler class is replaced in the tests
+BaseProfile = cProfile.Profile
+
+class Profile( BaseProfile ):
+	'''
+	Profiler that records whether it is running.
+	'''
+
+	running = []
+
+	def enable( self ):
+		BaseProfile.enable( self )
+		self.running.append( self )
+
+	def disable( self ):
+		BaseProfile.disable( self )
+		if self in self.running:
+			self.running.remove( self )
+
+class MainTestCase( unittest.TestCase ):
+	def setUp( self ):
+		self.saved = ( hcds_config.SINGLEFLIGHT_DIR, hcds_config.SINGLEFLIGHT_TIMEOUT, hcds_config.ADMISSION_DIR, hcds_admission.limiters, hcds_metrics.registry.path )
+		self.dir = tempfile.TemporaryDirectory()
+
+		hcds_config.SINGLEFLIGHT_TIMEOUT = 0.1
+
+		hcds_admission.limiters = {}
+		hcds_config.SINGLEFLIGHT_DIR = self.dir.name + "/singleflight"
+		hcds_config.ADMISSION_DIR = self.dir.name + "/admission"
+		hcds_metrics.registry.path = self.dir.name + "/metrics"
+
+		main.responder_cache[ "failing" ] = FailingResponder( {} )
+
+	def tearDown( self ):
+		del main.responder_cache[ "failing" ]
+
+		hcds_config.SINGLEFLIGHT_DIR, hcds_config.SINGLEFLIGHT_TIMEOUT, hcds_config.ADMISSION_DIR, hcds_admission.limiters, hcds_metrics.registry.path = self.saved
+		self.dir.cleanup()
+
+	def call( self, path, query = "" ):
+		environ = { "PATH_INFO": hcds_config.BASE_PATH + path, "QUERY_STRING": query, "wsgi.input": io.BytesIO() }
+		wsgiref.util.setup_testing_defaults( environ )
+
+		return main.hcds_app( environ, lambda status, headers: None )
+
+	def test_exception( self ):
+		with self.assertRaises( ValueError ):
+			self.call( "failing" )
+
+		# The computation is left, so that identical requests do not wait for it
+		self.assertEqual( main.responder_cache[ "failing" ].flight, None )
+		self.assertEqual( hcds_singleflight.flights, {} )
+
+		other = FailingResponder( {} )
+		other.set_request( {}, None )
+		self.assertFalse( other.check_validators( [ "failing" ] ) )
+		self.assertFalse( other.flight.fd is None )
+		other.clean()
+
+	def test_exception_profile( self ):
+		saved = ( hcds_config.PROFILE_TOKEN, hcds_profile.cProfile.Profile )
+		hcds_config.PROFILE_TOKEN = "secret"
+		hcds_profile.cProfile.Profile = Profile
+
+		try:
+			with self.assertRaises( ValueError ):
+				self.call( "failing", "profile=secret" )
+		finally:
+			hcds_config.PROFILE_TOKEN, hcds_profile.cProfile.Profile = saved
+
+		self.assertEqual( Profile.running, [] )
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,89 @@
+# Unit testing for the hcds_metrics module.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import hcds_metrics
+
+class RegistryTestCase( unittest.TestCase ):
+	def test_counter( self ):
+		registry = hcds_metrics.Registry()
+
+		registry.inc( "hcds_requests_total", module = "coll", route = "grid" )
+		registry.inc( "hcds_requests_total", 2., route = "grid", module = "coll" )
+
+		self.assertIn( "hcds_requests_total{module=\"coll\",route=\"grid\"} 3.0", registry.expose().split( "\n" ) )
+
+	def test_histogram( self ):
+		registry = hcds_metrics.Registry()
+
+		registry.observe( "hcds_request_duration_seconds", 0.02, module = "coll" )
+		registry.observe( "hcds_request_duration_seconds", 20., module = "coll" )
+
+		lines = registry.expose().split( "\n" )
+
+		self.assertIn( "# TYPE hcds_request_duration_seconds histogram", lines )
+		self.assertIn( "hcds_request_duration_seconds_bucket{module=\"coll\",le=\"0.01\"} 0", lines )
+		self.assertIn( "hcds_request_duration_seconds_bucket{module=\"coll\",le=\"0.025\"} 1", lines )
+		self.assertIn( "hcds_request_duration_seconds_bucket{module=\"coll\",le=\"+Inf\"} 2", lines )
+		self.assertIn( "hcds_request_duration_seconds_count{module=\"coll\"} 2", lines )
+
+	def test_hit_ratio( self ):
+		registry = hcds_metrics.Registry()
+
+		registry.set( "hcds_cache_hits_total", 3, cache = "tiles" )
+		registry.set( "hcds_cache_misses_total", 1, cache = "tiles" )
+
+		self.assertIn( "hcds_cache_hit_ratio{cache=\"tiles\"} 0.75", registry.expose().split( "\n" ) )
+
+	def test_workers( self ):
+		with tempfile.TemporaryDirectory() as path:
+			other = hcds_metrics.Registry()
+			other.inc( "hcds_requests_total", 4., module = "coll" )
+			other.observe( "hcds_request_duration_seconds", 0.2, module = "coll" )
+
+			# The parent process is running, while the child has finished
+			child = subprocess.Popen( [ sys.executable, "-c", "pass" ] )
+			child.wait()
+
+			for pid in [ os.getppid(), child.pid ]:
+				with open( os.path.join( path, "{:d}.json".format( pid ) ), "w" ) as f:
+					json.dump( other.dump(), f )
+
+			registry = hcds_metrics.Registry( path )
+			registry.inc( "hcds_requests_total", module = "coll" )
+			registry.observe( "hcds_request_duration_seconds", 0.002, module = "coll" )
+
+			lines = registry.expose().split( "\n" )
+
+			self.assertIn( "hcds_requests_total{module=\"coll\"} 5.0", lines )
+			self.assertIn( "hcds_request_duration_seconds_bucket{module=\"coll\",le=\"0.005\"} 1", lines )
+			self.assertIn( "hcds_request_duration_seconds_bucket{module=\"coll\",le=\"0.25\"} 2", lines )
+			self.assertTrue( os.path.exists( os.path.join( path, "{:d}.json".format( os.getpid() ) ) ) )
+			self.assertFalse( os.path.exists( os.path.join( path, "{:d}.json".format( child.pid ) ) ) )
+
+			# The file of the process is removed when it stops
+			registry.remove()
+			self.assertFalse( os.path.exists( os.path.join( path, "{:d}.json".format( os.getpid() ) ) ) )
+
+if __name__ == '__main__':
+	unittest.main()
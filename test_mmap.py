@@ -0,0 +1,72 @@
+# Unit testing for the hcds_mmap module.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import os
+import tempfile
+
+import numpy
+import tables
+
+import hcds_mmap
+
+class MmapTestCase( unittest.TestCase ):
+	def setUp( self ):
+		self.dir = tempfile.TemporaryDirectory()
+		self.file = os.path.join( self.dir.name, "data.h5" )
+
+		with tables.open_file( self.file, "w" ) as h5file:
+			group = h5file.create_group( h5file.root, "sim_000" )
+			h5file.create_array( group, "time", numpy.linspace( 0., 1., 5 ) )
+			h5file.create_carray( group, "mass", obj = numpy.arange( 5, dtype = numpy.int32 ), filters = tables.Filters( complevel = 5 ) )
+
+	def tearDown( self ):
+		self.dir.cleanup()
+
+	def test_contiguous( self ):
+		with tables.open_file( self.file ) as h5file:
+			self.assertTrue( hcds_mmap.is_contiguous( h5file.root.sim_000.time ) )
+			self.assertFalse( hcds_mmap.is_contiguous( h5file.root.sim_000.mass ) )
+
+			# Compressed datasets can only be mapped from a sidecar export
+			self.assertEqual( hcds_mmap.map_offset( h5file.root.sim_000.mass ), None )
+			self.assertEqual( hcds_mmap.map_sidecar( h5file.root.sim_000.mass ), None )
+
+	def test_export( self ):
+		self.assertEqual( hcds_mmap.export( self.file ), 2 )
+		self.assertTrue( os.path.exists( hcds_mmap.get_sidecar( self.file, "/sim_000/time" ) ) )
+
+		with tables.open_file( self.file ) as h5file:
+			for name, expected in [ ( "time", numpy.linspace( 0., 1., 5 ) ), ( "mass", numpy.arange( 5 ) ) ]:
+				array = hcds_mmap.map_node( getattr( h5file.root.sim_000, name ) )
+
+				self.assertEqual( array.tolist(), expected.tolist() )
+				self.assertFalse( array.flags.writeable )
+
+	def test_stale( self ):
+		hcds_mmap.export( self.file )
+
+		# The data file is newer than its export
+		mtime = os.stat( self.file ).st_mtime
+		os.utime( hcds_mmap.get_sidecar( self.file, "/sim_000/mass" ), ( mtime - 10., mtime - 10. ) )
+
+		with tables.open_file( self.file ) as h5file:
+			self.assertEqual( hcds_mmap.map_sidecar( h5file.root.sim_000.mass ), None )
+			self.assertEqual( hcds_mmap.map_node( h5file.root.sim_000.time ).tolist(), numpy.linspace( 0., 1., 5 ).tolist() )
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,108 @@
+# Unit testing for the hcds_profile module.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import os
+import tempfile
+
+import hcds_compress
+import hcds_config
+import hcds_profile
+import hcds_responder_base
+
+class ProfileTestCase( unittest.TestCase ):
+	def setUp( self ):
+		self.saved = ( hcds_config.PROFILE_TOKEN, hcds_config.PROFILE_RATE, hcds_config.PROFILE_DIR )
+
+		hcds_config.PROFILE_TOKEN = "secret"
+		hcds_config.PROFILE_RATE = 0.
+		hcds_config.PROFILE_DIR = None
+
+	def tearDown( self ):
+		hcds_config.PROFILE_TOKEN, hcds_config.PROFILE_RATE, hcds_config.PROFILE_DIR = self.saved
+
+	def make_responder( self ):
+		resp = hcds_responder_base.BaseResponder( {} )
+		resp.set_request( {}, None )
+		resp.start( "200 OK", [ ( "Content-Type", "application/json" ) ] )
+		resp.add_output( b"[]" )
+
+		return resp
+
+	def test_is_requested( self ):
+		self.assertTrue( hcds_profile.is_requested( {}, "a=1&profile=secret" ) )
+		self.assertTrue( hcds_profile.is_requested( { "HTTP_X_HCDS_PROFILE": "secret" }, "" ) )
+		self.assertFalse( hcds_profile.is_requested( {}, "profile=wrong" ) )
+		self.assertFalse( hcds_profile.is_requested( {}, "" ) )
+
+		hcds_config.PROFILE_TOKEN = None
+
+		self.assertFalse( hcds_profile.is_requested( {}, "profile=secret" ) )
+
+	def test_not_profiled( self ):
+		self.assertEqual( hcds_profile.start( {}, "" ), ( None, False ) )
+
+	def test_report( self ):
+		profiler, requested = hcds_profile.start( {}, "profile=secret" )
+		self.assertTrue( requested )
+
+		resp = self.make_responder()
+		hcds_profile.finish( profiler, requested, resp, "coll", "grid" )
+
+		self.assertIn( ( "Content-Type", "text/plain; charset=utf-8" ), resp.headers )
+		self.assertIn( b"function calls", resp.get_output()[ 0 ] )
+
+	def test_report_validators( self ):
+		profiler, requested = hcds_profile.start( {}, "profile=secret" )
+
+		resp = self.make_responder()
+		resp.set_request( { "HTTP_ACCEPT_ENCODING": "gzip" }, lambda status, headers: None )
+		resp.check_validators( [ "test" ], 0. )
+		resp.start( "200 OK", [ ( "Content-Type", "application/json" ) ] )
+		resp.add_output( b"[]" )
+		hcds_profile.finish( profiler, requested, resp, "coll", "grid" )
+
+		# The report is neither cached by clients nor with the compressed responses
+		headers = dict( resp.headers )
+		self.assertNotIn( "ETag", headers )
+		self.assertNotIn( "Last-Modified", headers )
+		self.assertEqual( headers[ "Cache-Control" ], "no-store" )
+
+		size = len( hcds_compress.cache )
+		resp.finish()
+		self.assertEqual( len( hcds_compress.cache ), size )
+		resp.clean()
+
+	def test_store( self ):
+		with tempfile.TemporaryDirectory() as path:
+			hcds_config.PROFILE_DIR = path
+			hcds_config.PROFILE_RATE = 1.
+
+			profiler, requested = hcds_profile.start( {}, "" )
+			self.assertFalse( requested )
+
+			resp = self.make_responder()
+			hcds_profile.finish( profiler, requested, resp, "coll", "grid" )
+
+			self.assertEqual( resp.get_output(), [ b"[]" ] )
+
+			name = dict( resp.headers )[ "X-HCDS-Profile" ]
+			self.assertTrue( name.endswith( "-coll-grid.pstats" ) )
+			self.assertTrue( os.path.exists( os.path.join( path, name ) ) )
+
+if __name__ == '__main__':
+	unittest.main()
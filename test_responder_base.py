@@ -16,15 +16,39 @@
 
 import unittest
 
+import io
+import os
+import tempfile
+import threading
 import urllib.parse
 
+import hcds_admission
+import hcds_config
+import hcds_exception
 import hcds_responder_base
 
+class HeavyResponder( hcds_responder_base.BaseResponder ):
+	def get_route_class( self ):
+		return "heavy"
+
 class BaseResponderTestCase( unittest.TestCase ):
-	def make_obj( self, config = {}, url = None, sub = None, query = None ):
-		resp = hcds_responder_base.BaseResponder( config )
+	def setUp( self ):
+		self.saved = ( hcds_config.SINGLEFLIGHT_DIR, hcds_config.ADMISSION_DIR, hcds_admission.limiters )
+		self.dir = tempfile.TemporaryDirectory()
+
+		hcds_admission.limiters = {}
+
+		hcds_config.SINGLEFLIGHT_DIR = os.path.join( self.dir.name, "singleflight" )
+		hcds_config.ADMISSION_DIR = os.path.join( self.dir.name, "admission" )
+
+	def tearDown( self ):
+		hcds_config.SINGLEFLIGHT_DIR, hcds_config.ADMISSION_DIR, hcds_admission.limiters = self.saved
+		self.dir.cleanup()
 
-		resp.set_request( {}, None )
+	def make_obj( self, config = {}, url = None, sub = None, query = None, environ = {}, heavy = False ):
+		resp = ( HeavyResponder if heavy else hcds_responder_base.BaseResponder )( config )
+
+		resp.set_request( environ, None )
 
 		if not url is None:
 			resp.set_url( url, sub )
@@ -94,5 +118,168 @@ class BaseResponderTestCase( unittest.TestCase ):
 		self.assertEqual( resp.parse_list_query( "good", allowed ), "one" )
 		self.assertEqual( resp.parse_list_query( "bad", allowed ), None )
 
+	def test_get_body_none( self ):
+		resp = self.make_obj()
+
+		self.assertEqual( resp.get_body(), b"" )
+
+	def test_get_body( self ):
+		resp = self.make_obj( environ = { "CONTENT_LENGTH": "4", "wsgi.input": io.BytesIO( b"data and more" ) } )
+
+		self.assertEqual( resp.get_body(), b"data" )
+
+	def test_get_body_limit( self ):
+		resp = self.make_obj( environ = { "CONTENT_LENGTH": "13", "wsgi.input": io.BytesIO( b"data and more" ) } )
+
+		with self.assertRaises( hcds_exception.PayloadTooLarge ):
+			resp.get_body( 10 )
+
+	def test_timing( self ):
+		resp = self.make_obj()
+
+		resp.add_timing( "phase", 0.5 )
+		with resp.timing( "phase" ):
+			pass
+
+		self.assertEqual( list( resp.get_timings().keys() ), [ "phase" ] )
+		self.assertGreaterEqual( resp.get_timings()[ "phase" ], 0.5 )
+
+	def test_finish( self ):
+		started = []
+
+		resp = hcds_responder_base.BaseResponder( {} )
+		resp.set_request( {}, lambda status, headers: started.append( ( status, headers ) ) )
+
+		resp.start( "200 OK", [ ( "Content-type", "text/plain" ) ] )
+		resp.add_timing( "total", 0.25 )
+
+		self.assertEqual( started, [] )
+
+		resp.finish()
+
+		self.assertEqual( len( started ), 1 )
+		self.assertEqual( started[ 0 ][ 0 ], "200 OK" )
+		self.assertIn( ( "Server-Timing", "total;dur=250.000" ), started[ 0 ][ 1 ] )
+
+	def test_validators( self ):
+		resp = self.make_obj()
+
+		self.assertFalse( resp.check_validators( [ { "a": 1 } ], 1.e9 ) )
+
+		resp.start( "200 OK", [] )
+		headers = dict( resp.headers )
+
+		self.assertIn( "ETag", headers )
+		self.assertEqual( headers[ "Last-Modified" ], "Sun, 09 Sep 2001 01:46:40 GMT" )
+		resp.clean()
+
+		# The tag depends on the parameters and on the time of the last modification
+		other = self.make_obj()
+		other.check_validators( [ { "a": 2 } ], 1.e9 )
+		other.start( "200 OK", [] )
+
+		self.assertNotEqual( dict( other.headers )[ "ETag" ], headers[ "ETag" ] )
+		other.clean()
+
+		other = self.make_obj()
+		other.check_validators( [ { "a": 1 } ], 1.e9 + 1. )
+		other.start( "200 OK", [] )
+
+		self.assertNotEqual( dict( other.headers )[ "ETag" ], headers[ "ETag" ] )
+
+		# Errors do not get validators
+		other.start( "404 Not Found", [] )
+
+		self.assertNotIn( "ETag", dict( other.headers ) )
+		other.clean()
+
+	def test_validators_match( self ):
+		resp = self.make_obj()
+		resp.check_validators( [ "data" ] )
+		resp.start( "200 OK", [] )
+		tag = dict( resp.headers )[ "ETag" ]
+		resp.clean()
+
+		resp = self.make_obj( environ = { "HTTP_IF_NONE_MATCH": "\"other\", W/" + tag } )
+
+		self.assertTrue( resp.check_validators( [ "data" ] ) )
+		self.assertEqual( resp.status, "304 Not Modified" )
+		self.assertEqual( dict( resp.headers )[ "ETag" ], tag )
+
+		resp = self.make_obj( environ = { "HTTP_IF_NONE_MATCH": "\"other\"" } )
+
+		self.assertFalse( resp.check_validators( [ "data" ] ) )
+		resp.clean()
+
+	def test_validators_modified( self ):
+		resp = self.make_obj( environ = { "HTTP_IF_MODIFIED_SINCE": "Sun, 09 Sep 2001 01:46:40 GMT" } )
+
+		self.assertTrue( resp.check_validators( [ "data" ], 1.e9 ) )
+
+		resp = self.make_obj( environ = { "HTTP_IF_MODIFIED_SINCE": "Sun, 09 Sep 2001 01:46:40 GMT" } )
+
+		self.assertFalse( resp.check_validators( [ "data" ], 1.e9 + 1. ) )
+		self.assertFalse( resp.check_validators( [ "data" ] ) )
+		resp.clean()
+
+	def test_shared( self ):
+		resp = self.make_obj( heavy = True )
+		self.assertFalse( resp.check_validators( [ "shared" ] ) )
+
+		# An identical request waits for the first one and gets its response
+		other = self.make_obj( heavy = True )
+		done = []
+		thread = threading.Thread( target = lambda: done.append( other.check_validators( [ "shared" ] ) ) )
+		thread.start()
+
+		resp.start( "200 OK", [ ( "Content-Type", "application/json" ) ] )
+		resp.add_output( b"[1]" )
+		resp.share_result()
+		thread.join()
+
+		self.assertEqual( done, [ True ] )
+		self.assertEqual( other.status, "200 OK" )
+		self.assertEqual( other.get_output(), [ b"[1]" ] )
+		self.assertEqual( dict( other.headers )[ "ETag" ], dict( resp.headers )[ "ETag" ] )
+
+	def test_shared_light( self ):
+		# Light requests are not shared, so they do not use the files of the computations in progress
+		resp = self.make_obj()
+		self.assertFalse( resp.check_validators( [ "shared" ] ) )
+		self.assertEqual( resp.flight, None )
+		self.assertFalse( os.path.exists( hcds_config.SINGLEFLIGHT_DIR ) )
+		resp.clean()
+
+	def test_shared_admission( self ):
+		saved = hcds_config.ADMISSION
+		hcds_config.ADMISSION = { "heavy": { "slots": 1, "queue": 0 } }
+		hcds_config.ADMISSION_DIR = None
+
+		try:
+			resp = self.make_obj( heavy = True )
+			self.assertFalse( resp.check_validators( [ "admission" ] ) )
+
+			# The request that computes the response uses the only slot
+			with self.assertRaises( hcds_exception.ServiceUnavailable ):
+				self.make_obj( heavy = True ).admit()
+
+			# An identical request does not need one
+			other = self.make_obj( heavy = True )
+			done = []
+			thread = threading.Thread( target = lambda: done.append( other.check_validators( [ "admission" ] ) ) )
+			thread.start()
+
+			resp.start( "200 OK", [ ( "Content-Type", "application/json" ) ] )
+			resp.add_output( b"[1]" )
+			resp.share_result()
+			thread.join()
+			resp.release()
+
+			self.assertEqual( done, [ True ] )
+			self.assertEqual( other.admission, None )
+			other.clean()
+		finally:
+			hcds_config.ADMISSION = saved
+
 if __name__ == '__main__':
 	unittest.main()
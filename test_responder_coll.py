@@ -15,6 +15,16 @@
 # limitations under the License.
 
 import unittest
+
+import io
+import json
+import os
+import tempfile
+
+import numpy
+
+import hcds_coll_table
+import hcds_exception
 import hcds_responder_coll
 
 class CollResponderTestCase( unittest.TestCase ):
@@ -180,5 +190,184 @@ class CollResponderTestCase( unittest.TestCase ):
 		self.assertEqual( retp[ "dtar_value" ], 1. )
 		self.assertEqual( retp[ "dtar_unit" ], "cgs" )
 
+	def test_get_types_jsonpoly( self ):
+		resp = self.make_obj( "format=jsonpoly" )
+
+		formats = resp.get_types()
+
+		self.assertEqual( formats[ "ctype" ], "application/json" )
+		self.assertEqual( formats[ "data" ], "poly" )
+		self.assertEqual( formats[ "image" ], None )
+
+	def test_retrieve_models( self ):
+		self.assertEqual( self.make_obj( "model=c2019" ).retrieve_models(), None )
+		self.assertEqual( self.make_obj( "models=merge,c2019&models=ls2012" ).retrieve_models(), [ "merge", "c2019", "ls2012" ] )
+
+		for query in [ "models=merge,other", "models=merge,merge", "models=," ]:
+			with self.assertRaises( hcds_exception.JSONBadRequest ):
+				self.make_obj( query ).retrieve_models()
+
+	def test_retrieve_body_size_dens_memo( self ):
+		resp = self.make_obj( "rtar_type=dens&dtar_value=1&dtar_unit=cgs" )
+
+		mtar = 1. / resp.MASS_MEARTH_MSOL
+
+		radius1, retp = resp.retrieve_body_size( "tar", mtar, "merge" )
+		radius2, retp = resp.retrieve_body_size( "tar", mtar, "merge" )
+
+		self.assertEqual( radius1, radius2 )
+		self.assertEqual( resp.bodies.hits, 1 )
+
+	def test_retrieve_params_impactor_radius( self ):
+		resp = self.make_obj( "model=merge&mtar_value=1&mtar_unit=earth&mimp_value=0.1&mimp_unit=earth&rtar_type=dens&dtar_value=5&dtar_unit=cgs&rimp_type=dens&dimp_value=5&dimp_unit=cgs" )
+
+		values, response = resp.retrieve_params( [ "model", "tar", "imp" ] )
+
+		# The radius of the impactor is computed from its own mass, not the one of the target
+		self.assertAlmostEqual( values[ "rimp" ] / values[ "rtar" ], 0.1 ** ( 1. / 3. ) )
+		self.assertEqual( values[ "imp" ].radius, values[ "rimp" ] )
+
+	def test_body_radius_memo( self ):
+		resp = self.make_obj( "" )
+
+		mass = 1. / resp.MASS_MEARTH_MSOL
+
+		radius1 = resp.body_radius( mass )
+		radius2 = resp.body_radius( mass )
+
+		self.assertEqual( radius1, radius2 )
+		self.assertTrue( radius1 > 0. )
+		self.assertEqual( resp.bodies.hits, 1 )
+
+	def test_compute_map_memo( self ):
+		resp = self.make_obj( "model=c2019&mtar_value=1&mtar_unit=earth&mimp_value=0.1&mimp_unit=earth" )
+		values, response = resp.retrieve_params( [ "model", "tar", "imp" ] )
+
+		x = numpy.linspace( 0., 90., 5 )
+		y = numpy.linspace( 1., 4., 3 )
+
+		result = resp.compute_map( values, response, x, y )
+		other = resp.compute_map( values, response, x, y )
+
+		# All the quantities come from the same evaluations
+		self.assertIs( other, result )
+		self.assertEqual( resp.get_counts(), { "evaluations": 15 } )
+		self.assertEqual( result.regime.dtype, numpy.int8 )
+		self.assertEqual( result.get( "acctr" ).dtype, numpy.float32 )
+		self.assertEqual( result.get( "acctr" ).shape, ( 3, 5 ) )
+
+	def test_tile_cache( self ):
+		resp = self.make_obj( "model=c2019&mtar_value=1&mtar_unit=earth&mimp_value=0.1&mimp_unit=earth&format=npy" )
+		resp.tile( "0/0/0" )
+
+		# The tile is only kept in the cache of the tiles, not in the one of the maps
+		self.assertEqual( len( resp.tiles ), 1 )
+		self.assertEqual( len( resp.maps ), 0 )
+		resp.clean()
+
+	def make_table( self, path, accsr ):
+		axes = {
+			"mass": hcds_coll_table.make_axis( 0.1, 10., 2, True ),
+			"ratio": hcds_coll_table.make_axis( 0.01, 1., 2, True ),
+			"vel": hcds_coll_table.make_axis( 0.99, 4.01, 2, False ),
+			"angle": hcds_coll_table.make_axis( 0., 90., 2, False ),
+		}
+
+		shape = ( 1, 2, 2, 2, 2 )
+		numpy.save( os.path.join( path, "regime.npy" ), numpy.ones( shape, dtype = numpy.int8 ) )
+		numpy.save( os.path.join( path, "acclr.npy" ), numpy.full( shape, 0.25, dtype = numpy.float32 ) )
+		numpy.save( os.path.join( path, "accsr.npy" ), numpy.full( shape, accsr, dtype = numpy.float32 ) )
+		numpy.save( os.path.join( path, "acctr.npy" ), numpy.full( shape, 0.75, dtype = numpy.float32 ) )
+
+		with open( os.path.join( path, "table.json" ), "w" ) as f:
+			json.dump( { "models": [ "c2019" ], "axes": axes, "method": "linear", "error": { "method": "linear" } }, f )
+
+	def single_table( self, accsr ):
+		with tempfile.TemporaryDirectory() as path:
+			self.make_table( path, accsr )
+
+			resp = hcds_responder_coll.CollResponder( { "table": path } )
+			resp.set_request( {}, None )
+			resp.set_query( "model=c2019&mtar_value=1&mtar_unit=earth&mimp_value=0.1&mimp_unit=earth&vel_value=2&vel_unit=escape&angle_value=30" )
+			resp.single()
+
+		return json.loads( b"".join( resp.get_output() ) ), resp.get_counts()
+
+	def test_single_table( self ):
+		res, counts = self.single_table( 0.5 )
+
+		self.assertEqual( res[ "acclr" ], 0.25 )
+		self.assertEqual( res[ "accsr" ], 0.5 )
+		self.assertIn( "table", res )
+		self.assertNotIn( "evaluations", counts )
+
+	def test_single_table_unavailable( self ):
+		# Values that are not available in the table are computed rather than sent as NaN
+		res, counts = self.single_table( numpy.nan )
+
+		self.assertNotIn( "table", res )
+		self.assertTrue( all( [ numpy.isfinite( res[ quant ] ) for quant in [ "acclr", "accsr", "acctr" ] ] ) )
+		self.assertEqual( counts[ "evaluations" ], 1 )
+
+	def test_table_method( self ):
+		with tempfile.TemporaryDirectory() as path:
+			self.make_table( path, 0.5 )
+
+			# The error bounds of the table would not apply to another interpolation
+			with self.assertRaises( ValueError ):
+				hcds_responder_coll.CollResponder( { "table": path, "table_method": "nearest" } )
+
+	def make_bulk( self, body ):
+		resp = hcds_responder_coll.CollResponder( {} )
+		resp.set_request( { "REQUEST_METHOD": "POST", "CONTENT_LENGTH": str( len( body ) ), "wsgi.input": io.BytesIO( body ) }, None )
+		resp.set_query( "" )
+		return resp
+
+	def test_bulk_columns_rows( self ):
+		resp = self.make_bulk( bytes( json.dumps( [ { "mtar_value": 1., "mtar_unit": "kg" }, { "mtar_value": 2. } ] ), "utf-8" ) )
+
+		count, columns = resp.get_bulk_columns()
+
+		self.assertEqual( count, 2 )
+		self.assertEqual( columns[ "mtar_value" ], [ 1., 2. ] )
+		self.assertEqual( columns[ "mtar_unit" ], [ "kg", None ] )
+
+	def test_bulk_columns_broadcast( self ):
+		resp = self.make_bulk( bytes( json.dumps( { "mtar_value": [ 1., 2., 3. ], "mtar_unit": "kg" } ), "utf-8" ) )
+
+		count, columns = resp.get_bulk_columns()
+
+		self.assertEqual( count, 3 )
+		self.assertEqual( columns[ "mtar_unit" ], [ "kg", "kg", "kg" ] )
+
+	def test_bulk_columns_invalid( self ):
+		resp = self.make_bulk( b"not json" )
+
+		with self.assertRaises( hcds_exception.JSONBadRequest ):
+			resp.get_bulk_columns()
+
+	def test_bulk_mass( self ):
+		resp = self.make_bulk( b"" )
+		columns = { "mtar_value": [ 1., -1., 1., "text" ], "mtar_unit": [ "kg", "kg", "pound", "kg" ], "mimp_value": [ 0.5, 0.5, 0.5, 2. ], "mimp_unit": [ "target" ] * 4 }
+
+		mtar = resp.bulk_mass( columns, "tar", 4 )
+		mimp = resp.bulk_mass( columns, "imp", 4, mtar )
+
+		self.assertEqual( mtar[ 0 ], 1. / resp.MASS_KG_MSOL )
+		self.assertTrue( numpy.isnan( mtar[ 1 : ] ).all() )
+		self.assertEqual( mimp[ 0 ], 0.5 / resp.MASS_KG_MSOL )
+		self.assertTrue( numpy.isnan( mimp[ 1 : ] ).all() )
+
+	def test_bulk_size( self ):
+		resp = self.make_bulk( b"" )
+		columns = { "rtar_type": [ "rad", "rad", "e2020", "rad" ], "rtar_value": [ 1., 1., 1., 1. ], "rtar_unit": [ "earth", "venus", "earth", "earth" ] }
+		model = numpy.array( [ "merge", "merge", "merge", "c2019" ] )
+
+		size, e2020 = resp.bulk_size( columns, "tar", 4, numpy.ones( 4 ), model )
+
+		self.assertEqual( size[ 0 ], 1. / resp.DIST_REARTH_AU )
+		self.assertTrue( numpy.isnan( size[ 1 ] ) )
+		self.assertEqual( e2020.tolist(), [ False, False, True, True ] )
+
 if __name__ == '__main__':
 	unittest.main()
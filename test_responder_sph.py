@@ -0,0 +1,229 @@
+# Unit testing for the hcds_responder_sph module.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import json
+import os
+import tempfile
+import urllib.parse
+
+import numpy
+import tables
+import yaml
+
+import hcds_admission
+import hcds_config
+import hcds_exception
+import hcds_materialize
+import hcds_responder_set
+
+class SPHResponderTestCase( unittest.TestCase ):
+	def setUp( self ):
+		self.dir = tempfile.TemporaryDirectory()
+
+		with tables.open_file( os.path.join( self.dir.name, "set.h5" ), "w" ) as h5file:
+			for n in [ 0, 2 ]:
+				group = h5file.create_group( h5file.root, "file_{:03d}".format( n ) )
+				group._v_attrs[ "desc" ] = "Series {:d}".format( n )
+				h5file.create_array( group, "time", numpy.linspace( 0., 3600., 3 ) )
+				h5file.create_array( group, "mass", numpy.full( 3, n + 1. ) )
+				h5file.create_array( group, "radius", numpy.full( 2, 1. ) )
+
+			h5file.create_group( h5file.root, "file_1" )
+
+		self.write_defs( "mass" )
+
+		# Lock files of the requests are kept out of the default directories
+		self.saved = ( hcds_config.SINGLEFLIGHT_DIR, hcds_config.ADMISSION_DIR, hcds_admission.limiters )
+		self.run_dir = tempfile.TemporaryDirectory()
+
+		hcds_admission.limiters = {}
+		hcds_config.SINGLEFLIGHT_DIR = os.path.join( self.run_dir.name, "singleflight" )
+		hcds_config.ADMISSION_DIR = os.path.join( self.run_dir.name, "admission" )
+
+	def tearDown( self ):
+		self.dir.cleanup()
+
+		hcds_config.SINGLEFLIGHT_DIR, hcds_config.ADMISSION_DIR, hcds_admission.limiters = self.saved
+		self.run_dir.cleanup()
+
+	def write_defs( self, data ):
+		defs = {
+			"set": {
+				"file": "set.h5",
+				"desc": "Test set",
+				"fields": [
+					{ "data": "time / 3600", "value": "Time", "unit": "h" },
+					{ "data": data, "value": "Mass", "unit": "Total" },
+				],
+			},
+			"missing": {
+				"file": "missing.h5",
+				"desc": "Missing set",
+				"fields": [],
+			},
+		}
+
+		with open( os.path.join( self.dir.name, "set.yaml" ), "w" ) as f:
+			yaml.dump( defs, f )
+
+	def make_obj( self, sub = None ):
+		resp = hcds_responder_set.SetResponder( { "dir": self.dir.name, "file": "set.yaml" } )
+		resp.set_request( {}, None )
+		resp.set_url( urllib.parse.urlparse( "http://localhost/sph/" + ( sub or "" ) ), sub )
+
+		return resp
+
+	def test_plan( self ):
+		resp = self.make_obj()
+		resp.preload()
+
+		plan = resp.get_plans()[ "set" ]
+		self.assertEqual( plan.errors, [] )
+		self.assertEqual( plan.groups, { "fields": [ "file_000", "file_002" ] } )
+		self.assertEqual( plan.labels[ "file_002" ], "Series 2" )
+		self.assertEqual( plan.datasets[ "file_000" ][ "time" ], ( ( 3, ), numpy.dtype( numpy.float64 ) ) )
+
+		# The file of the other item does not exist
+		self.assertEqual( len( resp.get_plans()[ "missing" ].errors ), 1 )
+
+	def test_errors( self ):
+		for data, message in [ ( "mass +* 2", "unexpected symbol" ), ( "density", "variable `density' does not exist" ), ( "mass / radius", "shape mismatch" ), ( "sqrt( mass )", "function `sqrt' does not exist" ) ]:
+			self.write_defs( data )
+
+			with self.assertLogs( "hcds.sph" ) as cm:
+				self.make_obj().preload()
+
+			self.assertTrue( any( [ message in line for line in cm.output ] ), cm.output )
+
+	def test_reload( self ):
+		resp = self.make_obj( "set" )
+		resp()
+		self.assertEqual( json.loads( b"".join( resp.get_output() ) )[ "series" ][ 1 ][ 0 ], [ 0., 3. ] )
+		resp.clean()
+
+		# The definitions are loaded again once they are modified
+		self.write_defs( "mass * 2" )
+		mtime = os.stat( os.path.join( self.dir.name, "set.yaml" ) ).st_mtime
+		os.utime( os.path.join( self.dir.name, "set.yaml" ), ( mtime + 10., mtime + 10. ) )
+
+		resp.set_request( {}, None )
+		resp.set_url( urllib.parse.urlparse( "http://localhost/sph/set" ), "set" )
+		resp()
+		self.assertEqual( json.loads( b"".join( resp.get_output() ) )[ "series" ][ 1 ][ 0 ], [ 0., 6. ] )
+		resp.clean()
+
+	def get_tag( self, sub ):
+		resp = self.make_obj( sub )
+		resp()
+		tag = dict( resp.headers )[ "ETag" ]
+		resp.clean()
+
+		return tag
+
+	def test_tag( self ):
+		tags = [ self.get_tag( "" ), self.get_tag( "set" ) ]
+
+		# Rewriting the data file or the definitions changes the tags
+		for name, index in [ ( "set.h5", 1 ), ( "set.yaml", 0 ), ( "set.yaml", 1 ) ]:
+			mtime = os.stat( os.path.join( self.dir.name, name ) ).st_mtime
+			os.utime( os.path.join( self.dir.name, name ), ( mtime + 10., mtime + 10. ) )
+
+			tag = self.get_tag( [ "", "set" ][ index ] )
+			self.assertNotEqual( tag, tags[ index ] )
+			tags[ index ] = tag
+
+	def materialize( self, sidecar ):
+		resp = hcds_responder_set.SetResponder( { "dir": self.dir.name, "file": "set.yaml", "mmap": False, "materialized": False } )
+
+		return hcds_materialize.materialize( resp, resp.get_plans()[ "set" ], sidecar )
+
+	def test_materialize( self ):
+		self.assertEqual( self.materialize( False ), 4 )
+
+		# The materialized values are read rather than evaluated, which is checked by modifying them without changing the stamp of the file
+		filename = os.path.join( self.dir.name, "set.h5" )
+		stamp = hcds_materialize.get_stamp( filename )
+		name = hcds_materialize.get_path( "file_002", "mass" )
+		with tables.open_file( filename, "a" ) as h5file:
+			self.assertEqual( h5file.get_node( name )._v_attrs[ "expr" ], "mass" )
+			self.assertEqual( h5file.get_node( name )._v_attrs[ "stamp" ], stamp )
+			h5file.get_node( name )[ : ] = 5.
+		hcds_materialize.set_stamp( filename, stamp )
+
+		resp = self.make_obj( "set" )
+		resp()
+		self.assertEqual( json.loads( b"".join( resp.get_output() ) )[ "series" ][ 1 ][ 0 ], [ 0., 5. ] )
+		self.assertEqual( resp.get_counts()[ "materialized" ], 4 )
+		resp.clean()
+
+		# Values of another expression are not used
+		self.write_defs( "mass * 2" )
+		resp = self.make_obj( "set" )
+		resp()
+		self.assertEqual( json.loads( b"".join( resp.get_output() ) )[ "series" ][ 1 ][ 0 ], [ 0., 6. ] )
+		self.assertEqual( resp.get_counts()[ "materialized" ], 2 )
+		resp.clean()
+
+		# Nor values of a file modified afterwards
+		self.write_defs( "mass" )
+		with tables.open_file( filename, "a" ) as h5file:
+			h5file.get_node( "/file_002/mass" )[ : ] = 7.
+
+		resp = self.make_obj( "set" )
+		resp()
+		self.assertEqual( json.loads( b"".join( resp.get_output() ) )[ "series" ][ 1 ][ 0 ], [ 0., 7. ] )
+		self.assertEqual( resp.get_counts().get( "materialized", 0 ), 0 )
+		resp.clean()
+
+		# Until they are verified, which removes the values whose source datasets changed
+		self.assertEqual( hcds_materialize.verify( filename ), ( 3, 1 ) )
+
+		resp = self.make_obj( "set" )
+		resp()
+		self.assertEqual( json.loads( b"".join( resp.get_output() ) )[ "series" ][ 1 ][ 0 ], [ 0., 7. ] )
+		self.assertEqual( resp.get_counts()[ "materialized" ], 3 )
+		resp.clean()
+
+		# Materializing the fields again keeps the values that are still used
+		self.write_defs( "mass * 2" )
+		self.assertEqual( self.materialize( False ), 4 )
+		self.write_defs( "mass" )
+		resp = self.make_obj( "set" )
+		resp()
+		self.assertEqual( resp.get_counts()[ "materialized" ], 3 )
+		resp.clean()
+
+	def test_materialize_sidecar( self ):
+		mtime = os.stat( os.path.join( self.dir.name, "set.h5" ) ).st_mtime
+		self.assertEqual( self.materialize( True ), 4 )
+
+		resp = self.make_obj()
+		self.assertEqual( resp.get_plans()[ "set" ].materialized[ "file_000" ][ hcds_materialize.get_name( "mass" ) ], "sidecar" )
+
+		# The sidecar files are ignored once the HDF5 file is more recent
+		os.utime( os.path.join( self.dir.name, "set.h5" ), ( mtime + 10., mtime + 10. ) )
+		self.assertEqual( resp.get_plans()[ "set" ].materialized[ "file_000" ], {} )
+
+	def test_not_found( self ):
+		resp = self.make_obj( "none" )
+
+		with self.assertRaises( hcds_exception.NotFound ):
+			resp()
+
+if __name__ == '__main__':
+	unittest.main()
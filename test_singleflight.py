@@ -0,0 +1,136 @@
+# Unit testing for the hcds_singleflight module.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import os
+import tempfile
+import threading
+import time
+
+import hcds_config
+import hcds_singleflight
+
+class SingleFlightTestCase( unittest.TestCase ):
+	def setUp( self ):
+		self.saved = ( hcds_config.SINGLEFLIGHT, hcds_config.SINGLEFLIGHT_DIR, hcds_config.SINGLEFLIGHT_TIMEOUT )
+		self.dir = tempfile.TemporaryDirectory()
+
+		hcds_config.SINGLEFLIGHT = True
+		hcds_config.SINGLEFLIGHT_DIR = self.dir.name
+		hcds_config.SINGLEFLIGHT_TIMEOUT = 5.
+
+	def tearDown( self ):
+		hcds_config.SINGLEFLIGHT, hcds_config.SINGLEFLIGHT_DIR, hcds_config.SINGLEFLIGHT_TIMEOUT = self.saved
+		self.dir.cleanup()
+
+	def follow( self, key, results ):
+		results.append( hcds_singleflight.join( key ) )
+
+	def test_local( self ):
+		result, flight = hcds_singleflight.join( "key" )
+		self.assertEqual( result, None )
+
+		results = []
+		thread = threading.Thread( target = self.follow, args = ( "key", results ) )
+		thread.start()
+
+		# A different key does not wait
+		result, other = hcds_singleflight.join( "other" )
+		self.assertEqual( result, None )
+		hcds_singleflight.leave( other, None )
+
+		hcds_singleflight.leave( flight, ( "200 OK", [], b"data" ) )
+		thread.join()
+
+		self.assertEqual( results, [ ( ( "200 OK", [], b"data" ), None ) ] )
+
+		# Once finished, the next request computes its own result
+		result, flight = hcds_singleflight.join( "key" )
+		self.assertEqual( result, None )
+		hcds_singleflight.leave( flight, None )
+
+	def test_failed( self ):
+		result, flight = hcds_singleflight.join( "key" )
+
+		results = []
+		thread = threading.Thread( target = self.follow, args = ( "key", results ) )
+		thread.start()
+
+		hcds_singleflight.leave( flight, None )
+		thread.join()
+
+		self.assertEqual( results, [ ( None, None ) ] )
+
+	def test_file( self ):
+		result, flight = hcds_singleflight.join( "key" )
+		self.assertEqual( result, None )
+
+		# Simulate another worker, which does not share the in-process state
+		fd = hcds_singleflight.lock_file( "key", 0.05 )
+		self.assertEqual( fd, None )
+
+		hcds_singleflight.leave( flight, None )
+
+		# This request waits for the other worker, and gets its result
+		fd = hcds_singleflight.lock_file( "key", 0.05 )
+
+		results = []
+		thread = threading.Thread( target = self.follow, args = ( "key", results ) )
+		thread.start()
+
+		while not "key" in hcds_singleflight.flights:
+			time.sleep( 0.01 )
+		time.sleep( 0.05 )
+
+		hcds_singleflight.write_result( "key", ( "200 OK", [ ( "Content-Type", "text/plain" ) ], b"line\ndata" ) )
+		os.close( fd )
+		thread.join()
+
+		self.assertEqual( results, [ ( ( "200 OK", [ ( "Content-Type", "text/plain" ) ], b"line\ndata" ), None ) ] )
+
+		# A result that is not awaited is not used
+		result, flight = hcds_singleflight.join( "key" )
+		self.assertEqual( result, None )
+		hcds_singleflight.leave( flight, None )
+
+	def test_sweep( self ):
+		hcds_singleflight.write_result( "old", ( "200 OK", [], b"" ) )
+		hcds_singleflight.write_result( "new", ( "200 OK", [], b"" ) )
+		fd = hcds_singleflight.lock_file( "old", 0. )
+		os.close( fd )
+		fd = hcds_singleflight.lock_file( "used", 0. )
+
+		past = time.time() - 1000.
+		for key, ext in [ ( "old", ".result" ), ( "old", ".lock" ), ( "used", ".lock" ) ]:
+			os.utime( hcds_singleflight.get_file( key, ext ), ( past, past ) )
+
+		hcds_singleflight.sweep( True )
+
+		# Only the files that expired and that are not locked are removed
+		self.assertFalse( os.path.exists( hcds_singleflight.get_file( "old", ".result" ) ) )
+		self.assertFalse( os.path.exists( hcds_singleflight.get_file( "old", ".lock" ) ) )
+		self.assertTrue( os.path.exists( hcds_singleflight.get_file( "new", ".result" ) ) )
+		self.assertTrue( os.path.exists( hcds_singleflight.get_file( "used", ".lock" ) ) )
+		os.close( fd )
+
+	def test_disabled( self ):
+		hcds_config.SINGLEFLIGHT_DIR = None
+
+		self.assertEqual( hcds_singleflight.join( "key" ), ( None, None ) )
+
+if __name__ == '__main__':
+	unittest.main()